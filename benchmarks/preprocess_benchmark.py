@@ -0,0 +1,120 @@
+"""Micro-benchmark of the PIL letterbox preprocessing against LetterboxPreprocessor."""
+import sys
+import pathlib
+
+sys.path.append(f"{pathlib.Path(__file__).absolute().parent.parent.resolve()}/common")
+
+import os
+import time
+import cv2
+import numpy as np
+from PIL import Image
+
+from frame_processor import FrameProcessor, preprocess
+from inference_engine import InferenceEngine
+from preprocessor import LetterboxPreprocessor
+
+
+def read_frames(video_path: str, count: int, frame_size: tuple) -> list:
+    """
+    Read frames from the sample video.
+
+    @param
+        video_path (str): Path to the video
+        count (int): Number of frames to read
+        frame_size (tuple): Frame size (width, height), as sent to the queue
+    @return
+        frames (list): Frames
+    """
+    vid = cv2.VideoCapture(video_path)
+    frames = []
+    while len(frames) < count:
+        result, frame = vid.read()
+        if not result:
+            vid.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            continue
+        frames.append(cv2.resize(frame, frame_size))
+    vid.release()
+    return frames
+
+
+def time_per_frame(function, frames: list, repeat: int) -> float:
+    """
+    Measure the average time per frame of a preprocessing function.
+
+    @param
+        function (Callable): Preprocessing function taking a frame
+        frames (list): Frames
+        repeat (int): Number of passes over the frames
+    @return
+        seconds (float): Average seconds per frame
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for frame in frames:
+            function(frame)
+    return (time.perf_counter() - start) / (repeat * len(frames))
+
+
+def compare_detections(frames: list, preprocessor: LetterboxPreprocessor) -> None:
+    """
+    Compare the detections of both preprocessing paths, when the model is available.
+
+    @param
+        frames (list): Frames
+        preprocessor (LetterboxPreprocessor): Preprocessor to compare with the PIL path
+    """
+    processor = FrameProcessor()
+    if not os.path.isfile(processor.model_path):
+        print(f"Skipping detection comparison, model not found at {processor.model_path}")
+        return
+    engine = InferenceEngine(processor.model_path, processor.input_names, processor.output_names)
+    mismatched, max_box_difference = 0, 0.0
+    for frame in frames:
+        image_shape = np.array([frame.shape[:2]], dtype=np.float32)
+        preprocessor.preprocess(frame)
+        detections = []
+        for image_data in (preprocess(Image.fromarray(frame)), preprocessor.batch(1)):
+            boxes, _, indices = engine.run(image_data, image_shape)
+            selected = indices[0]
+            selected_boxes = boxes[selected[:, 0], selected[:, 2]]
+            # order by class, then by box position, so both paths line up
+            order = np.lexsort((selected_boxes[:, 1], selected_boxes[:, 0], selected[:, 1]))
+            detections.append((selected[order, 1], selected_boxes[order]))
+        (pil_classes, pil_boxes), (numpy_classes, numpy_boxes) = detections
+        if not np.array_equal(pil_classes, numpy_classes):
+            mismatched += 1
+        elif len(pil_boxes):
+            max_box_difference = max(max_box_difference, float(np.abs(pil_boxes - numpy_boxes).max()))
+    print(f"Frames with different detected classes: {mismatched}/{len(frames)}")
+    print(f"Max box coordinate difference: {max_box_difference:.2f} px")
+
+
+def main() -> None:
+    frames = read_frames(
+        f"{pathlib.Path(__file__).absolute().parent.parent.resolve()}/common/slow_traffic_small.mp4",
+        count=50,
+        frame_size=(640, 480),
+    )
+    pil_time = time_per_frame(lambda frame: preprocess(Image.fromarray(frame)), frames, 5)
+    print(f"PIL letterbox: {pil_time * 1000:.3f} ms/frame")
+
+    for name, interpolation in (("INTER_LINEAR", cv2.INTER_LINEAR), ("INTER_AREA", cv2.INTER_AREA)):
+        preprocessor = LetterboxPreprocessor((416, 416), interpolation=interpolation)
+        numpy_time = time_per_frame(lambda frame: preprocessor.preprocess(frame), frames, 5)
+        differences = [
+            np.abs(preprocess(Image.fromarray(frame))[0] - preprocessor.preprocess(frame))
+            for frame in frames
+        ]
+        print(
+            f"LetterboxPreprocessor {name}: {numpy_time * 1000:.3f} ms/frame, "
+            f"speedup {pil_time / numpy_time:.1f}x, "
+            f"max difference {max(d.max() for d in differences):.4f}, "
+            f"mean difference {np.mean([d.mean() for d in differences]):.4f}"
+        )
+
+    compare_detections(frames, LetterboxPreprocessor((416, 416)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""This module is used to send socket messages from a background thread, off the frame pipeline."""
+import collections
+import itertools
+import logging
+import random
+import threading
+from typing import Any, Callable, Hashable, Optional
+
+from frame_protocol import HEADER, is_binary_message
+
+
+def coalescing_key(message: Any) -> Optional[Hashable]:
+    """
+    Get the key under which a newer message replaces a pending one.
+
+    @param
+        message (Any): Message to send
+    @return
+        key (Hashable): (message type, camera id, tier) of a binary frame protocol message,
+            None for a message that is never replaced
+    """
+    if is_binary_message(message):
+        _, _, message_type, camera_id, tier = HEADER.unpack_from(message)[:5]
+        return message_type, camera_id, tier
+    return None
+
+
+def backoff_delay(attempt: int, base: float, maximum: float, jitter: float = 0.5) -> float:
+    """
+    Get the delay before a reconnection attempt, exponential with random jitter so that
+    clients disconnected together do not reconnect together.
+
+    @param
+        attempt (int): Failed attempts so far, 0 for the first reconnection
+        base (float): Delay of the first attempt in seconds
+        maximum (float): Highest delay in seconds, before jitter
+        jitter (float): Share of the delay randomly removed, 0 to 1
+    @return
+        delay (float): Seconds to wait
+    """
+    delay = min(maximum, base * 2 ** attempt)
+    return delay * (1 - jitter * random.random())
+
+
+class SenderStats:
+    """
+    Snapshot of the sender counters.
+    """
+
+    def __init__(self, queued: int, coalesced: int, dropped: int, sent: int, failed: int, pending: int) -> None:
+        """
+        Initialize the sender stats.
+
+        @param
+            queued (int): Messages accepted by send
+            coalesced (int): Pending messages replaced by a newer one with the same key
+            dropped (int): Pending messages discarded to make room, the buffer being full
+            sent (int): Messages written to the socket
+            failed (int): Messages the socket failed to write
+            pending (int): Messages currently waiting
+        """
+        self.queued = queued
+        self.coalesced = coalesced
+        self.dropped = dropped
+        self.sent = sent
+        self.failed = failed
+        self.pending = pending
+
+    def __str__(self) -> str:
+        return (
+            f"queued={self.queued} sent={self.sent} coalesced={self.coalesced} "
+            f"dropped={self.dropped} failed={self.failed} pending={self.pending}"
+        )
+
+
+class BackgroundSender:
+    """
+    Bounded buffer of outgoing messages, written to the socket by a sender thread.
+
+    Putting a message never blocks: a pending message with the same coalescing key is
+    replaced by the newer one, and when the buffer is full the oldest message is dropped.
+    Messages wait in the buffer while the socket is disconnected, so only the latest
+    frame of each camera tier is sent once it reconnects.
+    """
+
+    def __init__(
+        self,
+        write: Callable[[Any, int], None],
+        name: str,
+        max_pending: int = 4,
+        on_failure: Optional[Callable[[Exception], None]] = None,
+    ) -> None:
+        """
+        Initialize the background sender.
+
+        @param
+            write (Callable[[Any, int], None]): Writes a message with its opcode to the socket,
+                raises on failure
+            name (str): Name of the sender thread
+            max_pending (int): Max messages waiting to be sent
+            on_failure (Callable[[Exception], None]): Called from the sender thread when a
+                write fails, e.g. to reconnect
+        """
+        self.write = write
+        self.max_pending = max_pending
+        self.on_failure = on_failure
+        self.logger = logging.getLogger(BackgroundSender.__name__)
+        self._pending = collections.OrderedDict()
+        # keys of the messages that are never coalesced
+        self._unique_keys = itertools.count()
+        self._condition = threading.Condition()
+        self._is_connected = False
+        self.queued_count = 0
+        self.coalesced_count = 0
+        self.dropped_count = 0
+        self.sent_count = 0
+        self.failed_count = 0
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def put(self, message: Any, opcode: int) -> bool:
+        """
+        Queue a message for the sender thread, never blocks.
+
+        @param
+            message (Any): Message to send
+            opcode (int): Opcode of the message
+        @return
+            result (bool): True, the message is queued
+        """
+        key = coalescing_key(message)
+        if key is None:
+            key = ("unique", next(self._unique_keys))
+        with self._condition:
+            self.queued_count += 1
+            if key in self._pending:
+                # keep the position of the stale message, so every key gets its turn
+                self.coalesced_count += 1
+            elif len(self._pending) >= self.max_pending:
+                self._pending.popitem(last=False)
+                self.dropped_count += 1
+            self._pending[key] = (message, opcode)
+            self._condition.notify()
+        return True
+
+    def set_connected(self, is_connected: bool) -> None:
+        """
+        Pause or resume sending, e.g. from the open and close callbacks of the socket.
+
+        @param
+            is_connected (bool): True when the socket can be written
+        """
+        with self._condition:
+            self._is_connected = is_connected
+            self._condition.notify()
+
+    def _run(self) -> None:
+        """
+        Send the pending messages, oldest key first, while connected (internal).
+        """
+        while True:
+            with self._condition:
+                while not (self._is_connected and self._pending):
+                    self._condition.wait()
+                _, (message, opcode) = self._pending.popitem(last=False)
+            try:
+                self.write(message, opcode)
+                self.sent_count += 1
+            except Exception as e:
+                self.failed_count += 1
+                self.logger.warning(f"FAILED sending message in {self.thread.name}, Exception: {e}")
+                self.set_connected(False)
+                if self.on_failure is not None:
+                    self.on_failure(e)
+
+    def stats(self) -> SenderStats:
+        """
+        Get the sender counters.
+
+        @return
+            stats (SenderStats): Counters
+        """
+        with self._condition:
+            return SenderStats(
+                self.queued_count,
+                self.coalesced_count,
+                self.dropped_count,
+                self.sent_count,
+                self.failed_count,
+                len(self._pending),
+            )
@@ -0,0 +1,214 @@
+"""This module is used to fan out messages to websocket clients, framing each message once."""
+import collections
+import logging
+import struct
+import time
+from typing import Callable, Dict, List, Optional
+
+from tornado import ioloop
+from tornado.iostream import StreamClosedError
+from tornado.websocket import WebSocketClosedError
+
+from frame_protocol import is_compressible
+from websocket_internals import is_compressing, write_frame
+
+# Websocket opcodes
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+FIN = 0x80
+
+
+def frame_message(opcode: int, payload: bytes) -> bytes:
+    """
+    Build an unmasked, uncompressed websocket frame, as sent by a server.
+
+    @param
+        opcode (int): OPCODE_TEXT or OPCODE_BINARY
+        payload (bytes): Message
+    @return
+        frame (bytes): Websocket frame
+    """
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", FIN | opcode, length)
+    elif length <= 0xFFFF:
+        header = struct.pack("!BBH", FIN | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", FIN | opcode, 127, length)
+    return header + payload
+
+
+class PreparedMessage:
+    """
+    Message serialized once for all the subscribers, framed on first use.
+    """
+
+    def __init__(self, message, binary: bool) -> None:
+        self.payload = message if isinstance(message, bytes) else message.encode("utf-8")
+        self.binary = binary
+        self.is_compressible = is_compressible(message)
+        self.published_at = time.monotonic()
+        self._frame = None
+
+    @property
+    def frame(self) -> bytes:
+        if self._frame is None:
+            self._frame = frame_message(OPCODE_BINARY if self.binary else OPCODE_TEXT, self.payload)
+        return self._frame
+
+
+class ClientChannel:
+    """
+    Bounded queue of one subscriber, the oldest message is dropped when the client lags.
+    """
+
+    def __init__(self, handler, max_pending: int) -> None:
+        """
+        Initialize the client channel.
+
+        @param
+            handler (FrameHandler): Websocket handler of the client
+            max_pending (int): Max messages waiting for the client
+        """
+        self.handler = handler
+        self.pending = collections.deque(maxlen=max_pending)
+        self.is_sending = False
+        self.sent_count = 0
+        self.dropped_count = 0
+        # seconds between publishing a message and finishing writing it to the client
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "client": id(self.handler),
+            "sent": self.sent_count,
+            "dropped": self.dropped_count,
+            "pending": len(self.pending),
+            "last_lag": self.last_lag,
+            "max_lag": self.max_lag,
+        }
+
+
+class Broadcaster:
+    """
+    Fan out messages to the subscribers of a channel.
+
+    Each message is serialized and framed once and the same bytes are written to every
+    subscriber, except for compressible messages to clients that negotiated compression,
+    which go through their own compressor. Every subscriber drains its own small queue, so
+    a slow client only drops its own frames and never delays the others.
+    """
+
+    def __init__(
+        self, max_pending: int = 2, on_subscribers_changed: Optional[Callable[[], None]] = None
+    ) -> None:
+        """
+        Initialize the broadcaster.
+
+        @param
+            max_pending (int): Max messages waiting per subscriber, latest messages win
+            on_subscribers_changed (Callable[[], None]): Called when a subscriber is added or removed
+        """
+        self.max_pending = max_pending
+        self.on_subscribers_changed = on_subscribers_changed
+        self.channels: Dict[object, ClientChannel] = {}
+        self.logger = logging.getLogger(Broadcaster.__name__)
+
+    def subscribe(self, handler) -> None:
+        """
+        Add a subscriber.
+
+        @param
+            handler (FrameHandler): Websocket handler of the client
+        """
+        if handler not in self.channels:
+            self.channels[handler] = ClientChannel(handler, self.max_pending)
+            self._subscribers_changed()
+
+    def unsubscribe(self, handler) -> None:
+        """
+        Remove a subscriber.
+
+        @param
+            handler (FrameHandler): Websocket handler of the client
+        """
+        if self.channels.pop(handler, None) is not None:
+            self._subscribers_changed()
+
+    def _subscribers_changed(self) -> None:
+        """
+        Notify a change of the subscribers (internal).
+        """
+        if self.on_subscribers_changed is not None:
+            self.on_subscribers_changed()
+
+    def subscriber_count(self) -> int:
+        return len(self.channels)
+
+    def publish(self, message, binary: bool) -> None:
+        """
+        Queue a message for every subscriber, must be called on the IOLoop.
+
+        @param
+            message (bytes | str): Message
+            binary (bool): True to send a binary message
+        """
+        if not self.channels:
+            return
+        prepared = PreparedMessage(message, binary)
+        for channel in list(self.channels.values()):
+            if len(channel.pending) == channel.pending.maxlen:
+                channel.dropped_count += 1
+            channel.pending.append(prepared)
+            if not channel.is_sending:
+                channel.is_sending = True
+                ioloop.IOLoop.current().spawn_callback(self._drain, channel)
+
+    async def _drain(self, channel: ClientChannel) -> None:
+        """
+        Write the queued messages of a subscriber, one at a time (internal).
+
+        @param
+            channel (ClientChannel): Channel of the subscriber
+        """
+        try:
+            while channel.pending and channel.handler in self.channels:
+                prepared = channel.pending.popleft()
+                await self._write(channel.handler, prepared)
+                channel.sent_count += 1
+                channel.last_lag = time.monotonic() - prepared.published_at
+                channel.max_lag = max(channel.max_lag, channel.last_lag)
+        except Exception as ex:
+            if not isinstance(ex, (StreamClosedError, WebSocketClosedError)):
+                self.logger.exception(ex)
+            self.unsubscribe(channel.handler)
+        finally:
+            channel.is_sending = False
+
+    async def _write(self, handler, prepared: PreparedMessage) -> None:
+        """
+        Write a message to a subscriber (internal).
+
+        @param
+            handler (FrameHandler): Websocket handler of the client
+            prepared (PreparedMessage): Message
+        """
+        connection = handler.ws_connection
+        if connection is None:
+            raise StreamClosedError()
+        if prepared.is_compressible and is_compressing(connection):
+            await handler.send_message(prepared.payload, binary=prepared.binary)
+            return
+        handler.count_uncompressed(prepared.payload)
+        # the shared frame bypasses tornado framing, as it is the same for every client
+        await write_frame(handler, prepared.frame, prepared.payload, prepared.binary)
+
+    def stats(self) -> List[dict]:
+        """
+        Get the metrics of every subscriber.
+
+        @return
+            stats (List[dict]): Metrics per subscriber
+        """
+        return [channel.to_dict() for channel in self.channels.values()]
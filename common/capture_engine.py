@@ -0,0 +1,227 @@
+"""This module is used to capture frames from a video source on a dedicated thread."""
+import logging
+import os
+import re
+import threading
+import time
+from typing import Callable, List, Optional
+
+import cv2
+import numpy as np
+
+from frame_pool import FramePool
+from rate_controller import RateController
+
+
+# Scheme of the local test source, e.g. synthetic://640x480@30
+SYNTHETIC_SCHEME = "synthetic://"
+
+
+class SyntheticCapture:
+    """
+    Local test source generating frames of a moving box, with the VideoCapture methods used.
+    """
+
+    def __init__(self, source: str) -> None:
+        """
+        Initialize the synthetic source.
+
+        @param
+            source (str): synthetic://<width>x<height>@<fps>, every part optional
+        """
+        match = re.match(r"(?:(\d+)x(\d+))?(?:@(\d+(?:\.\d+)?))?$", source[len(SYNTHETIC_SCHEME):])
+        if match is None:
+            raise ValueError(f"Invalid synthetic source {source}")
+        width, height, fps = match.groups()
+        self.width = int(width or 640)
+        self.height = int(height or 480)
+        self.fps = float(fps or 30)
+        self.frame_index = 0
+        self.is_opened = True
+
+    def isOpened(self) -> bool:
+        return self.is_opened
+
+    def get(self, prop: int) -> float:
+        return {
+            cv2.CAP_PROP_FPS: self.fps,
+            cv2.CAP_PROP_FRAME_WIDTH: self.width,
+            cv2.CAP_PROP_FRAME_HEIGHT: self.height,
+        }.get(prop, 0.0)
+
+    def set(self, prop: int, value: float) -> bool:
+        return False
+
+    def grab(self) -> bool:
+        self.frame_index += 1
+        return self.is_opened
+
+    def retrieve(self, image: Optional[np.ndarray] = None) -> tuple:
+        if image is None or image.shape != (self.height, self.width, 3):
+            image = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        image.fill(64)
+        size = min(self.width, self.height) // 4
+        left = self.frame_index * 4 % max(1, self.width - size)
+        top = (self.height - size) // 2
+        image[top:top + size, left:left + size] = (0, 200, 255)
+        return True, image
+
+    def release(self) -> None:
+        self.is_opened = False
+
+
+def open_video_source(source: str):
+    """
+    Open a video source.
+
+    @param
+        source (str): File path, stream URL, device or synthetic:// source
+    @return
+        vid (cv2.VideoCapture | SyntheticCapture): Video source
+    """
+    if isinstance(source, str) and source.startswith(SYNTHETIC_SCHEME):
+        return SyntheticCapture(source)
+    return cv2.VideoCapture(source)
+
+
+class CaptureEngine:
+    """
+    Read a video source at its own frame rate and hand the frames consumers need to a callback.
+
+    Every frame is grabbed to keep pace with the source, but it is only decoded with
+    retrieve() when at least one gate is due. Pacing follows a monotonic schedule, so a slow
+    grab is absorbed by the next sleep instead of delaying every following frame.
+    """
+
+    def __init__(
+        self,
+        source: str,
+        on_frame: Callable[[np.ndarray], None],
+        gates: List[RateController],
+        default_fps: float = 30,
+        frame_pool: Optional[FramePool] = None,
+        name: str = "CaptureEngine",
+    ) -> None:
+        """
+        Initialize the capture engine.
+
+        @param
+            source (str): File path, stream URL (e.g. rtsp://), device or synthetic:// source
+            on_frame (Callable[[np.ndarray], None]): Callback receiving every decoded frame,
+                called on the capture thread
+            gates (List[RateController]): Rates of the consumers, a frame is decoded when any
+                of them is due
+            default_fps (float): Rate used when the source does not report its own
+            frame_pool (FramePool): Pool frames are decoded into, None to allocate them
+            name (str): Name of the capture thread
+        """
+        self.source = source
+        # files are rewound when they end, streams are reopened
+        self.is_file = isinstance(source, str) and os.path.isfile(source)
+        self.on_frame = on_frame
+        self.gates = gates
+        self.name = name
+        self.default_fps = default_fps
+        self.fps = default_fps
+        self.frame_pool = frame_pool
+        # shape of the decoded frames, known after the first one
+        self.frame_shape = None
+        self.vid = None
+        self.thread = None
+        self.is_running = False
+        self.reconnect_delay = 1.0
+        self.grabbed_count = 0
+        self.retrieved_count = 0
+        # ticks the capture thread fell more than a frame behind the schedule
+        self.late_count = 0
+        self.logger = logging.getLogger(CaptureEngine.__name__)
+
+    def _open(self) -> Optional[cv2.VideoCapture]:
+        """
+        Open the video source and read its frame rate (internal).
+
+        @return
+            vid (cv2.VideoCapture): Opened source, None if it could not be opened
+        """
+        try:
+            vid = open_video_source(self.source)
+        except Exception as ex:
+            self.logger.exception(ex)
+            self.logger.error(f"Error opening video stream {ex}")
+            return None
+        if not vid.isOpened():
+            self.logger.error(f"Could not open video source {self.source}")
+            return None
+        source_fps = vid.get(cv2.CAP_PROP_FPS)
+        # some sources report 0 or absurd rates
+        self.fps = source_fps if 0 < source_fps <= 240 else self.default_fps
+        self.logger.info(f"Opened video source {self.source} at {self.fps} fps")
+        return vid
+
+    def start(self) -> None:
+        """
+        Start the capture thread.
+        """
+        self.vid = self._open()
+        self.is_running = True
+        self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the capture thread and release the source.
+        """
+        self.is_running = False
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+        if self.vid is not None:
+            self.vid.release()
+
+    def _run(self) -> None:
+        """
+        Capture loop (internal).
+        """
+        next_tick = time.monotonic()
+        while self.is_running:
+            if self.vid is None or not self.vid.isOpened():
+                self.logger.error("Could not open video device, reconnecting to camera")
+                time.sleep(self.reconnect_delay)
+                self.vid = self._open()
+                next_tick = time.monotonic()
+                continue
+
+            interval = 1 / self.fps
+            now = time.monotonic()
+            if next_tick > now:
+                time.sleep(next_tick - now)
+            elif now - next_tick > interval:
+                # fell behind, resume the schedule from now instead of bursting to catch up
+                self.late_count += 1
+                next_tick = now
+            next_tick += interval
+
+            if not self.vid.grab():
+                if self.is_file:
+                    # restart video on completion
+                    self.vid.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                else:
+                    self.vid.release()
+                continue
+            self.grabbed_count += 1
+            now = time.monotonic()
+            if not any(gate.due(now) for gate in self.gates):
+                continue
+            if self.frame_pool is not None and self.frame_shape is not None:
+                is_retrieved, frame = self.vid.retrieve(image=self.frame_pool.acquire(self.frame_shape))
+            else:
+                is_retrieved, frame = self.vid.retrieve()
+            if not is_retrieved or frame is None:
+                continue
+            # decoding reallocates when the source changes resolution
+            self.frame_shape = frame.shape
+            self.retrieved_count += 1
+            try:
+                self.on_frame(frame)
+            except Exception as ex:
+                self.logger.exception(ex)
+                self.logger.error(f"Error handling captured frame {ex}")
@@ -0,0 +1,68 @@
+"""This module is used to publish the detections of the FrameProcessor results to the UI."""
+import logging
+import socket
+from typing import Optional
+
+import numpy as np
+
+from detections import encode_detections_message
+from frame_protocol import UNIX_SOCKET_PATH
+from socket_client import ConnectionManager
+from unix_socket_client import UnixSocketClient
+
+
+class DetectionPublisher:
+    """
+    Send the detections of every result to the server, which forwards them to the UI
+    clients of the camera to overlay on its frames.
+
+    Uses the same transport as the FrameProvider, see FrameProvider.ui_socket_path. The
+    connection is not bound to a camera, so it never receives subscriber counts.
+    """
+
+    def __init__(self) -> None:
+        # local server socket, None to use ws_url, e.g. for a remote server
+        self.socket_path = UNIX_SOCKET_PATH if hasattr(socket, "AF_UNIX") else None
+        self.ws_url = "ws://localhost:7001/ws/frame_internal"
+        self.client = None
+        self.logger = logging.getLogger(DetectionPublisher.__name__)
+
+    def _connect(self):
+        """
+        Connect to the server, on first use (internal).
+
+        @return
+            client (UnixSocketClient | SocketClient): Connected client
+        """
+        if self.socket_path is not None:
+            client = UnixSocketClient(self.socket_path, camera_id=None)
+            client.start()
+            return client
+        manager = ConnectionManager.default()
+        client = manager.get_client(self.ws_url)
+        manager.start()
+        return client
+
+    def publish(self, result, tracks: Optional[np.ndarray] = None) -> bool:
+        """
+        Send the detections of a result, never blocks.
+
+        @param
+            result (FrameProcessingResult): Result of the frame processing
+            tracks (np.ndarray): tracker.TRACK_DTYPE array of the frame to send instead of
+                the detections, None to send the detections
+        @return
+            result (bool): True if the detections are queued for sending
+        """
+        if self.client is None:
+            self.client = self._connect()
+        return self.client.send_binary(
+            encode_detections_message(
+                result.camera_id,
+                result.correlation_id,
+                result.detections if tracks is None else tracks,
+                result.frame_size,
+                sequence=result.sequence,
+                captured_at=result.captured_at,
+            )
+        )
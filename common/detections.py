@@ -0,0 +1,109 @@
+"""This module is used to turn model outputs into detection arrays and detection messages."""
+import json
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from frame_protocol import MESSAGE_DETECTIONS, encode_message
+
+# One detection: box (y1, x1, y2, x2) in pixels of the inferred frame, score, class id and
+# the sequence of the frame it was detected in
+DETECTION_DTYPE = np.dtype(
+    [
+        ("box", np.float32, (4,)),
+        ("score", np.float32),
+        ("class_id", np.int32),
+        ("correlation", np.int64),
+    ]
+)
+
+
+def select_detections(
+    boxes: np.ndarray,
+    scores: np.ndarray,
+    indices: np.ndarray,
+    correlations: Sequence[int],
+    min_score: float = 0.0,
+    class_ids: Optional[Sequence[int]] = None,
+) -> List[np.ndarray]:
+    """
+    Gather the boxes selected by the NMS of the model into one detection array per frame.
+
+    @param
+        boxes (np.ndarray): Boxes (batch, box, 4) output by the model
+        scores (np.ndarray): Scores (batch, class, box) output by the model
+        indices (np.ndarray): Selected (batch index, class id, box index) output by the model
+        correlations (Sequence[int]): Sequence of every frame of the batch
+        min_score (float): Lowest score kept
+        class_ids (Sequence[int]): Class ids kept, None for all classes
+    @return
+        detections (List[np.ndarray]): DETECTION_DTYPE array per frame, in batch order
+    """
+    selected = np.asarray(indices, dtype=np.int64).reshape(-1, 3)
+    batch_index, class_index, box_index = selected[:, 0], selected[:, 1], selected[:, 2]
+    keep = scores[batch_index, class_index, box_index] >= min_score
+    if class_ids is not None:
+        keep &= np.isin(class_index, class_ids)
+    # detections of a frame end up next to each other, in the order the model selected them
+    order = np.argsort(batch_index[keep], kind="stable")
+    batch_index, class_index, box_index = (
+        batch_index[keep][order],
+        class_index[keep][order],
+        box_index[keep][order],
+    )
+
+    detections = np.empty(len(batch_index), dtype=DETECTION_DTYPE)
+    detections["box"] = boxes[batch_index, box_index]
+    detections["score"] = scores[batch_index, class_index, box_index]
+    detections["class_id"] = class_index
+    detections["correlation"] = np.asarray(correlations, dtype=np.int64)[batch_index]
+    bounds = np.searchsorted(batch_index, np.arange(1, len(correlations)))
+    return np.split(detections, bounds)
+
+
+def encode_detections_message(
+    camera_id: int,
+    correlation_id: str,
+    detections: np.ndarray,
+    frame_size: tuple,
+    sequence: int = 0,
+    captured_at: float = 0.0,
+) -> bytes:
+    """
+    Encode the detections of a frame for the UI, boxes scaled to the frame so they overlay
+    every tier of the camera.
+
+    @param
+        camera_id (int): Camera of the frame
+        correlation_id (str): Correlation id of the frame
+        detections (np.ndarray): DETECTION_DTYPE array of the frame, or tracker.TRACK_DTYPE
+            array to also send the track ids and velocities
+        frame_size (tuple): Size (width, height) of the inferred frame
+        sequence (int): Capture sequence of the frame
+        captured_at (float): Wall clock time the frame was captured, the UI extrapolates the
+            tracks from it
+    @return
+        message (bytes): MESSAGE_DETECTIONS message with a JSON payload of boxes
+            (x1, y1, x2, y2) relative to the frame size, scores and class ids, plus track
+            ids and box velocities relative to the frame size per second for tracks
+    """
+    width, height = frame_size
+    scale = np.array([width, height, width, height], dtype=np.float64)
+    # (y1, x1, y2, x2) pixels -> (x1, y1, x2, y2) fractions of the frame
+    boxes = detections["box"][:, [1, 0, 3, 2]] / scale
+    payload = {
+        "boxes": np.round(boxes, 4).tolist(),
+        "scores": np.round(detections["score"].astype(np.float64), 3).tolist(),
+        "classes": detections["class_id"].tolist(),
+    }
+    if "track_id" in detections.dtype.names:
+        payload["ids"] = detections["track_id"].tolist()
+        payload["velocities"] = np.round(detections["velocity"][:, [1, 0, 3, 2]] / scale, 4).tolist()
+    return encode_message(
+        MESSAGE_DETECTIONS,
+        camera_id=camera_id,
+        sequence=sequence,
+        correlation_id=correlation_id,
+        payload=json.dumps(payload, separators=(",", ":")).encode("utf-8"),
+        captured_at=captured_at,
+    )
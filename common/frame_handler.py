@@ -1,6 +1,208 @@
+import base64
+import json
+import time
+
 from tornado import websocket
+from tornado.iostream import StreamClosedError
+
+from broadcaster import Broadcaster
+from frame_protocol import (
+    MESSAGE_DETECTIONS,
+    MESSAGE_FRAME,
+    MESSAGE_SUBSCRIPTIONS,
+    decode_message,
+    encode_message,
+    is_binary_message,
+    is_compressible,
+)
+from latest_frame import LatestFrame
+from ui_tiers import DEFAULT_TIER, TIERS, tier_by_name
+from websocket_internals import is_compressing, wrap_compressor, write_uncompressed
+
+# (camera id, tier index) -> broadcaster to the UI clients watching the camera tier
+broadcasters = {}
+# (camera id, tier index) -> latest frame of the camera tier, served over HTTP
+latest_frames = {}
+# camera id -> internal connection of the FrameProvider sending the frames of the camera
+internal_clients = {}
+
+
+def get_broadcaster(camera_id: int, tier: int = DEFAULT_TIER.index) -> Broadcaster:
+    """
+    Get the broadcaster of a camera tier, created on first use.
+
+    @param
+        camera_id (int): Camera id
+        tier (int): Tier index, see ui_tiers
+    @return
+        broadcaster (Broadcaster): Broadcaster to the UI clients of the camera tier
+    """
+    key = (camera_id, tier)
+    if key not in broadcasters:
+        broadcasters[key] = Broadcaster(on_subscribers_changed=lambda: notify_subscriptions(camera_id))
+    return broadcasters[key]
+
+
+def get_latest_frame(camera_id: int, tier: int = DEFAULT_TIER.index) -> LatestFrame:
+    """
+    Get the latest frame slot of a camera tier, created on first use.
+
+    @param
+        camera_id (int): Camera id
+        tier (int): Tier index, see ui_tiers
+    @return
+        latest_frame (LatestFrame): Latest frame slot of the camera tier
+    """
+    key = (camera_id, tier)
+    if key not in latest_frames:
+        latest_frames[key] = LatestFrame()
+    return latest_frames[key]
+
+
+def subscriber_count(camera_id: int, tier: int) -> int:
+    """
+    Count the websocket clients and HTTP viewers of a camera tier.
+
+    @param
+        camera_id (int): Camera id
+        tier (int): Tier index, see ui_tiers
+    @return
+        count (int): Subscriber count
+    """
+    key = (camera_id, tier)
+    count = broadcasters[key].subscriber_count() if key in broadcasters else 0
+    if key in latest_frames:
+        count += latest_frames[key].viewer_count
+    return count
+
+
+def notify_subscriptions(camera_id: int) -> None:
+    """
+    Send the subscriber count of every tier of a camera to the FrameProvider, which only
+    produces the tiers somebody watches.
+
+    @param
+        camera_id (int): Camera id
+    """
+    internal = internal_clients.get(camera_id)
+    if internal is None:
+        return
+    counts = {tier.index: subscriber_count(camera_id, tier.index) for tier in TIERS}
+    message = encode_message(
+        MESSAGE_SUBSCRIPTIONS,
+        camera_id=camera_id,
+        sequence=0,
+        correlation_id="",
+        payload=json.dumps(counts).encode("utf-8"),
+    )
+    try:
+        internal.write_message(message, binary=True)
+    except (websocket.WebSocketClosedError, StreamClosedError):
+        pass
+
+
+def forward_frame(message, default_camera_id: int) -> None:
+    """
+    Forward a message of a FrameProvider to the UI clients of its camera tier, and keep it as
+    the latest frame of the tier. Detections go to the UI clients of every tier of the camera.
+
+    @param
+        message (bytes | str): Binary frame protocol message, frame or detections, or legacy JSON
+        default_camera_id (int): Camera of legacy JSON messages without a camera_id
+    """
+    is_binary = is_binary_message(message)
+    if is_binary:
+        # route by the camera id and tier of the header, the frame itself is forwarded as is
+        frame_message = decode_message(message)
+        camera_id, tier = frame_message.camera_id, frame_message.tier
+        if frame_message.message_type == MESSAGE_DETECTIONS:
+            # detections overlay every tier of the camera
+            for (broadcaster_camera_id, _), broadcaster in list(broadcasters.items()):
+                if broadcaster_camera_id == camera_id:
+                    broadcaster.publish(message, binary=True)
+            return
+        if frame_message.message_type == MESSAGE_FRAME:
+            get_latest_frame(camera_id, tier).update(
+                frame_message.payload, frame_message.sequence, frame_message.captured_at
+            )
+    else:
+        data = json.loads(message)
+        camera_id = data.get("camera_id", default_camera_id)
+        tier = data.get("tier", DEFAULT_TIER.index)
+        latest_frame = get_latest_frame(camera_id, tier)
+        latest_frame.update(base64.b64decode(data["frame"]), latest_frame.sequence + 1, time.time())
+    get_broadcaster(camera_id, tier).publish(message, binary=is_binary)
+
+
+class CompressionStats:
+    """
+    Counters of the permessage-deflate compression of the messages sent to the UI clients.
+    """
+
+    def __init__(self) -> None:
+        self.compressed_messages = 0
+        self.compressed_bytes_in = 0
+        self.compressed_bytes_out = 0
+        self.compression_seconds = 0.0
+        # messages sent as is, either not worth compressing or to clients without compression
+        self.uncompressed_messages = 0
+        self.uncompressed_bytes = 0
+
+    def to_dict(self) -> dict:
+        """
+        Get the counters, with the compression ratio (compressed size / original size).
 
-ui_clients = []
+        @return
+            stats (dict): Counters
+        """
+        return {
+            "compressed_messages": self.compressed_messages,
+            "compressed_bytes_in": self.compressed_bytes_in,
+            "compressed_bytes_out": self.compressed_bytes_out,
+            "compression_ratio": (
+                self.compressed_bytes_out / self.compressed_bytes_in if self.compressed_bytes_in else None
+            ),
+            "compression_seconds": self.compression_seconds,
+            "uncompressed_messages": self.uncompressed_messages,
+            "uncompressed_bytes": self.uncompressed_bytes,
+        }
+
+
+compression_stats = CompressionStats()
+
+
+class MeasuredCompressor:
+    """
+    Wrap the permessage-deflate compressor of a connection to count its ratio and CPU time.
+    """
+
+    def __init__(self, compressor, stats: CompressionStats) -> None:
+        self.compressor = compressor
+        self.stats = stats
+
+    def compress(self, data: bytes) -> bytes:
+        start = time.process_time()
+        compressed = self.compressor.compress(data)
+        self.stats.compression_seconds += time.process_time() - start
+        self.stats.compressed_messages += 1
+        self.stats.compressed_bytes_in += len(data)
+        self.stats.compressed_bytes_out += len(compressed)
+        return compressed
+
+
+def camera_argument(handler: websocket.WebSocketHandler) -> int:
+    """
+    Get the camera a websocket is bound to, from its camera query argument.
+
+    @param
+        handler (WebSocketHandler): Websocket handler
+    @return
+        camera_id (int): Camera id, 0 when not given
+    """
+    try:
+        return int(handler.get_argument("camera", "0"))
+    except ValueError:
+        return 0
 
 
 class FrameHandler(websocket.WebSocketHandler):
@@ -9,19 +211,51 @@ class FrameHandler(websocket.WebSocketHandler):
 
     # overridden method from WebsocketHandler
     def open(self) -> None:
+        self.camera_id = camera_argument(self)
+        # resolution, fps and quality of the frames, e.g. /ws/frame?camera=0&tier=thumbnail
+        self.tier = tier_by_name(self.get_argument("tier", DEFAULT_TIER.name))
+        # the compressor only exists when the client negotiated permessage-deflate
+        wrap_compressor(
+            self.ws_connection, lambda compressor: MeasuredCompressor(compressor, compression_stats)
+        )
         # Set a no-wait indication when receiving messages
-        if self not in ui_clients:
-            ui_clients.append(self)
         self.set_nodelay(True)
+        get_broadcaster(self.camera_id, self.tier.index).subscribe(self)
+
+    def send_message(self, message, binary: bool = False):
+        """
+        Send a message, compressing it only when its type is worth it.
+
+        permessage-deflate allows leaving single messages uncompressed, so image payloads
+        skip the compression pass while metadata keeps it.
+
+        @param
+            message (bytes | str): Message to send
+            binary (bool): True to send a binary message
+        @return
+            future (Future): Future of the write
+        """
+        if is_compressing(self.ws_connection) and is_compressible(message):
+            return self.write_message(message, binary=binary)
+        self.count_uncompressed(message)
+        return write_uncompressed(self, message, binary)
 
     # overridden method from WebsocketHandler
     def on_close(self) -> None:
-        if self in ui_clients:
-            ui_clients.remove(self)
-        pass
+        get_broadcaster(self.camera_id, self.tier.index).unsubscribe(self)
+
+    def count_uncompressed(self, message) -> None:
+        """
+        Count a message sent without compression.
+
+        @param
+            message (bytes | str): Message sent
+        """
+        compression_stats.uncompressed_messages += 1
+        compression_stats.uncompressed_bytes += len(message)
 
     def get_compression_options(self):
-        # compression level 6 is the default compression level..
+        # compression level 6 is the default compression level, applied per message see send_message
         return {"compression_level": 6, "mem_level": 5}
 
     # overridden method from WebsocketHandler
@@ -39,22 +273,30 @@ class FrameHandlerInternal(websocket.WebSocketHandler):
 
     # overridden method from WebsocketHandler
     def open(self) -> None:
+        # frames of one camera per internal connection, forwarded to its UI channels
+        self.camera_id = camera_argument(self)
         # Set a no-wait indication when receiving messages
         self.set_nodelay(True)
+        # connections without a camera only send messages, e.g. detections
+        if self.get_argument("camera", None) is not None:
+            internal_clients[self.camera_id] = self
+            # let the FrameProvider know which tiers to produce, also after a reconnection
+            notify_subscriptions(self.camera_id)
 
     # overridden method from WebsocketHandler
     def on_close(self) -> None:
-        pass
+        if internal_clients.get(self.camera_id) is self:
+            del internal_clients[self.camera_id]
 
     def get_compression_options(self):
-        # compression level 6 is the default compression level..
-        return {"compression_level": 6, "mem_level": 5}
+        # only small subscription messages are sent back, and the FrameProvider sends frames uncompressed
+        return None
 
     # overridden method from WebsocketHandler
-    def on_message(self, message: str) -> None:
+    def on_message(self, message) -> None:
         """Handler action when an incoming message is received
 
-        message (str): incoming message from the UI Component
+        message (bytes | str): incoming frame from the FrameProvider, binary frame protocol
+            message or legacy JSON
         """
-        for ui in ui_clients:
-            ui.write_message(message)
+        forward_frame(message, self.camera_id)
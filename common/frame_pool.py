@@ -0,0 +1,79 @@
+"""This module is used to provide a pool of reusable frame buffers."""
+import threading
+import weakref
+
+import numpy as np
+
+
+class FramePool:
+    """
+    Pool of preallocated frame buffers, grouped by shape.
+
+    acquire() hands out a view of a free buffer, and the buffer goes back to the pool as soon
+    as that view is garbage collected, so it is shared by reference like any other array.
+    Keep the returned array itself rather than a slice of it, a slice does not keep the
+    buffer out of the pool. When every buffer of a shape is in use a fresh array is
+    allocated, and counted as a miss.
+    """
+
+    def __init__(self, buffers_per_shape: int = 8, dtype: str = "uint8") -> None:
+        """
+        Initialize the pool, buffers are allocated on first demand of a shape.
+
+        @param
+            buffers_per_shape (int): Max buffers kept per shape
+            dtype (str): Buffer dtype
+        """
+        self.buffers_per_shape = buffers_per_shape
+        self.dtype = np.dtype(dtype)
+        # shape -> free buffers
+        self._free = {}
+        # shape -> buffers allocated by the pool
+        self._allocated = {}
+        self._locker = threading.Lock()
+        self.misses = 0
+
+    def acquire(self, shape: tuple) -> np.ndarray:
+        """
+        Get a buffer to write a frame into.
+
+        @param
+            shape (tuple): Frame shape (height, width, channels)
+        @return
+            buffer (np.ndarray): Uninitialized buffer, returned to the pool once unreferenced
+        """
+        shape = tuple(shape)
+        with self._locker:
+            free = self._free.setdefault(shape, [])
+            if free:
+                buffer = free.pop()
+            elif self._allocated.get(shape, 0) < self.buffers_per_shape:
+                self._allocated[shape] = self._allocated.get(shape, 0) + 1
+                buffer = np.empty(shape, dtype=self.dtype)
+            else:
+                self.misses += 1
+                return np.empty(shape, dtype=self.dtype)
+        view = buffer.view()
+        weakref.finalize(view, self._release, shape, buffer)
+        return view
+
+    def _release(self, shape: tuple, buffer: np.ndarray) -> None:
+        """
+        Put a buffer back in the pool, called when its view is collected (internal).
+
+        @param
+            shape (tuple): Frame shape
+            buffer (np.ndarray): Pooled buffer
+        """
+        with self._locker:
+            self._free[shape].append(buffer)
+
+    def in_use(self) -> int:
+        """
+        Count the pooled buffers currently handed out.
+
+        @return
+            count (int): Buffers in use
+        """
+        with self._locker:
+            return sum(self._allocated.values()) - sum(len(free) for free in self._free.values())
@@ -11,7 +11,13 @@ import time
 import logging
 import os
 import signal
-from typing import Any
+from typing import Any, List, Optional, Sequence
+from detections import select_detections
+from inference_engine import InferenceEngine
+from preprocessor import LetterboxPreprocessor, LAYOUT_NCHW_FLOAT32, LAYOUT_NHWC_UINT8
+
+# PIL reference implementation of the preprocessing, superseded by LetterboxPreprocessor
+# and kept to validate it (see benchmarks/preprocess_benchmark.py)
 
 # this function is from yolo3.utils.letterbox_image
 def letterbox_image(image, size):
@@ -36,67 +42,289 @@ def preprocess(img):
     image_data = np.expand_dims(image_data, 0)
     return image_data
 
-def infer(frame):
-    image = Image.fromarray(frame)
+def infer(
+    engine: InferenceEngine,
+    preprocessor: LetterboxPreprocessor,
+    frames: list,
+    correlations: Optional[Sequence[int]] = None,
+    min_score: float = 0.0,
+    class_ids: Optional[Sequence[int]] = None,
+) -> List[np.ndarray]:
+    """
+    Run inference on a batch of frames with a single session run.
+
+    @param
+        engine (InferenceEngine): Loaded inference engine
+        preprocessor (LetterboxPreprocessor): Preprocessor owning the input buffer
+        frames (list): Frames (np.ndarray) to run inference on
+        correlations (Sequence[int]): Sequence of every frame, None for the batch index
+        min_score (float): Lowest score kept
+        class_ids (Sequence[int]): Class ids kept, None for all classes
+    @return
+        detections (List[np.ndarray]): detections.DETECTION_DTYPE array per frame, in input order
+    """
+    # input, letterboxed into one reused NCHW tensor
+    for index, frame in enumerate(frames):
+        preprocessor.preprocess(frame, index)
+    image_data = preprocessor.batch(len(frames))
+    image_size = np.array([frame.shape[:2] for frame in frames], dtype=np.float32)
+
+    boxes, scores, indices = engine.run(image_data, image_size)
+
+    # split detections back out per frame using the batch index of every selected box
+    if correlations is None:
+        correlations = range(len(frames))
+    return select_detections(boxes, scores, indices, correlations, min_score, class_ids)
 
-    # input
-    image_data = preprocess(image)
-    image_size = np.array([image.size[1], image.size[0]], dtype=np.float32).reshape(1, 2)
+def _queue_dwell_time(item: Any) -> float:
+    """
+    Get the seconds an item waited in the queue.
 
-    session = onnxruntime.InferenceSession(f'{pathlib.Path(__file__).parent.resolve()}/tiny-yolov3-11.onnx')
+    @param
+        item: Item stamped by the queue with enqueued_at and dequeued_at
+    @return
+        dwell_time (float): Seconds between adding and taking the item, 0 if not stamped
+    """
+    enqueued_at = getattr(item, "enqueued_at", None)
+    dequeued_at = getattr(item, "dequeued_at", None)
+    if enqueued_at is None or dequeued_at is None:
+        return 0.0
+    return dequeued_at - enqueued_at
 
-    boxes, scores, indices = session.run(['yolonms_layer_1', 'yolonms_layer_1:1', 'yolonms_layer_1:2'], {'input_1': image_data, 'image_shape': image_size})
 
-    out_boxes, out_scores, out_classes = [], [], []
-    for idx_ in indices[0]:
-        out_classes.append(idx_[1])
-        out_scores.append(scores[tuple(idx_)])
-        idx_1 = (idx_[0], idx_[2])
-        out_boxes.append(boxes[idx_1])
+class FrameProcessingResult:
+    def __init__(
+        self,
+        correlation_id: str,
+        sequence: int,
+        detections: Optional[np.ndarray],
+        inference_time: float,
+        queue_dwell_time: float = 0.0,
+        camera_id: int = 0,
+        frame_size: tuple = (0, 0),
+        is_inferred: bool = True,
+        captured_at: float = 0.0,
+    ) -> None:
+        self.correlation_id = correlation_id
+        self.sequence = sequence
+        self.camera_id = camera_id
+        # detections.DETECTION_DTYPE array, boxes in pixels of the inferred frame, None until
+        # the ResultCollector resolves the detections of a frame that was not inferred
+        self.detections = detections
+        # size (width, height) of the inferred frame
+        self.frame_size = frame_size
+        # False when the scene did not change, or the frame was overwritten during inference,
+        # and the detections of an earlier frame of the camera are reused, their correlation
+        # field tells which one
+        self.is_inferred = is_inferred
+        # wall clock time the frame was captured, the tracker predicts the boxes for it
+        self.captured_at = captured_at
+        self.inference_time = inference_time
+        # seconds the frame waited in the queue before a worker took it
+        self.queue_dwell_time = queue_dwell_time
+
+    @property
+    def boxes(self) -> np.ndarray:
+        return self.detections["box"]
+
+    @property
+    def scores(self) -> np.ndarray:
+        return self.detections["score"]
+
+    @property
+    def classes(self) -> np.ndarray:
+        return self.detections["class_id"]
 
-    #print(max(out_scores), out_classes[out_scores.index(max(out_scores))])
 
 class FrameProcessor:
     """
     Process two.
     """
 
-    def __init__(self) -> None:
+    def __init__(self, intra_op_num_threads: int = 0, inter_op_num_threads: int = 1) -> None:
         """
         Initialize the process two.
+
+        @param
+            intra_op_num_threads (int): onnxruntime threads inside an operator, 0 for all cores
+            inter_op_num_threads (int): onnxruntime threads across operators
+        """
+        model_dir = pathlib.Path(__file__).parent.resolve()
+        self.model_path = f"{model_dir}/tiny-yolov3-11.onnx"
+        # Variant taking uint8 NHWC input (tools/fold_preprocessing.py), used when present
+        self.uint8_model_path = f"{model_dir}/tiny-yolov3-11.uint8.onnx"
+        self.prefer_uint8_model = True
+        self.input_names = ["input_1", "image_shape"]
+        self.output_names = ["yolonms_layer_1", "yolonms_layer_1:1", "yolonms_layer_1:2"]
+        self.intra_op_num_threads = intra_op_num_threads
+        self.inter_op_num_threads = inter_op_num_threads
+        self.graph_optimization_level = "all"
+        self.warmup_runs = 3
+        self.model_image_size = (416, 416)
+        # detections kept, by lowest score and by class id (None for all classes)
+        self.min_score = 0.3
+        self.class_ids = None
+        # Micro-batching, up to batch_size frames or batch_timeout seconds after the first frame
+        self.batch_size = 1
+        self.batch_timeout = 0.05
+        # Max seconds to block waiting for an item, items wake the worker up as soon as they arrive
+        self.queue_wait_timeout = 1.0
+        # Engine and preprocessor are created in run() so that every worker owns its own
+        self.engine = None
+        self.preprocessor = None
+        self.input_layout = LAYOUT_NCHW_FLOAT32
+
+    def _create_engine(self) -> InferenceEngine:
         """
-        pass
+        Create, load and warm up the inference engine.
 
-    def run(self, queue) -> None:
+        @return
+            engine (InferenceEngine): Ready to use inference engine
+        """
+        model_path = self.model_path
+        if self.prefer_uint8_model and os.path.isfile(self.uint8_model_path):
+            model_path = self.uint8_model_path
+        engine = InferenceEngine(
+            model_path=model_path,
+            input_names=self.input_names,
+            output_names=self.output_names,
+            intra_op_num_threads=self.intra_op_num_threads,
+            inter_op_num_threads=self.inter_op_num_threads,
+            graph_optimization_level=self.graph_optimization_level,
+            # Optimized graph is serialized next to the model so restarts skip graph optimization
+            optimized_model_path=model_path.replace(".onnx", ".optimized.onnx"),
+            warmup_runs=self.warmup_runs,
+        )
+        start = datetime.now().timestamp()
+        engine.load()
+        if engine.image_input_type() == "tensor(uint8)":
+            self.input_layout = LAYOUT_NHWC_UINT8
+            engine.warmup((self.batch_size, *self.model_image_size, 3))
+        else:
+            self.input_layout = LAYOUT_NCHW_FLOAT32
+            engine.warmup((self.batch_size, 3, *self.model_image_size))
+        end = datetime.now().timestamp()
+        self.logger.info(f"Time taken for loading inference engine {model_path}: {end-start}")
+        return engine
+
+    def run(self, queue, result_queue=None) -> None:
         """
         Run the process two.
 
         @param
             queue: ProcessQueue object to communicate within processes
+            result_queue: Queue to put FrameProcessingResult objects in, None to discard results
         """
         self.logger = logging.getLogger(__name__)
         self.logger.info("Starting process two...")
+        try:
+            self.engine = self._create_engine()
+            self.preprocessor = LetterboxPreprocessor(
+                self.model_image_size, self.batch_size, input_layout=self.input_layout
+            )
+        except Exception as e:
+            # Kill the main process in case of error
+            self.logger.critical("Failed to load the inference engine {}".format(e))
+            self.logger.exception(e)
+            self.logger.critical(f"Killing main process... pid = {os.getppid()}")
+            os.kill(os.getppid(), signal.SIGTERM)
+            return
+        self.logger.info("Process two is ready...")
         while True:
-            if not queue.is_empty():
-                item = queue.get_item()
-                self._process(item)
-            else:
-                # Check for item in queue every 100 milliseconds
-                time.sleep(0.1)
-
-    def _process(self, item: Any) -> None:
+            # ready for a new batch, let the provider produce frames for it
+            queue.grant_credits(self.batch_size)
+            items = self._collect_batch(queue)
+            if items:
+                self._process(items, queue, result_queue)
+
+    def _collect_batch(self, queue) -> list:
+        """
+        Collect up to batch_size items, waiting at most batch_timeout after the first one.
+
+        @param
+            queue: ProcessQueue object to communicate within processes
+        @return
+            items (list): Collected items, empty if no item arrived within queue_wait_timeout
+        """
+        items = []
+        item = queue.wait_for_item(self.queue_wait_timeout)
+        if item is None:
+            return items
+        items.append(item)
+        deadline = time.monotonic() + self.batch_timeout
+        while len(items) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            item = queue.wait_for_item(remaining)
+            if item is not None:
+                items.append(item)
+        return items
+
+    def _process(self, items: list, queue, result_queue=None) -> None:
         """
         Process two processing.
 
         @param
-            item: Object to be processed
+            items (list): Objects to be processed as one batch
+            queue: Queue the items were taken from, the inference latency is reported to it
+            result_queue: Queue to put FrameProcessingResult objects in, None to discard results
         """
         try:
-            self.logger.info(f"Received in process two: {item.correlation_id}")
+            correlation_ids = [item.correlation_id for item in items]
+            self.logger.info(f"Received in process two: {correlation_ids}")
+            dwell_times = [_queue_dwell_time(item) for item in items]
+            self.logger.info(f"Time spent in queue: {max(dwell_times)}")
             start = datetime.now().timestamp()
-            infer(item.frame)
+            # the FrameProvider gates the frames of static scenes, see FrameProcessingRequest
+            inferred = [item.is_changed for item in items]
+            inferred_items = [item for item, is_inferred in zip(items, inferred) if is_inferred]
+            results = []
+            if inferred_items:
+                results = infer(
+                    self.engine,
+                    self.preprocessor,
+                    [item.frame for item in inferred_items],
+                    correlations=[item.sequence for item in inferred_items],
+                    min_score=self.min_score,
+                    class_ids=self.class_ids,
+                )
             end = datetime.now().timestamp()
-            self.logger.info(f'Time taken for inference: {end-start}')
+            # frames of the ring buffer are read in place, the writer may have overwritten one
+            # while it was inferred
+            intact = [queue.is_frame_intact(item) for item in inferred_items]
+            if not all(intact):
+                self.logger.warning(f"Frames overwritten during inference: {intact.count(False)}")
+            self.logger.info(
+                f'Time taken for inference: {end-start}, batch size: {len(items)}, '
+                f'reused detections: {len(items) - len(inferred_items)}'
+            )
+            queue.report_latency(end - start)
+            inferred_results = iter(zip(results, intact))
+            for item, dwell_time, is_inferred in zip(items, dwell_times, inferred):
+                detections = None
+                if is_inferred:
+                    # an overwritten frame is reported like a frame of a static scene, the
+                    # ResultCollector gives both the last detections of their camera before them
+                    detections, is_inferred = next(inferred_results)
+                    if is_inferred:
+                        self.logger.debug(f"Detections for {item.correlation_id}: {len(detections)}")
+                    else:
+                        detections = None
+                if result_queue is not None:
+                    result_queue.put(
+                        FrameProcessingResult(
+                            correlation_id=item.correlation_id,
+                            sequence=item.sequence,
+                            detections=detections,
+                            inference_time=end - start if is_inferred else 0.0,
+                            queue_dwell_time=dwell_time,
+                            camera_id=item.camera_id,
+                            frame_size=(item.frame.shape[1], item.frame.shape[0]),
+                            is_inferred=is_inferred,
+                            captured_at=item.captured_at,
+                        )
+                    )
             # Perform CPU bound task
             # time.sleep(0.2)
             # for _ in range(2):
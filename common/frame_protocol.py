@@ -0,0 +1,167 @@
+"""This module is used to encode and decode the binary messages sent over the websockets."""
+import os
+import struct
+import tempfile
+import time
+from typing import Optional
+
+# First bytes of every message, to tell binary messages from legacy JSON ones
+MAGIC = b"FP"
+VERSION = 2
+
+# Message types
+# JPEG frame of a camera tier
+MESSAGE_FRAME = 1
+# JSON {tier index: subscriber count} of a camera, sent by the server to the FrameProvider
+MESSAGE_SUBSCRIPTIONS = 2
+# Sent by a FrameProvider when its local socket connects, to bind the connection to a camera
+MESSAGE_HELLO = 3
+# JSON detections of an inferred frame, sent to every tier of its camera
+MESSAGE_DETECTIONS = 4
+
+# Message types with text-like payloads worth compressing, images are already compressed
+COMPRESSIBLE_MESSAGE_TYPES = frozenset({MESSAGE_SUBSCRIPTIONS, MESSAGE_DETECTIONS})
+
+# magic, version, message type, camera id, tier, reserved, correlation id length, sequence,
+# captured at, sent at
+HEADER = struct.Struct("!2sBBHBxHQdd")
+
+# Length of each message on the local unix socket between the FrameProvider and the server
+LENGTH_PREFIX = struct.Struct("!I")
+# Local socket of the server, FrameProviders on other hosts use the internal websocket
+UNIX_SOCKET_PATH = os.path.join(tempfile.gettempdir(), "frame_provider.sock")
+
+
+class FrameMessage:
+    """
+    Decoded binary message, the payload is a view on the received bytes.
+    """
+
+    def __init__(
+        self,
+        message_type: int,
+        camera_id: int,
+        sequence: int,
+        correlation_id: str,
+        captured_at: float,
+        sent_at: float,
+        payload: memoryview,
+        tier: int = 0,
+    ) -> None:
+        self.message_type = message_type
+        self.camera_id = camera_id
+        self.tier = tier
+        self.sequence = sequence
+        self.correlation_id = correlation_id
+        # wall clock timestamps
+        self.captured_at = captured_at
+        self.sent_at = sent_at
+        self.payload = payload
+
+
+def encode_message(
+    message_type: int,
+    camera_id: int,
+    sequence: int,
+    correlation_id: str,
+    payload: bytes,
+    captured_at: float = 0.0,
+    sent_at: Optional[float] = None,
+    tier: int = 0,
+) -> bytes:
+    """
+    Encode a message: the fixed header, the correlation id, then the payload as is.
+
+    @param
+        message_type (int): Message type, e.g. MESSAGE_FRAME
+        camera_id (int): Camera the message is about
+        sequence (int): Capture sequence of the frame
+        correlation_id (str): Correlation id of the frame
+        payload (bytes): Message body, e.g. JPEG bytes for MESSAGE_FRAME
+        captured_at (float): Wall clock time the frame was captured
+        sent_at (float): Wall clock time the message is sent, None for now
+        tier (int): UI tier of the frame, see ui_tiers
+    @return
+        message (bytes): Encoded message
+    """
+    correlation_id = correlation_id.encode("utf-8")
+    header = HEADER.pack(
+        MAGIC,
+        VERSION,
+        message_type,
+        camera_id,
+        tier,
+        len(correlation_id),
+        sequence,
+        captured_at,
+        time.time() if sent_at is None else sent_at,
+    )
+    return b"".join((header, correlation_id, payload))
+
+
+def is_binary_message(message) -> bool:
+    """
+    Check if a message uses the binary protocol rather than legacy JSON.
+
+    @param
+        message (Any): Received message
+    @return
+        is_binary (bool): True for a binary protocol message
+    """
+    return (
+        isinstance(message, (bytes, bytearray, memoryview))
+        and len(message) >= HEADER.size
+        and bytes(message[: len(MAGIC)]) == MAGIC
+    )
+
+
+def decode_message(message: bytes) -> FrameMessage:
+    """
+    Decode a message without copying its payload.
+
+    @param
+        message (bytes): Encoded message
+    @return
+        message (FrameMessage): Decoded message
+    """
+    if not is_binary_message(message):
+        raise ValueError("Not a binary frame protocol message")
+    (
+        _,
+        version,
+        message_type,
+        camera_id,
+        tier,
+        id_length,
+        sequence,
+        captured_at,
+        sent_at,
+    ) = HEADER.unpack_from(message)
+    if version != VERSION:
+        raise ValueError(f"Unsupported frame protocol version {version}, expected {VERSION}")
+    view = memoryview(message)
+    payload_start = HEADER.size + id_length
+    return FrameMessage(
+        message_type=message_type,
+        camera_id=camera_id,
+        sequence=sequence,
+        correlation_id=bytes(view[HEADER.size:payload_start]).decode("utf-8"),
+        captured_at=captured_at,
+        sent_at=sent_at,
+        payload=view[payload_start:],
+        tier=tier,
+    )
+
+
+def is_compressible(message) -> bool:
+    """
+    Check if a message is worth a websocket compression pass.
+
+    @param
+        message (Any): Message to send
+    @return
+        is_compressible (bool): False for image payloads, True for metadata and text
+    """
+    if is_binary_message(message):
+        return message[3] in COMPRESSIBLE_MESSAGE_TYPES
+    return True
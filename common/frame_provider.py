@@ -1,258 +1,549 @@
 """This module is used to preform camera integration."""
 import base64
+import functools
+import itertools
 import json
+import socket
 import time
-import uuid
 import cv2
 import numpy as np
 import logging
 import sys
 import pathlib
+from typing import Any, Callable, List, Optional
 from websocket import ABNF
 
-from rx import Observable, operators as op, interval
-from socket_client import SocketClient
+from rx import Observable, operators as op
+from rx.subject import Subject
+from capture_engine import CaptureEngine
+from frame_pool import FramePool
+from frame_protocol import (
+    MESSAGE_FRAME,
+    MESSAGE_SUBSCRIPTIONS,
+    UNIX_SOCKET_PATH,
+    FrameMessage,
+    encode_message,
+)
+from motion_gate import MotionGate
+from rate_controller import RateController
+from socket_client import ConnectionManager
+from unix_socket_client import UnixSocketClient
+from ui_tiers import TIERS, UiTier
+
+
+# Color conversions of the BGR frames, by color format
+COLOR_CONVERSIONS = {"rgb": cv2.COLOR_BGR2RGB, "gray": cv2.COLOR_BGR2GRAY}
+
+
+def format_correlation_id(camera_id: int, sequence: int) -> str:
+    """
+    Format the string id of a frame, only done when the id is actually needed.
+
+    @param
+        camera_id (int): Camera the frame was captured by
+        sequence (int): Capture sequence of the frame
+    @return
+        correlation_id (str): Correlation id
+    """
+    return f"camera-{camera_id}-frame-{sequence}"
 
 
 class Frame:
+    """
+    Captured frame, with a memo of its derived forms shared by every branch.
+
+    Derived forms are keyed by (size, color format, encoding), computed on first demand and
+    dropped by release() once the frame has left the pipeline.
+    """
+
+    __slots__ = ("frame", "sequence", "camera_id", "captured_at", "pool", "_derived")
+
     def __init__(
         self,
         frame: np.ndarray,
-        correlation_id: str,
+        sequence: int = 0,
+        camera_id: int = 0,
+        pool: Optional[FramePool] = None,
+        captured_at: float = 0.0,
     ) -> None:
         self.frame = frame
-        self.correlation_id = correlation_id
+        # capture order of the frame, used to deliver results in order
+        self.sequence = sequence
+        self.camera_id = camera_id
+        # wall clock time of the capture
+        self.captured_at = captured_at
+        # pool the resized forms are written into, None to allocate them
+        self.pool = pool
+        self._derived = {}
+
+    @property
+    def correlation_id(self) -> str:
+        return format_correlation_id(self.camera_id, self.sequence)
+
+    def derive(self, key: tuple, compute: Callable[[], Any]) -> Any:
+        """
+        Get a derived form of the frame, computing it on first demand.
+
+        @param
+            key (tuple): (size, color format, encoding) of the form
+            compute (Callable[[], Any]): Computes the form when it is not cached
+        @return
+            form (Any): Derived form
+        """
+        if key not in self._derived:
+            self._derived[key] = compute()
+        return self._derived[key]
+
+    def resized(self, size: tuple, color: str = "bgr") -> np.ndarray:
+        """
+        Get the frame resized and converted, shared by every caller.
+
+        @param
+            size (tuple): Frame size (width, height)
+            color (str): Color format, "bgr" or one of COLOR_CONVERSIONS
+        @return
+            frame (np.ndarray): Resized frame, must not be modified
+        """
+        size = tuple(size)
+        if color != "bgr":
+            return self.derive(
+                (size, color, None),
+                lambda: cv2.cvtColor(self.resized(size), COLOR_CONVERSIONS[color]),
+            )
+        if size == (self.frame.shape[1], self.frame.shape[0]):
+            return self.frame
+        return self.derive((size, color, None), lambda: self._resize(size))
+
+    def _resize(self, size: tuple) -> np.ndarray:
+        """
+        Resize the frame into a pooled buffer when there is a pool (internal).
+
+        @param
+            size (tuple): Frame size (width, height)
+        @return
+            frame (np.ndarray): Resized frame
+        """
+        if self.pool is None:
+            return cv2.resize(self.frame, size)
+        buffer = self.pool.acquire((size[1], size[0]) + self.frame.shape[2:])
+        return cv2.resize(self.frame, size, dst=buffer)
+
+    def encoded(
+        self, size: Optional[tuple], encoding: str = "jpeg", color: str = "bgr", quality: int = 95
+    ) -> bytes:
+        """
+        Get the frame resized and encoded, shared by every caller.
+
+        @param
+            size (tuple): Frame size (width, height), None for the captured size
+            encoding (str): Image encoding, "jpeg"
+            color (str): Color format, "bgr" or one of COLOR_CONVERSIONS
+            quality (int): JPEG quality, 0 to 100
+        @return
+            image (bytes): Encoded image
+        """
+        size = (self.frame.shape[1], self.frame.shape[0]) if size is None else tuple(size)
+        return self.derive(
+            (size, color, (encoding, quality)),
+            lambda: cv2.imencode(
+                ".jpg", self.resized(size, color), (cv2.IMWRITE_JPEG_QUALITY, quality)
+            )[1].tobytes(),
+        )
+
+    def release(self) -> None:
+        """
+        Drop the derived forms, once every branch is done with the frame.
+        """
+        self._derived.clear()
+
 
 class FrameProcessingRequest:
-    def __init__(self, correlation_id: str, frame: np.ndarray) -> None:
+    # the queues stamp enqueued_at, dequeued_at and frame_slot on the request
+    __slots__ = (
+        "frame", "sequence", "camera_id", "captured_at", "is_changed", "enqueued_at", "dequeued_at", "frame_slot"
+    )
+
+    def __init__(
+        self,
+        frame: np.ndarray,
+        sequence: int = 0,
+        camera_id: int = 0,
+        captured_at: float = 0.0,
+        is_changed: bool = True,
+    ) -> None:
         self.frame = frame
-        self.correlation_id = correlation_id
+        self.sequence = sequence
+        self.camera_id = camera_id
+        # wall clock time the frame was captured, see Frame.captured_at
+        self.captured_at = captured_at
+        # False when the motion gate found the scene static, the frame is not inferred and
+        # takes the detections of the last inferred frame of its camera
+        self.is_changed = is_changed
+
+    @property
+    def correlation_id(self) -> str:
+        return format_correlation_id(self.camera_id, self.sequence)
+
+
+# Sources opened when none are configured
+DEFAULT_SOURCES = [f"{pathlib.Path(__file__).parent.resolve()}/slow_traffic_small.mp4"]
 
 
-def encode_image(image: bytes) -> str:
+class TierStream:
+    """
+    UI tier of a camera, only produced while the server reports subscribers to it.
     """
-    Encode image to base64 string.
 
-    @param
-        image (bytes): Image data in bytes
-    @return
-        image_str (str:) Base64 encoded image string
+    def __init__(self, tier: UiTier) -> None:
+        self.tier = tier
+        self.rate = RateController(tier.fps)
+        self.rate.is_paused = True
+        self.subscribers = 0
+
+    def set_subscribers(self, subscribers: int) -> None:
+        """
+        Update the subscriber count, pausing the tier without subscribers.
+
+        @param
+            subscribers (int): Subscriber count reported by the server
+        """
+        self.subscribers = subscribers
+        self.rate.is_paused = subscribers == 0
+
+
+class CameraStream:
+    """
+    State of one camera of the FrameProvider: its source, capture pacing, UI tiers and queue rate.
     """
-    image = cv2.imencode(".jpg", image)[1].tobytes()
-    image = base64.b64encode(image).decode("utf-8")
-    return image
+
+    def __init__(self, camera_id: int, source: str, tiers: List[UiTier]) -> None:
+        """
+        Initialize the camera stream.
+
+        @param
+            camera_id (int): Camera id, tagging its frames and results
+            source (str): Video source, see CaptureEngine
+            tiers (List[UiTier]): UI tiers that can be subscribed to
+        """
+        self.camera_id = camera_id
+        self.source = source
+        self.ws = None
+        self.capture_engine = None
+        self.tiers = [TierStream(tier) for tier in tiers]
+        self.queue_rate = None
+        self.current_frame = None
 
 
 class FrameProvider:
     """
-    Intergrate with camera, read frames and emit frame to the WebAppAPI and Queue, controlled by FPS
+    Intergrate with cameras, read frames and emit frame to the WebAppAPI and Queue, controlled by FPS
     """
 
-    def __init__(self, queue) -> None:
+    def __init__(self, queue, sources: Optional[List[str]] = None) -> None:
         """
         Initialize the camera integration.
 
         @param
             queue (ProcessQueue): Queue to add frames to
+            sources (List[str]): Video sources, one camera each, None for DEFAULT_SOURCES
         """
         self.queue = queue
         self.logger = logging.getLogger(
            FrameProvider.__name__,
         )
-        self.ws = None
-        self.vid = None
+        # resolution/fps/quality variants of the UI stream, see ui_tiers
+        self.ui_tiers = TIERS
+        self.cameras = [
+            CameraStream(camera_id, source, self.ui_tiers)
+            for camera_id, source in enumerate(sources or DEFAULT_SOURCES)
+        ]
+        # shared by all cameras, so that results of every camera are ordered by capture time
+        self._sequence = itertools.count()
+        # captured and resized frames are written into reused buffers
+        self.frame_pool = FramePool()
 
+        # each camera has its own UI channel, selected by the camera argument
         self.ws_url = "ws://localhost:7001/ws/frame_internal"
-        self.camera_path = f"{pathlib.Path(__file__).parent.resolve()}/slow_traffic_small.mp4"
+        # local server socket, skipping the websocket framing, None to use ws_url, e.g. for a remote server
+        self.ui_socket_path = UNIX_SOCKET_PATH if hasattr(socket, "AF_UNIX") else None
+        # websockets of all cameras, sharing one dispatcher thread
+        self.connection_manager = ConnectionManager.default()
+        # used when the camera does not report its own frame rate
         self.frame_rate_camera = 30
-        self.frame_rate_ui = 15
+        # initial queue rate per camera, adjusted at runtime to the inference throughput within the bounds
         self.frame_rate_queue = 5
-        self.frame_size_ui = (640,480)
+        self.frame_rate_queue_min = 1
+        self.frame_rate_queue_max = 15
         self.frame_size_queue = (640,480)
+        # skip inference on queued frames of static scenes, inferring at least every max staleness
+        # seconds; the gate sees every queued frame of a camera, whichever worker infers it
+        self.motion_gating = True
+        self.motion_max_staleness = 2.0
+        self.motion_gate = None
+        # send UI frames as base64 JPEG in JSON instead of the binary frame protocol
+        self.legacy_json_ui = False
 
-    def _get_camera(self, camera_path: str) -> cv2.VideoCapture:
+    def _get_frame_stream(self, camera: CameraStream, frame_subject: Subject) -> Observable:
         """
-        Get camera.
+        Get frame stream.
 
         @param
-            camera_path (str): Path to camera
+            camera (CameraStream): Camera of the stream
+            frame_subject (Subject): Subject the capture engine pushes decoded frames to
         @return
-            camera_object (cv2.VideoCapture): cv2 camera object
+            frame_stream (Observable): Frame stream object
         """
-        try:
-            vid = cv2.VideoCapture(camera_path)
-            return vid
-        except Exception as ex:
-            self.logger.exception(ex)
-            self.logger.error(f"Error opening video stream {ex}")
-            raise ex
+        frame_stream = frame_subject.pipe(
+            op.map(lambda frame: self._create_frame(camera, frame)),  # create frame object
+            op.share(),  # share frame stream
+        )
+        return frame_stream
 
-    def _get_frame_stream(self, frame_rate: float) -> Observable:
+    def _create_frame(self, camera: CameraStream, frame: np.ndarray) -> Frame:
         """
-        Get frame stream.
+        Wrap a captured frame, releasing the derived forms of the previous one.
+
+        The branches handle a frame synchronously on the capture thread of its camera, so the
+        previous frame has left the pipeline once the next one is captured.
 
         @param
-            frame_rate (float): Frame rate for ui
+            camera (CameraStream): Camera the frame was captured by
+            frame (np.ndarray): Captured frame
         @return
-            frame_stream (Observable): Frame stream object
+            frame (Frame): Frame object
         """
-        frame_stream = interval(frame_rate).pipe(
-            op.map(lambda _: self.vid.read()),  # read frame
-            op.do_action(lambda result: self.vid.set(cv2.CAP_PROP_POS_FRAMES, 0) if result[0] is False else None), # restart video on completion
-            op.filter(
-                lambda result: result[0] is True and result[1] is not None
-            ),  # filter None frames
-            op.map(lambda result: result[1]),  # get frame
-            op.map(
-                lambda frame: Frame(
-                    frame=frame,
-                    correlation_id=str(uuid.uuid4()),
-                )
-            ),  # create frame object
-            op.share(),  # share frame stream
+        if camera.current_frame is not None:
+            camera.current_frame.release()
+        camera.current_frame = Frame(
+            frame=frame,
+            sequence=next(self._sequence),
+            camera_id=camera.camera_id,
+            pool=self.frame_pool,
+            captured_at=time.time(),
         )
-        return frame_stream
+        return camera.current_frame
 
     def _emit_frame_to_queue(
-        self, frame_stream: Observable, queue_fps: float, frame_size: list
+        self, frame_stream: Observable, queue_rate: RateController, frame_size: list
     ) -> Observable:
         """
         Emit frame to queue.
 
         @param
             frame_stream (Observable): Frame stream object
-            queue_fps (float): Frame rate for queue
+            queue_rate (RateController): Rate of frames for queue
             frame_size (list): Frame size for queue (width, height)
         @return
             frame_stream (Observable): Frame stream object
         """
         return frame_stream.pipe(
-            op.sample(queue_fps),
-            op.map(
-                lambda frame: Frame(
-                    cv2.resize(frame.frame, frame_size),
-                    frame.correlation_id,
-                )
-            ),
-            op.map(lambda frame: self._write_to_queue(frame=frame)),
+            op.filter(lambda _: queue_rate.take()),
+            # spend the credit queue_rate found free, unless another camera spent it since
+            op.filter(lambda _: self.queue.try_acquire_credit()),
+            op.map(lambda frame: self._write_to_queue(frame=frame, frame_size=frame_size)),
         )
 
-    def _write_to_queue(self, frame: Frame) -> bool:
+    def _write_to_queue(self, frame: Frame, frame_size: list) -> bool:
         """
         Write frame to queue.
 
         @param
-            frame (bytes): Frame to send to queue
+            frame (Frame): Frame to send to queue
+            frame_size (list): Frame size for queue (width, height)
         @return
             result (bool): Result of writing frame to queue, True for success
         """
         try:
+            resized_frame = frame.resized(frame_size)
+            # gated on the frame itself, before the queue copies it to the ring buffer
+            is_changed = self.motion_gate is None or self.motion_gate.should_infer(frame.camera_id, resized_frame)
             label_extraction_request = FrameProcessingRequest(
-                correlation_id=frame.correlation_id,
-                frame=frame.frame,
+                frame=resized_frame,
+                sequence=frame.sequence,
+                camera_id=frame.camera_id,
+                captured_at=frame.captured_at,
+                is_changed=is_changed,
             )
-            return self.queue.add_item(label_extraction_request)
+            is_added = self.queue.add_item(label_extraction_request)
+            if not is_added and is_changed and self.motion_gate is not None:
+                # the new reference is never inferred, infer the next frame of the camera instead
+                self.motion_gate.invalidate(frame.camera_id)
+            return is_added
         except Exception as ex:
             self.logger.exception(ex)
             self.logger.error(f"Error reading video stream {ex}")
             return False
 
-    def _connect_to_socket(self) -> None:
+    def _connect_to_socket(self, camera: CameraStream) -> None:
+        """
+        Connect the UI channel of a camera to socket.
+
+        @param
+            camera (CameraStream): Camera to connect
+        """
+        on_message = functools.partial(self._on_socket_message, camera)
+        if self.ui_socket_path is not None:
+            camera.ws = UnixSocketClient(self.ui_socket_path, camera.camera_id, on_message=on_message)
+            camera.ws.start()
+            return
+        camera.ws = self.connection_manager.get_client(
+            f"{self.ws_url}?camera={camera.camera_id}", on_message=on_message
+        )
+
+    def _on_socket_message(self, camera: CameraStream, message: Any) -> None:
         """
-        Connect to socket.
+        Handle a message of the server, the subscriber counts of the tiers of a camera.
+
+        @param
+            camera (CameraStream): Camera of the socket
+            message (Any): FrameMessage, or a text message that is ignored
         """
-        self.ws = SocketClient(
-            self.ws_url
-        ) 
-        self.ws.connect()
-        self.ws.start_dispatcher()
+        if not isinstance(message, FrameMessage) or message.message_type != MESSAGE_SUBSCRIPTIONS:
+            return
+        counts = json.loads(bytes(message.payload))
+        for tier_stream in camera.tiers:
+            tier_stream.set_subscribers(int(counts.get(str(tier_stream.tier.index), 0)))
+        self.logger.info(
+            f"Camera {camera.camera_id} subscribers: "
+            + ", ".join(f"{tier_stream.tier.name}={tier_stream.subscribers}" for tier_stream in camera.tiers)
+        )
 
-    def _emit_frame_to_socket(
-        self, frame_stream: Observable, socket_fps: float, frame_size: list
-    ) -> Observable:
+    def _emit_frame_to_socket(self, frame_stream: Observable, tier_stream: TierStream) -> Observable:
         """
         Emit frame to socket.
 
         @param
             frame_stream (Observable): Frame stream object
-            frame_size (list): Frame size for socket (width, height)
+            tier_stream (TierStream): UI tier, setting the rate, size and quality of the frames
         @return
             frame_stream (Observable): Frame stream object
         """
         return frame_stream.pipe(
-            op.sample(socket_fps),
-            op.map(
-                lambda frame: Frame(
-                    cv2.resize(frame.frame, frame_size),
-                    frame.correlation_id,
-                )
-            ),
-            op.map(
-                lambda frame: Frame(
-                    frame.frame,
-                    frame.correlation_id,
-                )
-            ),
-            op.map(lambda frame: self._write_to_socket(frame=frame)),
+            op.filter(lambda _: tier_stream.rate.take()),
+            op.map(lambda frame: self._write_to_socket(frame=frame, tier=tier_stream.tier)),
         )
 
-    def _write_to_socket(self, frame: Frame) -> bool:
+    def _write_to_socket(self, frame: Frame, tier: UiTier) -> bool:
         """
         Write frame to socket.
 
         @param
-            frame (str): Frame to send to socket
+            frame (Frame): Frame to send to socket
+            tier (UiTier): UI tier of the frame
         @return
             result (bool): Result of writing frame to socket, True for success
         """
         try:
-            return self.ws.send(
-                json.dumps(
-                    {
-                        "frame": encode_image(frame.frame),
-                        "correlation_id": frame.correlation_id,
-                    }
-                ),
-                ABNF.OPCODE_BINARY,
+            ws = self.cameras[frame.camera_id].ws
+            image = frame.encoded(tier.size, quality=tier.jpeg_quality)
+            if self.legacy_json_ui:
+                return ws.send(
+                    json.dumps(
+                        {
+                            "frame": base64.b64encode(image).decode("utf-8"),
+                            "correlation_id": frame.correlation_id,
+                            "camera_id": frame.camera_id,
+                            "tier": tier.index,
+                        }
+                    ),
+                    ABNF.OPCODE_TEXT,
+                )
+            return ws.send_binary(
+                encode_message(
+                    MESSAGE_FRAME,
+                    camera_id=frame.camera_id,
+                    sequence=frame.sequence,
+                    correlation_id=frame.correlation_id,
+                    payload=image,
+                    captured_at=frame.captured_at,
+                    tier=tier.index,
+                )
             )
         except Exception as ex:
             self.logger.exception(ex)
             self.logger.error(f"Error writting video stream to socket {ex}")
             return False
 
-    def start_camera(self) -> None:
+    def _start_camera_stream(self, camera: CameraStream) -> None:
         """
-        Start camera in infinite loop.
-        """
-        self._connect_to_socket()
-        self.vid = self._get_camera(self.camera_path)
-        self.logger.info("Started camera...")
-
-        frame_stream = self._get_frame_stream(1 / self.frame_rate_camera)
+        Start capturing a camera and emitting its frames.
 
-        socket_result_stream = self._emit_frame_to_socket(
-            frame_stream, 1 / self.frame_rate_ui, self.frame_size_ui
+        @param
+            camera (CameraStream): Camera to start
+        """
+        # the workers are shared by all cameras, each camera gets its share of the throughput
+        camera.queue_rate = RateController(
+            self.frame_rate_queue,
+            min_fps=self.frame_rate_queue_min,
+            max_fps=self.frame_rate_queue_max,
+            stats_source=self.queue.stats,
+            parallelism=(getattr(self.queue, "max_credits", None) or 1) / len(self.cameras),
+            # frames no worker is ready for are skipped before they are even decoded
+            is_ready=self.queue.has_credit,
         )
+        frame_subject = Subject()
+        frame_stream = self._get_frame_stream(camera, frame_subject)
+
+        for tier_stream in camera.tiers:
+            socket_result_stream = self._emit_frame_to_socket(frame_stream, tier_stream)
+            socket_result_stream.subscribe(
+                on_next=lambda _: None,
+                on_error=lambda ex: self.logger.exception(ex),
+                on_completed=lambda: self.logger.info("Completed frame stream"),
+            )
         queue_result_stream = self._emit_frame_to_queue(
-            frame_stream, 1 / self.frame_rate_queue, self.frame_size_queue
-        )
-        socket_result_stream.subscribe(
-            on_next=lambda _: None,
-            on_error=lambda ex: self.logger.exception(ex),
-            on_completed=lambda: self.logger.info("Completed frame stream"),
+            frame_stream, camera.queue_rate, self.frame_size_queue
         )
         queue_result_stream.subscribe(
             on_next=lambda _: None,
             on_error=lambda ex: self.logger.exception(ex),
             on_completed=lambda: self.logger.info("Completed frame stream"),
         )
+        camera.capture_engine = CaptureEngine(
+            camera.source,
+            on_frame=frame_subject.on_next,
+            # tiers without subscribers are paused and never trigger a decode, the queue rate
+            # neither while no credit is free; it comes last, so a due tier decodes the frame
+            # before it is asked and counts a missing credit only once
+            gates=[tier_stream.rate for tier_stream in camera.tiers] + [camera.queue_rate],
+            default_fps=self.frame_rate_camera,
+            frame_pool=self.frame_pool,
+            name=f"CaptureEngine-{camera.camera_id}",
+        )
+        camera.capture_engine.start()
+        self.logger.info(f"Started camera {camera.camera_id} stream from {camera.source}...")
+
+    def start_camera(self) -> None:
+        """
+        Start cameras in infinite loop.
+        """
+        if self.motion_gating:
+            self.motion_gate = MotionGate(max_staleness=self.motion_max_staleness)
+        for camera in self.cameras:
+            self._connect_to_socket(camera)
+        if self.ui_socket_path is None:
+            # a single dispatcher serves the websockets of all cameras
+            self.connection_manager.start()
+        for camera in self.cameras:
+            self._start_camera_stream(camera)
         self.logger.info("Started camera stream...")
         while True:
-            if not self.vid.isOpened():
-                self.logger.error("Could not open video device, reconnecting to camera")
-                self.vid = self._get_camera(self.camera_path)
-
             time.sleep(10)
+            self.logger.info(f"Queue stats: {self.queue.stats()}, pool misses: {self.frame_pool.misses}")
+            if self.motion_gate is not None:
+                self.logger.info(
+                    f"Motion gate: inferred: {self.motion_gate.inferred_count}, "
+                    f"skipped: {self.motion_gate.skipped_count}"
+                )
+            for camera in self.cameras:
+                self.logger.info(
+                    f"Camera {camera.camera_id}: queue fps: {camera.queue_rate.fps:.1f}, "
+                    f"frames grabbed: {camera.capture_engine.grabbed_count}, "
+                    f"decoded: {camera.capture_engine.retrieved_count}, "
+                    f"late: {camera.capture_engine.late_count}, UI subscribers: "
+                    + ", ".join(f"{tier_stream.tier.name}={tier_stream.subscribers}" for tier_stream in camera.tiers)
+                    + f", UI sender: {camera.ws.stats()}"
+                )
 
-def run(queue):
-    FrameProvider(queue).start_camera()
\ No newline at end of file
+def run(queue, sources: Optional[List[str]] = None):
+    FrameProvider(queue, sources).start_camera()
\ No newline at end of file
@@ -0,0 +1,89 @@
+"""This module is used to receive the frames of local FrameProviders over a unix domain socket."""
+import logging
+
+from tornado import netutil
+from tornado.iostream import IOStream, StreamClosedError
+from tornado.tcpserver import TCPServer
+
+import frame_handler
+from frame_protocol import LENGTH_PREFIX, MESSAGE_HELLO, decode_message, is_binary_message
+
+
+class FrameStreamConnection:
+    """
+    Connection of a local FrameProvider, the unix socket counterpart of FrameHandlerInternal.
+    """
+
+    def __init__(self, stream: IOStream) -> None:
+        self.stream = stream
+        # bound by the MESSAGE_HELLO message of the FrameProvider
+        self.camera_id = None
+
+    def write_message(self, message: bytes, binary: bool = True):
+        """
+        Send a message to the FrameProvider, e.g. the subscriber counts of its camera.
+
+        @param
+            message (bytes): Binary frame protocol message
+            binary (bool): ignored, for compatibility with FrameHandlerInternal
+        @return
+            future (Future): Future of the write
+        """
+        self.stream.write(LENGTH_PREFIX.pack(len(message)))
+        return self.stream.write(message)
+
+    def on_message(self, message: bytes) -> None:
+        """
+        Handle a message of the FrameProvider.
+
+        @param
+            message (bytes): Binary frame protocol message, or legacy JSON
+        """
+        if is_binary_message(message) and message[3] == MESSAGE_HELLO:
+            self.camera_id = decode_message(message).camera_id
+            frame_handler.internal_clients[self.camera_id] = self
+            # let the FrameProvider know which tiers to produce, also after a reconnection
+            frame_handler.notify_subscriptions(self.camera_id)
+            return
+        frame_handler.forward_frame(message, self.camera_id or 0)
+
+    def on_close(self) -> None:
+        if frame_handler.internal_clients.get(self.camera_id) is self:
+            del frame_handler.internal_clients[self.camera_id]
+
+
+class FrameStreamServer(TCPServer):
+    """
+    Server of the length-prefixed messages of the FrameProviders on the same host.
+
+    Frames are read as they were sent, without websocket framing, unmasking or
+    decompression, and forwarded like the ones of the internal websocket.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.logger = logging.getLogger(FrameStreamServer.__name__)
+
+    def listen_unix(self, path: str) -> None:
+        """
+        Listen on a unix socket, replacing a stale socket file.
+
+        @param
+            path (str): Path of the unix socket
+        """
+        self.add_socket(netutil.bind_unix_socket(path))
+        self.logger.info(f"Listening for frames on unix socket {path}")
+
+    async def handle_stream(self, stream: IOStream, address) -> None:
+        connection = FrameStreamConnection(stream)
+        try:
+            while True:
+                (length,) = LENGTH_PREFIX.unpack(await stream.read_bytes(LENGTH_PREFIX.size))
+                connection.on_message(await stream.read_bytes(length))
+        except StreamClosedError:
+            pass
+        except Exception as ex:
+            self.logger.exception(ex)
+            stream.close()
+        finally:
+            connection.on_close()
@@ -0,0 +1,194 @@
+"""This module is used to provide a persistent ONNX inference engine."""
+import logging
+import os
+import threading
+from typing import List, Optional
+
+import numpy as np
+import onnxruntime
+
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+
+class InferenceEngine:
+    """
+    Owns a single onnxruntime InferenceSession, loaded once and warmed up before use.
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        input_names: List[str],
+        output_names: List[str],
+        intra_op_num_threads: int = 0,
+        inter_op_num_threads: int = 0,
+        graph_optimization_level: str = "all",
+        optimized_model_path: Optional[str] = None,
+        warmup_runs: int = 3,
+    ) -> None:
+        """
+        Initialize the inference engine, the session is created by load().
+
+        @param
+            model_path (str): Path to the onnx model
+            input_names (List[str]): Model input names, (image, image_shape)
+            output_names (List[str]): Model output names to fetch
+            intra_op_num_threads (int): Threads used inside an operator, 0 lets onnxruntime decide
+            inter_op_num_threads (int): Threads used across operators, 0 lets onnxruntime decide
+            graph_optimization_level (str): One of disable, basic, extended, all
+            optimized_model_path (str): Cache file for the optimized graph, None to disable.
+                The onnxruntime version, provider and optimization level are added to its name
+            warmup_runs (int): Number of inference passes run by warmup()
+        """
+        self.model_path = model_path
+        self.input_names = input_names
+        self.output_names = output_names
+        self.intra_op_num_threads = intra_op_num_threads
+        self.inter_op_num_threads = inter_op_num_threads
+        self.graph_optimization_level = graph_optimization_level
+        self.optimized_model_path = optimized_model_path
+        self.warmup_runs = warmup_runs
+        self.providers = ["CPUExecutionProvider"]
+        self.session = None
+        self.logger = logging.getLogger(InferenceEngine.__name__)
+
+    def cache_path(self) -> Optional[str]:
+        """
+        Get the cache file of the optimized graph, keyed on what the optimization depends on.
+
+        @return
+            path (str): Path of the optimized model, None when caching is disabled
+        """
+        if self.optimized_model_path is None:
+            return None
+        root, extension = os.path.splitext(self.optimized_model_path)
+        provider = self.providers[0].replace("ExecutionProvider", "").lower()
+        return f"{root}.ort-{onnxruntime.__version__}.{provider}.{self.graph_optimization_level}{extension}"
+
+    def _session_options(
+        self, optimize: bool, optimized_model_filepath: Optional[str] = None
+    ) -> onnxruntime.SessionOptions:
+        """
+        Build the session options.
+
+        @param
+            optimize (bool): True to optimize the graph
+            optimized_model_filepath (str): File the optimized graph is serialized to, None to not
+        @return
+            options (onnxruntime.SessionOptions): Session options
+        """
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = self.intra_op_num_threads
+        options.inter_op_num_threads = self.inter_op_num_threads
+        if self.inter_op_num_threads > 1:
+            options.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL
+        if optimize:
+            options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[
+                self.graph_optimization_level
+            ]
+            if optimized_model_filepath is not None:
+                options.optimized_model_filepath = optimized_model_filepath
+        else:
+            # The cached graph is already optimized
+            options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS["disable"]
+        return options
+
+    def _is_cache_valid(self) -> bool:
+        """
+        Check if the optimized model cache exists and is newer than the source model.
+
+        @return
+            is_valid (bool): True if the cached optimized model can be used
+        """
+        cache_path = self.cache_path()
+        return (
+            cache_path is not None
+            and os.path.isfile(cache_path)
+            and os.path.getmtime(cache_path) >= os.path.getmtime(self.model_path)
+        )
+
+    def load(self) -> onnxruntime.InferenceSession:
+        """
+        Create the inference session, from the optimized model cache when available.
+
+        @return
+            session (onnxruntime.InferenceSession): Loaded session
+        """
+        if self.session is not None:
+            return self.session
+        cache_path = self.cache_path()
+        if self._is_cache_valid():
+            try:
+                self.session = onnxruntime.InferenceSession(
+                    cache_path,
+                    sess_options=self._session_options(optimize=False),
+                    providers=self.providers,
+                )
+                self.logger.info(f"Loaded optimized model from cache {cache_path}")
+                return self.session
+            except Exception as ex:
+                self.logger.warning(f"Failed loading optimized model cache, rebuilding it {ex}")
+        # every worker of a pool may build the cache at once, each writes its own file and
+        # moves it in place atomically, so that no worker ever reads a partly written cache
+        temporary_path = None
+        if cache_path is not None:
+            root, extension = os.path.splitext(cache_path)
+            temporary_path = f"{root}.{os.getpid()}-{threading.get_ident()}.tmp{extension}"
+        self.session = onnxruntime.InferenceSession(
+            self.model_path,
+            sess_options=self._session_options(optimize=True, optimized_model_filepath=temporary_path),
+            providers=self.providers,
+        )
+        self.logger.info(f"Loaded model {self.model_path}")
+        if temporary_path is not None and os.path.isfile(temporary_path):
+            try:
+                os.replace(temporary_path, cache_path)
+            except OSError as ex:
+                self.logger.warning(f"Failed saving optimized model cache {cache_path} {ex}")
+        return self.session
+
+    def image_input_type(self) -> str:
+        """
+        Get the element type of the image input, e.g. tensor(float) or tensor(uint8).
+
+        @return
+            input_type (str): onnxruntime type string of the image input
+        """
+        inputs = {i.name: i for i in self.load().get_inputs()}
+        return inputs[self.input_names[0]].type
+
+    def warmup(self, input_shape: tuple, image_size: tuple = (480, 640)) -> None:
+        """
+        Run inference on blank input so that lazy allocations happen before real frames.
+
+        @param
+            input_shape (tuple): Shape of the preprocessed image batch
+            image_size (tuple): Image size (height, width) reported to the model
+        """
+        dtype = np.uint8 if self.image_input_type() == "tensor(uint8)" else np.float32
+        image_data = np.zeros(input_shape, dtype=dtype)
+        image_shape = np.array([image_size] * input_shape[0], dtype=np.float32)
+        for _ in range(self.warmup_runs):
+            self.run(image_data, image_shape)
+        self.logger.info(f"Warmed up inference engine with {self.warmup_runs} runs")
+
+    def run(self, image_data: np.ndarray, image_shape: np.ndarray) -> list:
+        """
+        Run inference.
+
+        @param
+            image_data (np.ndarray): Preprocessed image batch
+            image_shape (np.ndarray): Original image sizes (height, width) per batch item
+        @return
+            outputs (list): Model outputs, ordered as output_names
+        """
+        return self.load().run(
+            self.output_names,
+            {self.input_names[0]: image_data, self.input_names[1]: image_shape},
+        )
@@ -0,0 +1,86 @@
+"""This module is used to keep the latest encoded frame of a camera tier in the server."""
+import datetime
+from typing import Optional
+
+from tornado import locks
+
+# Boundary between the parts of the MJPEG stream
+MJPEG_BOUNDARY = "frame"
+
+
+class LatestFrame:
+    """
+    Slot holding the latest JPEG of a camera tier, as received from the FrameProvider.
+
+    The bytes are forwarded as they arrived, so serving them to any number of HTTP viewers
+    never encodes again. Viewers streaming from the slot count as subscribers of the tier.
+    """
+
+    def __init__(self) -> None:
+        self.sequence = -1
+        self.captured_at = 0.0
+        self._payload = None
+        self._image = None
+        self._part = None
+        # MJPEG streams and snapshots waiting for a frame
+        self.viewer_count = 0
+        self._updated = locks.Condition()
+
+    def update(self, payload, sequence: int, captured_at: float) -> None:
+        """
+        Replace the frame, must be called on the IOLoop.
+
+        @param
+            payload (bytes | memoryview): JPEG bytes, only copied when first served
+            sequence (int): Capture sequence of the frame
+            captured_at (float): Wall clock time of the capture
+        """
+        self._payload = payload
+        self._image = None
+        self._part = None
+        self.sequence = sequence
+        self.captured_at = captured_at
+        self._updated.notify_all()
+
+    @property
+    def image(self) -> Optional[bytes]:
+        """
+        JPEG bytes of the frame, None before the first frame.
+        """
+        if self._image is None and self._payload is not None:
+            self._image = bytes(self._payload)
+        return self._image
+
+    @property
+    def part(self) -> bytes:
+        """
+        The frame as one part of the MJPEG stream, built once for all the viewers.
+        """
+        if self._part is None:
+            image = self.image
+            header = (
+                f"--{MJPEG_BOUNDARY}\r\n"
+                f"Content-Type: image/jpeg\r\n"
+                f"Content-Length: {len(image)}\r\n\r\n"
+            ).encode("ascii")
+            self._part = header + image + b"\r\n"
+        return self._part
+
+    @property
+    def last_modified(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.captured_at, tz=datetime.timezone.utc)
+
+    async def wait_for_newer(self, sequence: int, timeout: float) -> bool:
+        """
+        Wait for a frame newer than a sequence.
+
+        @param
+            sequence (int): Sequence of the last frame seen
+            timeout (float): Max seconds to wait
+        @return
+            is_newer (bool): True if a newer frame is available
+        """
+        if self.sequence > sequence:
+            return True
+        await self._updated.wait(timeout=datetime.timedelta(seconds=timeout))
+        return self.sequence > sequence
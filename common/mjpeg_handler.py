@@ -0,0 +1,122 @@
+"""This module is used to serve the latest frames of the cameras over plain HTTP, as MJPEG and snapshots."""
+import time
+
+from tornado import web
+from tornado.iostream import StreamClosedError
+
+import frame_handler
+from latest_frame import MJPEG_BOUNDARY, LatestFrame
+from ui_tiers import DEFAULT_TIER, tier_by_name
+
+# Seconds a cached frame is served to snapshots without asking for a fresher one
+SNAPSHOT_MAX_AGE = 1.0
+# Max seconds a request waits for the FrameProvider to produce a frame of a paused tier
+FRAME_WAIT_TIMEOUT = 2.0
+
+
+class LatestFrameHandler(web.RequestHandler):
+    """Base handler of the endpoints serving the latest frame of a camera tier,
+    selected by the camera and tier query arguments.
+
+    Args:
+        web (_type_): Request handler
+    """
+
+    def prepare(self) -> None:
+        try:
+            self.camera_id = int(self.get_argument("camera", "0"))
+        except ValueError:
+            raise web.HTTPError(400, "camera must be an integer")
+        self.tier = tier_by_name(self.get_argument("tier", DEFAULT_TIER.name))
+        self.latest_frame: LatestFrame = frame_handler.get_latest_frame(self.camera_id, self.tier.index)
+        self.is_watching = False
+
+    def start_watching(self) -> None:
+        """
+        Count the request as a viewer of the tier, so the FrameProvider produces it.
+        """
+        if not self.is_watching:
+            self.is_watching = True
+            self.latest_frame.viewer_count += 1
+            frame_handler.notify_subscriptions(self.camera_id)
+
+    def stop_watching(self) -> None:
+        """
+        Remove the request from the viewers of the tier.
+        """
+        if self.is_watching:
+            self.is_watching = False
+            self.latest_frame.viewer_count -= 1
+            frame_handler.notify_subscriptions(self.camera_id)
+
+    def on_finish(self) -> None:
+        self.stop_watching()
+
+    def on_connection_close(self) -> None:
+        self.stop_watching()
+
+
+class SnapshotHandler(LatestFrameHandler):
+    """Handler for the snapshot endpoint, returning the latest JPEG of a camera tier,
+    e.g. /snapshot.jpg?camera=0&tier=full. The cached bytes are served as is, and
+    clients revalidating with the ETag of the current frame get a 304.
+
+    Args:
+        web (_type_): Request handler
+    """
+
+    async def get(self) -> None:
+        latest = self.latest_frame
+        if latest.image is None or time.time() - latest.captured_at > SNAPSHOT_MAX_AGE:
+            # the tier may be paused without subscribers, ask for it until a frame arrives
+            self.start_watching()
+            try:
+                await latest.wait_for_newer(latest.sequence, FRAME_WAIT_TIMEOUT)
+            finally:
+                self.stop_watching()
+        image = latest.image
+        if image is None:
+            self.set_status(503, "No frame received from the camera yet")
+            self.set_header("Retry-After", "1")
+            return
+        self.set_header("Content-Type", "image/jpeg")
+        self.set_header("Cache-Control", "no-cache")
+        self.set_header("Last-Modified", latest.last_modified)
+        self.set_etag_header()
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+        self.write(image)
+
+    def compute_etag(self) -> str:
+        return f'"{self.camera_id}-{self.tier.index}-{self.latest_frame.sequence}"'
+
+
+class MjpegHandler(LatestFrameHandler):
+    """Handler for the MJPEG endpoint, streaming the latest frames of a camera tier as
+    multipart/x-mixed-replace, e.g. /stream.mjpg?camera=0&tier=standard, for clients
+    that cannot use the websocket. A slow client skips to the latest frame instead of
+    queueing the frames it missed.
+
+    Args:
+        web (_type_): Request handler
+    """
+
+    async def get(self) -> None:
+        self.set_header("Content-Type", f"multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}")
+        self.set_header("Cache-Control", "no-cache, no-store, must-revalidate")
+        self.set_header("Pragma", "no-cache")
+        self.start_watching()
+        sequence = -1
+        try:
+            while self.is_watching:
+                if not await self.latest_frame.wait_for_newer(sequence, FRAME_WAIT_TIMEOUT):
+                    continue
+                sequence = self.latest_frame.sequence
+                self.write(self.latest_frame.part)
+                # one part in flight at a time, the frames published meanwhile are skipped
+                await self.flush()
+        except StreamClosedError:
+            pass
+        finally:
+            self.stop_watching()
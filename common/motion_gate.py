@@ -0,0 +1,128 @@
+"""This module is used to skip inference on frames of static scenes."""
+import time
+from typing import Dict, Optional
+
+import cv2
+import numpy as np
+
+
+class CameraMotionState:
+    """
+    Reference of a camera the next frames are compared to.
+    """
+
+    def __init__(self, reference: np.ndarray, inferred_at: float) -> None:
+        # tiny grayscale copy of the last inferred frame
+        self.reference = reference
+        self.inferred_at = inferred_at
+        # moving average of the change score of frames considered static, i.e. sensor noise
+        self.noise = 0.0
+
+
+class MotionGate:
+    """
+    Decide per frame whether its camera changed enough since the last inferred frame to
+    run inference again.
+
+    Frames are compared on a tiny grayscale copy, as the mean absolute pixel difference to
+    the last inferred frame, so that slow changes add up until they trigger. The threshold
+    follows the noise level of the camera, measured on the frames found static. A frame is
+    inferred anyway once the last inference is older than max_staleness.
+    """
+
+    def __init__(
+        self,
+        size: tuple = (32, 24),
+        min_threshold: float = 2.0,
+        noise_factor: float = 3.0,
+        noise_smoothing: float = 0.05,
+        max_staleness: float = 2.0,
+    ) -> None:
+        """
+        Initialize the motion gate.
+
+        @param
+            size (tuple): Size (width, height) of the copy the frames are compared on
+            min_threshold (float): Lowest change score, in gray levels, that triggers inference
+            noise_factor (float): Change score that triggers inference, as a multiple of the
+                noise level of the camera
+            noise_smoothing (float): Weight of the newest static frame in the noise level
+            max_staleness (float): Max seconds between two inferences of a camera
+        """
+        self.size = size
+        self.min_threshold = min_threshold
+        self.noise_factor = noise_factor
+        self.noise_smoothing = noise_smoothing
+        self.max_staleness = max_staleness
+        self.cameras: Dict[int, CameraMotionState] = {}
+        self.inferred_count = 0
+        self.skipped_count = 0
+
+    def _tiny_gray(self, frame: np.ndarray) -> np.ndarray:
+        """
+        Shrink a BGR frame to a tiny grayscale copy (internal).
+
+        @param
+            frame (np.ndarray): BGR frame
+        @return
+            tiny (np.ndarray): float32 grayscale copy of the gate size
+        """
+        tiny = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        if tiny.ndim == 3:
+            tiny = cv2.cvtColor(tiny, cv2.COLOR_BGR2GRAY)
+        return tiny.astype(np.float32)
+
+    def threshold(self, camera_id: int) -> float:
+        """
+        Get the change score above which a frame of a camera is inferred.
+
+        @param
+            camera_id (int): Camera id
+        @return
+            threshold (float): Change score threshold, in gray levels
+        """
+        state = self.cameras.get(camera_id)
+        noise = state.noise if state is not None else 0.0
+        return max(self.min_threshold, self.noise_factor * noise)
+
+    def should_infer(self, camera_id: int, frame: np.ndarray, now: Optional[float] = None) -> bool:
+        """
+        Check whether a frame needs inference, the frame becomes the reference if it does.
+
+        @param
+            camera_id (int): Camera of the frame
+            frame (np.ndarray): BGR frame
+            now (float): time.monotonic() timestamp, None for now
+        @return
+            is_inferred (bool): True to run inference, False to reuse the last detections
+        """
+        if now is None:
+            now = time.monotonic()
+        tiny = self._tiny_gray(frame)
+        state = self.cameras.get(camera_id)
+        if state is None or state.reference.shape != tiny.shape:
+            self.cameras[camera_id] = CameraMotionState(tiny, now)
+            self.inferred_count += 1
+            return True
+        score = float(np.mean(np.abs(tiny - state.reference)))
+        is_changed = score > self.threshold(camera_id)
+        if not is_changed:
+            # only static frames teach the gate the noise level of the camera
+            state.noise += self.noise_smoothing * (score - state.noise)
+        if is_changed or now - state.inferred_at >= self.max_staleness:
+            state.reference = tiny
+            state.inferred_at = now
+            self.inferred_count += 1
+            return True
+        self.skipped_count += 1
+        return False
+
+    def invalidate(self, camera_id: int) -> None:
+        """
+        Forget the reference of a camera, e.g. when the frame it was taken from was never
+        inferred, so that the next frame of the camera is inferred.
+
+        @param
+            camera_id (int): Camera id
+        """
+        self.cameras.pop(camera_id, None)
@@ -0,0 +1,125 @@
+"""This module is used to provide an allocation free letterbox preprocessor."""
+from typing import Dict, Tuple
+
+import cv2
+import numpy as np
+
+# Normalized float32 NCHW input, as expected by the original model
+LAYOUT_NCHW_FLOAT32 = "nchw_float32"
+# Raw uint8 NHWC input, for models with the normalization folded into the graph
+LAYOUT_NHWC_UINT8 = "nhwc_uint8"
+
+
+class LetterboxPreprocessor:
+    """
+    Letterbox frames straight into a preallocated, reused batch buffer.
+    """
+
+    def __init__(
+        self,
+        model_image_size: Tuple[int, int] = (416, 416),
+        max_batch_size: int = 1,
+        fill_value: int = 128,
+        interpolation: int = cv2.INTER_LINEAR,
+        input_layout: str = LAYOUT_NCHW_FLOAT32,
+    ) -> None:
+        """
+        Initialize the preprocessor and allocate the batch buffer.
+
+        @param
+            model_image_size (Tuple[int, int]): Model input size (height, width)
+            max_batch_size (int): Number of frames the buffer can hold
+            fill_value (int): Value of the padding, in 0-255 range
+            interpolation (int): cv2 interpolation, INTER_AREA is closest to PIL's
+                antialiased bicubic but several times slower than INTER_LINEAR
+            input_layout (str): LAYOUT_NCHW_FLOAT32 or LAYOUT_NHWC_UINT8
+        """
+        self.model_image_size = model_image_size
+        self.max_batch_size = max_batch_size
+        self.interpolation = interpolation
+        self.input_layout = input_layout
+        self.scale = np.float32(1 / 255.0)
+        height, width = model_image_size
+        if input_layout == LAYOUT_NHWC_UINT8:
+            self.fill_value = np.uint8(fill_value)
+            shape, dtype = (max_batch_size, height, width, 3), np.uint8
+        else:
+            self.fill_value = np.float32(fill_value / 255.0)
+            shape, dtype = (max_batch_size, 3, height, width), np.float32
+        self.buffer = np.full(shape, self.fill_value, dtype=dtype)
+        # (input height, input width) -> (resized width, resized height, left, top)
+        self._layouts: Dict[Tuple[int, int], Tuple[int, int, int, int]] = {}
+        # (resized height, resized width) -> reused resize destination
+        self._resized: Dict[Tuple[int, int], np.ndarray] = {}
+        # layout currently written into every batch slot, padding is only refilled on change
+        self._slot_layouts = [None] * max_batch_size
+
+    def _layout(self, input_size: Tuple[int, int]) -> Tuple[int, int, int, int]:
+        """
+        Get the scale and padding for an input resolution, computed once and cached.
+
+        @param
+            input_size (Tuple[int, int]): Input frame size (height, width)
+        @return
+            layout (Tuple[int, int, int, int]): Resized width, resized height, left and top padding
+        """
+        layout = self._layouts.get(input_size)
+        if layout is None:
+            ih, iw = input_size
+            h, w = self.model_image_size
+            scale = min(w / iw, h / ih)
+            nw = int(iw * scale)
+            nh = int(ih * scale)
+            layout = (nw, nh, (w - nw) // 2, (h - nh) // 2)
+            self._layouts[input_size] = layout
+            if self.input_layout == LAYOUT_NCHW_FLOAT32:
+                self._resized[(nh, nw)] = np.empty((nh, nw, 3), dtype=np.uint8)
+        return layout
+
+    def preprocess(self, frame: np.ndarray, index: int = 0) -> np.ndarray:
+        """
+        Letterbox a HWC uint8 frame into a slot of the batch buffer.
+
+        @param
+            frame (np.ndarray): Frame to preprocess
+            index (int): Batch slot to write into
+        @return
+            image_data (np.ndarray): View of the written slot
+        """
+        layout = self._layout(frame.shape[:2])
+        nw, nh, left, top = layout
+        target = self.buffer[index]
+        if self._slot_layouts[index] != layout:
+            target.fill(self.fill_value)
+            self._slot_layouts[index] = layout
+
+        if self.input_layout == LAYOUT_NHWC_UINT8:
+            # The model converts and normalizes, resize straight into the buffer
+            cv2.resize(
+                frame,
+                (nw, nh),
+                dst=target[top:top + nh, left:left + nw],
+                interpolation=self.interpolation,
+            )
+            return target
+
+        resized = self._resized[(nh, nw)]
+        cv2.resize(frame, (nw, nh), dst=resized, interpolation=self.interpolation)
+        # Normalize and convert HWC to CHW in one pass, straight into the buffer
+        np.multiply(
+            resized.transpose(2, 0, 1),
+            self.scale,
+            out=target[:, top:top + nh, left:left + nw],
+        )
+        return target
+
+    def batch(self, size: int) -> np.ndarray:
+        """
+        Get the first size slots of the batch buffer.
+
+        @param
+            size (int): Number of frames written into the buffer
+        @return
+            image_data (np.ndarray): Batch view, size items in the configured layout
+        """
+        return self.buffer[:size]
@@ -0,0 +1,122 @@
+"""This module is used to provide the overflow policies and counters shared by the queues."""
+from typing import Any
+
+# Keep only the newest item, an item replaced before being taken is stale
+POLICY_LATEST_ONLY = "latest_only"
+# Bounded FIFO, when full the oldest item is dropped as stale to make room
+POLICY_DROP_OLDEST = "drop_oldest"
+# Bounded FIFO, when full the incoming item is dropped
+POLICY_DROP_NEWEST = "drop_newest"
+# Bounded FIFO per source dropping its oldest item, sources are served in turn
+POLICY_FAIR_SHARE = "fair_share"
+
+POLICIES = (POLICY_LATEST_ONLY, POLICY_DROP_OLDEST, POLICY_DROP_NEWEST, POLICY_FAIR_SHARE)
+
+# Index of the counters in the shared counter arrays
+STAT_ENQUEUED = 0
+STAT_DROPPED = 1
+STAT_STALE = 2
+STAT_DEQUEUED = 3
+STAT_THROTTLED = 4
+STAT_COUNT = 5
+
+# Sequences of the last items taken by readers kept for the result collector, see dequeued_since
+DEQUEUED_LOG_SIZE = 256
+
+# Weight of the newest sample in the moving average of the reader latency
+LATENCY_SMOOTHING = 0.2
+
+
+class QueueStats:
+    """
+    Snapshot of the queue counters.
+    """
+
+    def __init__(
+        self,
+        enqueued: int,
+        dropped: int,
+        stale: int,
+        dequeued: int,
+        size: int,
+        throttled: int = 0,
+        latency: float = 0.0,
+    ) -> None:
+        """
+        Initialize the queue stats.
+
+        @param
+            enqueued (int): Items accepted by the queue
+            dropped (int): Incoming items rejected because the queue was full
+            stale (int): Accepted items discarded before being taken, replaced by newer ones
+            dequeued (int): Items taken from the queue
+            size (int): Items currently in the queue
+            throttled (int): Items not even produced because no reader had credit left
+            latency (float): Moving average of the seconds readers take to process a batch,
+                0 until reported
+        """
+        self.enqueued = enqueued
+        self.dropped = dropped
+        self.stale = stale
+        self.dequeued = dequeued
+        self.size = size
+        self.throttled = throttled
+        self.latency = latency
+
+    @property
+    def shed(self) -> int:
+        """
+        Total items that never reached a reader.
+        """
+        return self.dropped + self.stale
+
+    def __str__(self) -> str:
+        return (
+            f"enqueued={self.enqueued} dequeued={self.dequeued} dropped={self.dropped} "
+            f"stale={self.stale} throttled={self.throttled} size={self.size} "
+            f"latency={self.latency:.3f}"
+        )
+
+
+def channel_capacity(policy: str, capacity: int) -> int:
+    """
+    Get the capacity of one channel of a queue.
+
+    @param
+        policy (str): Overflow policy
+        capacity (int): Configured capacity, per source for POLICY_FAIR_SHARE
+    @return
+        capacity (int): Max items held by one channel
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown queue policy {policy}, expected one of {POLICIES}")
+    if policy == POLICY_LATEST_ONLY:
+        return 1
+    return max(1, capacity)
+
+
+def smooth_latency(average: float, latency: float) -> float:
+    """
+    Fold a latency sample into its moving average.
+
+    @param
+        average (float): Current average, 0 when there is no sample yet
+        latency (float): New sample in seconds
+    @return
+        average (float): Updated average
+    """
+    if average <= 0:
+        return latency
+    return average + LATENCY_SMOOTHING * (latency - average)
+
+
+def source_of(item: Any) -> int:
+    """
+    Get the source (camera) an item comes from.
+
+    @param
+        item (Any): Queued item
+    @return
+        source (int): Source id, 0 when the item is not tagged
+    """
+    return getattr(item, "camera_id", 0)
@@ -0,0 +1,155 @@
+"""This module is used to pace a frame stream at a rate adapted to the inference throughput."""
+import time
+from typing import Callable, Optional
+
+from queue_policy import QueueStats
+
+
+class RateController:
+    """
+    Let frames through at a target rate that can change at runtime.
+
+    With a stats source the rate is adjusted every update_interval: it backs off when the
+    queue sheds or throttles more than max_overload_rate of the frames, grows slowly
+    otherwise, and never exceeds what the workers can process at the measured latency.
+    Without a stats source the rate stays fixed.
+    """
+
+    def __init__(
+        self,
+        fps: float,
+        min_fps: Optional[float] = None,
+        max_fps: Optional[float] = None,
+        stats_source: Optional[Callable[[], QueueStats]] = None,
+        parallelism: int = 1,
+        update_interval: float = 1.0,
+        max_overload_rate: float = 0.1,
+        increase_step: float = 0.5,
+        decrease_factor: float = 0.7,
+        headroom: float = 0.9,
+        is_ready: Optional[Callable[[], bool]] = None,
+    ) -> None:
+        """
+        Initialize the rate controller.
+
+        @param
+            fps (float): Initial rate
+            min_fps (float): Lowest rate, None for fps
+            max_fps (float): Highest rate, None for fps
+            stats_source (Callable[[], QueueStats]): Stats of the queue fed by the stream, None
+                to keep the rate fixed
+            parallelism (int): Frames the workers can process at the same time
+            update_interval (float): Seconds between rate adjustments
+            max_overload_rate (float): Share of frames shed or throttled above which the rate
+                backs off
+            increase_step (float): Rate added per adjustment when not overloaded
+            decrease_factor (float): Rate multiplier per adjustment when overloaded
+            headroom (float): Share of the measured throughput the rate may reach
+            is_ready (Callable[[], bool]): Checked once a frame is due, the frame is only let
+                through if it returns True, e.g. while the queue has a free credit
+        """
+        self.min_fps = fps if min_fps is None else min_fps
+        self.max_fps = fps if max_fps is None else max_fps
+        self.fps = min(max(fps, self.min_fps), self.max_fps)
+        self.stats_source = stats_source
+        self.parallelism = parallelism
+        self.update_interval = update_interval
+        self.max_overload_rate = max_overload_rate
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.headroom = headroom
+        self.is_ready = is_ready
+        # a paused rate lets no frame through, e.g. while nobody consumes the frames
+        self.is_paused = False
+        self._next_due = None
+        self._next_update = None
+        self._last_stats = None
+
+    def due(self, now: Optional[float] = None) -> bool:
+        """
+        Check if the next frame is due, without taking it. A due frame is skipped, and the next
+        one scheduled, if is_ready returns False, as the consumer would refuse it anyway.
+
+        @param
+            now (float): time.monotonic() timestamp, None for now
+        @return
+            is_due (bool): True if a frame would be let through
+        """
+        if self.is_paused:
+            return False
+        if now is None:
+            now = time.monotonic()
+        if self._next_due is not None and now < self._next_due:
+            return False
+        if self.is_ready is not None and not self.is_ready():
+            self._schedule_next(now)
+            return False
+        return True
+
+    def take(self, now: Optional[float] = None) -> bool:
+        """
+        Let a frame through if it is due, and schedule the next one.
+
+        @param
+            now (float): time.monotonic() timestamp, None for now
+        @return
+            is_taken (bool): True if the frame is let through, False to skip it
+        """
+        if now is None:
+            now = time.monotonic()
+        self._maybe_update(now)
+        if not self.due(now):
+            return False
+        self._schedule_next(now)
+        return True
+
+    def _schedule_next(self, now: float) -> None:
+        """
+        Schedule the frame after the due one (internal).
+
+        @param
+            now (float): time.monotonic() timestamp
+        """
+        interval = 1 / self.fps
+        # keep the cadence of the schedule, unless it fell more than a frame behind
+        if self._next_due is None or now - self._next_due >= interval:
+            self._next_due = now + interval
+        else:
+            self._next_due += interval
+
+    def _maybe_update(self, now: float) -> None:
+        """
+        Adjust the rate from the queue stats once per update_interval (internal).
+
+        @param
+            now (float): time.monotonic() timestamp
+        """
+        if self.stats_source is None:
+            return
+        if self._next_update is not None and now < self._next_update:
+            return
+        self._next_update = now + self.update_interval
+        stats = self.stats_source()
+        if self._last_stats is not None:
+            self.fps = self.adjust(self._last_stats, stats)
+        self._last_stats = stats
+
+    def adjust(self, previous: QueueStats, current: QueueStats) -> float:
+        """
+        Compute the rate for the next interval.
+
+        @param
+            previous (QueueStats): Queue stats at the start of the interval
+            current (QueueStats): Queue stats at the end of the interval
+        @return
+            fps (float): New rate, within min_fps and max_fps
+        """
+        offered = (current.enqueued - previous.enqueued) + (current.throttled - previous.throttled)
+        overloaded = (current.shed - previous.shed) + (current.throttled - previous.throttled)
+        if offered > 0 and overloaded / offered > self.max_overload_rate:
+            fps = self.fps * self.decrease_factor
+        else:
+            fps = self.fps + self.increase_step
+        if current.latency > 0:
+            fps = min(fps, self.headroom * self.parallelism / current.latency)
+        return min(max(fps, self.min_fps), self.max_fps)
@@ -0,0 +1,196 @@
+"""This module is used to collect FrameProcessor results and deliver them in order."""
+import logging
+import queue
+import time
+from typing import Any, Callable, List
+
+import numpy as np
+
+from detections import DETECTION_DTYPE
+
+
+class ResultSequencer:
+    """
+    Reorder results produced by several workers by their capture sequence.
+
+    In ordered mode a result is held back only while an earlier frame is still being
+    processed by another worker, so frames dropped by the queue do not stall delivery.
+    A held result is released anyway once more than max_reorder_window results are
+    waiting or it waited longer than max_wait, e.g. when a worker died.
+    In unordered mode results are released as soon as they arrive, unless they are more
+    than max_reorder_window sequences behind the newest released result.
+    """
+
+    def __init__(self, ordered: bool = True, max_reorder_window: int = 4, max_wait: float = 2.0) -> None:
+        """
+        Initialize the sequencer.
+
+        @param
+            ordered (bool): True to deliver in capture order, False to allow out of order delivery
+            max_reorder_window (int): Max results held back (ordered) or max lag accepted (unordered)
+            max_wait (float): Max seconds a result is held back waiting for an earlier one
+        """
+        self.ordered = ordered
+        self.max_reorder_window = max_reorder_window
+        self.max_wait = max_wait
+        # sequence -> (arrival time, result)
+        self._pending = {}
+        # sequence -> time the frame was taken by a worker
+        self._in_flight = {}
+        self._last_released = -1
+        self.released_count = 0
+        self.late_count = 0
+
+    def start(self, sequences: List[int]) -> None:
+        """
+        Mark frames as being processed by a worker.
+
+        @param
+            sequences (List[int]): Sequences of the frames taken from the queue
+        """
+        now = time.monotonic()
+        for sequence in sequences:
+            if sequence > self._last_released:
+                self._in_flight[sequence] = now
+
+    def push(self, result: Any) -> List[Any]:
+        """
+        Add a result.
+
+        @param
+            result (Any): Result with a sequence attribute
+        @return
+            results (List[Any]): Results ready for delivery, in delivery order
+        """
+        self._in_flight.pop(result.sequence, None)
+        if not self.ordered:
+            if result.sequence < self._last_released - self.max_reorder_window:
+                self.late_count += 1
+                return []
+            self._last_released = max(self._last_released, result.sequence)
+            self.released_count += 1
+            return [result]
+
+        if result.sequence <= self._last_released:
+            # a later result was already delivered, this one can not be delivered in order
+            self.late_count += 1
+            return []
+        self._pending[result.sequence] = (time.monotonic(), result)
+        return self._release()
+
+    def flush_expired(self) -> List[Any]:
+        """
+        Release results that waited longer than max_wait.
+
+        @return
+            results (List[Any]): Results ready for delivery, in delivery order
+        """
+        return self._release()
+
+    def _release(self) -> List[Any]:
+        """
+        Release the results at the head of the pending results (internal).
+
+        @return
+            results (List[Any]): Results ready for delivery, in delivery order
+        """
+        released = []
+        now = time.monotonic()
+        # forget frames whose worker never answered
+        for sequence, started in list(self._in_flight.items()):
+            if now - started >= self.max_wait:
+                del self._in_flight[sequence]
+        while self._pending:
+            sequence = min(self._pending)
+            arrived, result = self._pending[sequence]
+            is_next = not any(earlier < sequence for earlier in self._in_flight)
+            is_expired = now - arrived >= self.max_wait
+            is_overflow = len(self._pending) > self.max_reorder_window
+            if not (is_next or is_expired or is_overflow):
+                break
+            del self._pending[sequence]
+            self._last_released = sequence
+            released.append(result)
+        self.released_count += len(released)
+        return released
+
+
+class ResultCollector:
+    """
+    Consume the result queue shared by the FrameProcessor workers.
+    """
+
+    def __init__(
+        self,
+        on_result: Callable[[Any], None],
+        ordered: bool = True,
+        max_reorder_window: int = 4,
+        max_wait: float = 2.0,
+    ) -> None:
+        """
+        Initialize the result collector.
+
+        @param
+            on_result (Callable[[Any], None]): Callback receiving every delivered result
+            ordered (bool): True to deliver in capture order, False to allow out of order delivery
+            max_reorder_window (int): See ResultSequencer
+            max_wait (float): See ResultSequencer
+        """
+        self.on_result = on_result
+        self.sequencer = ResultSequencer(ordered, max_reorder_window, max_wait)
+        self.is_running = False
+        # camera id -> detections of the last inferred result delivered for the camera
+        self._last_detections = {}
+        self.logger = logging.getLogger(ResultCollector.__name__)
+
+    def _resolve_detections(self, result: Any) -> None:
+        """
+        Give a result that was not inferred the detections of the last inferred result of its
+        camera delivered before it (internal).
+
+        @param
+            result (FrameProcessingResult): Result about to be delivered
+        """
+        if result.is_inferred:
+            self._last_detections[result.camera_id] = result.detections
+        elif result.detections is None:
+            # no earlier inferred result, e.g. it was dropped or overwritten in the ring buffer
+            result.detections = self._last_detections.get(result.camera_id, np.empty(0, dtype=DETECTION_DTYPE))
+
+    def run(self, result_queue: Any, frame_queue: Any = None) -> None:
+        """
+        Deliver results until stop() is called.
+
+        @param
+            result_queue (Any): multiprocessing.Queue or queue.Queue the workers put results in
+            frame_queue (Any): ProcessQueue or ThreadQueue the workers take the frames from, its
+                log of taken frames tells which results are on their way, None to not wait
+                for earlier results
+        """
+        self.is_running = True
+        self.logger.info("Starting result collector...")
+        # the frames are logged by the queue when taken, before their worker even starts on
+        # them, so an earlier frame is known to be in flight whichever result arrives first
+        cursor = 0
+        while self.is_running:
+            try:
+                result = result_queue.get(timeout=self.sequencer.max_wait / 2)
+                if frame_queue is not None:
+                    sequences, cursor = frame_queue.dequeued_since(cursor)
+                    self.sequencer.start(sequences)
+                results = self.sequencer.push(result)
+            except queue.Empty:
+                results = self.sequencer.flush_expired()
+            for result in results:
+                try:
+                    self._resolve_detections(result)
+                    self.on_result(result)
+                except Exception as ex:
+                    self.logger.exception(ex)
+                    self.logger.error(f"Error delivering result {result.correlation_id} {ex}")
+
+    def stop(self) -> None:
+        """
+        Stop delivering results.
+        """
+        self.is_running = False
@@ -1,5 +1,11 @@
+import socket
+
 from tornado import web, ioloop
 import frame_handler
+from frame_protocol import UNIX_SOCKET_PATH
+from frame_stream_server import FrameStreamServer
+import mjpeg_handler
+from ui_tiers import TIERS
 
 
 class IndexHandler(web.RequestHandler):
@@ -14,8 +20,31 @@ class IndexHandler(web.RequestHandler):
         self.render('index.html')
 
 
+class StatsHandler(web.RequestHandler):
+    """Handler for the stats endpoint, returning the counters of the
+    frame forwarding as JSON.
+
+    Args:
+        web (_type_): Request handler
+    """
+
+    def get(self):
+        self.write(
+            {
+                "compression": frame_handler.compression_stats.to_dict(),
+                "cameras": {
+                    f"{camera_id}/{TIERS[tier].name}": broadcaster.stats()
+                    for (camera_id, tier), broadcaster in frame_handler.broadcasters.items()
+                },
+            }
+        )
+
+
 app = web.Application([
     (r'/', IndexHandler),
+    (r'/stats', StatsHandler),
+    (r'/snapshot.jpg', mjpeg_handler.SnapshotHandler),
+    (r'/stream.mjpg', mjpeg_handler.MjpegHandler),
     (r'/ws/frame', frame_handler.FrameHandler),
     (r'/ws/frame_internal', frame_handler.FrameHandlerInternal),
 ])
@@ -23,6 +52,9 @@ app = web.Application([
 
 def start_server():
     app.listen(7001)
+    # FrameProviders on the same host skip the internal websocket
+    if hasattr(socket, "AF_UNIX"):
+        FrameStreamServer().listen_unix(UNIX_SOCKET_PATH)
     print("Starting server")
     ioloop.IOLoop.instance().start()
 
@@ -1,15 +1,40 @@
+import queue
 import socket
 import threading
-import time
-from typing import Any, Callable
+from typing import Any, Callable, Dict
 import websocket
 import logging
 import rel
 
+from background_sender import BackgroundSender, SenderStats, backoff_delay
+from frame_protocol import decode_message, is_binary_message
+
+
+class ThreadedRel:
+    """
+    The rel dispatcher, for connections opened outside the main thread, e.g. on reconnection.
+
+    websocket-client installs a keyboard interrupt handler on every connection, which
+    Python only allows from the main thread.
+    """
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(rel, name)
+
+    def signal(self, sig: int, callback: Callable, *args) -> None:
+        if threading.current_thread() is threading.main_thread():
+            rel.signal(sig, callback, *args)
+
+
+threaded_rel = ThreadedRel()
+
 
 class SocketClient:
     """
     Socket client to interact with WebAppApi.
+
+    Messages are sent by a background thread, see BackgroundSender, so the caller never
+    waits for the socket or for a reconnection.
     """
 
     def on_message(self, ws, message):
@@ -18,10 +43,14 @@ class SocketClient:
 
         @param
             ws (websocket): websocket object
-            message (Any): message received from websocket
+            message (Any): message received from websocket, decoded into a FrameMessage
+                when it uses the binary frame protocol
         """
-        if self.on_message_received is not None:
-            self.on_message_received(message)
+        if self.listeners:
+            if is_binary_message(message):
+                message = decode_message(message)
+            for listener in self.listeners:
+                listener(message)
 
     def on_error(self, ws, error):
         """
@@ -35,6 +64,7 @@ class SocketClient:
             f"Websocket connection ERROR for url: {self.url} error:{error}"
         )
         self.logger.exception(error)
+        self.sender.set_connected(False)
         self.reconnect()
 
     def on_close(self, ws, close_status_code, close_msg):
@@ -49,6 +79,7 @@ class SocketClient:
         self.logger.warning(
             f"Websocket connection CLOSED for url: {self.url} close_status_code:{close_status_code} close_msg:{close_msg}"
         )
+        self.sender.set_connected(False)
         self.reconnect()
 
     def on_open(self, ws):
@@ -59,6 +90,8 @@ class SocketClient:
             ws (websocket): websocket object
         """
         self.logger.info(f"Websocket connection OPENED for url: {self.url}")
+        self._reconnection_attempts = 0
+        self.sender.set_connected(True)
 
     def __init__(
         self,
@@ -68,143 +101,335 @@ class SocketClient:
         ping_interval: int = 0,
         ping_timeout: int = None,
         on_message: Callable[[Any], None] = None,
+        max_reconnection_interval: int = 30,
+        max_pending: int = 4,
+        manager: "ConnectionManager" = None,
     ):
         """
-        Initialize the socket client.
+        Initialize the socket client, see ConnectionManager.get_client to reuse a connection.
 
         @param
             url (str): url to connect to
             enable_tracing (bool): enable tracing
-            reconnection_interval (int): reconnection interval
+            reconnection_interval (int): delay of the first reconnection attempt, doubled
+                after every failed attempt
             ping_interval (int): ping interval
             ping_timeout (int): ping timeout
             on_message (Callable[[Any], None]): callback for on message
+            max_reconnection_interval (int): highest delay between reconnection attempts
+            max_pending (int): max messages waiting to be sent, the latest frame of a
+                camera tier replaces a pending one
+            manager (ConnectionManager): dispatcher of the connection, None for the
+                process-wide one
         """
         self.url = url
-        self.on_message_received = on_message
+        self.listeners = [] if on_message is None else [on_message]
+        self.manager = manager or ConnectionManager.default()
         self.logger = logging.getLogger(SocketClient.__name__)
         self.reconnection_interval = reconnection_interval
+        self.max_reconnection_interval = max_reconnection_interval
+        self._reconnection_attempts = 0
+        self._is_reconnect_scheduled = False
         self.ping_interval = ping_interval
         self.ping_timeout = ping_timeout
         websocket.enableTrace(enable_tracing)
         self.ws = None
-        self._lock_reconnect = threading.Lock()
-        self.dispatcher_thread = None
+        self._lock_reconnect = threading.RLock()
+        self.sender = BackgroundSender(
+            self._write,
+            name="SocketSender",
+            max_pending=max_pending,
+            on_failure=lambda _: self.reconnect(),
+        )
 
-    def connect(self) -> websocket.WebSocketApp:
+    def add_listener(self, on_message: Callable[[Any], None]) -> None:
         """
-        Connect to the websocket.
+        Add a callback for on message, e.g. for another user of a reused connection.
 
-        @return
-            websocket.WebSocketApp: websocket app object
-        """
-        self._lock_reconnect.acquire(blocking=True, timeout=3)
-        if not self.ws or not self.ws.sock or not self.ws.sock.connected:
-            # TODO: Add socks options like compresion, etc.
-            self.ws = websocket.WebSocketApp(
-                self.url,
-                on_open=self.on_open,
-                on_error=self.on_error,
-                on_close=self.on_close,
-                on_message=self.on_message,
-            )
-            return self.ws.run_forever(
-                sockopt=((socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),),
-                dispatcher=rel,
-                skip_utf8_validation=True,
-                ping_interval=self.ping_interval,
-                ping_timeout=self.ping_timeout,
-            )
-        self._lock_reconnect.release()
+        @param
+            on_message (Callable[[Any], None]): callback for on message
+        """
+        if on_message not in self.listeners:
+            self.listeners.append(on_message)
+
+    def connect(self) -> None:
+        """
+        Connect to the websocket, on the dispatcher thread of the manager.
+        """
+        if self.manager.is_dispatcher_thread():
+            self._open()
+        else:
+            self.manager.call_soon(self._open)
+
+    def _open(self) -> None:
+        """
+        Open the websocket unless connected, from the dispatcher thread (internal).
+        """
+        with self._lock_reconnect:
+            if not self.ws or not self.ws.sock or not self.ws.sock.connected:
+                # TODO: Add socks options like compresion, etc.
+                self.ws = websocket.WebSocketApp(
+                    self.url,
+                    on_open=self.on_open,
+                    on_error=self.on_error,
+                    on_close=self.on_close,
+                    on_message=self.on_message,
+                )
+                self.ws.run_forever(
+                    sockopt=((socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),),
+                    dispatcher=threaded_rel,
+                    skip_utf8_validation=True,
+                    ping_interval=self.ping_interval,
+                    ping_timeout=self.ping_timeout,
+                )
 
     def reconnect(self) -> None:
         """
-        Reconnect the websocket.
+        Close the websocket and schedule a connection attempt, after a delay growing
+        exponentially with the failed attempts. Returns immediately.
+        """
+        with self._lock_reconnect:
+            if self._is_reconnect_scheduled:
+                return
+            self._is_reconnect_scheduled = True
+            delay = backoff_delay(
+                self._reconnection_attempts, self.reconnection_interval, self.max_reconnection_interval
+            )
+            self._reconnection_attempts += 1
+        self.logger.warning(f"Websocket connection RECONNECTING for url: {self.url} in {delay:.1f}s")
+
+        sock = self.ws.sock if self.ws else None
+        if sock and sock.connected:
+            # the close handshake waits for the peer, keep it off the shared dispatcher thread
+            threading.Thread(
+                target=self._close_socket, args=(sock,), name="SocketClientClose", daemon=True
+            ).start()
+
+        self.manager.call_later(delay, self._reconnect_now)
+
+    def _close_socket(self, sock: websocket.WebSocket) -> None:
         """
-        self.logger.warning(f"Websocket connection RECONNECTING for url: {self.url}")
+        Close a websocket being replaced, from a short lived thread (internal).
 
+        @param
+            sock (websocket.WebSocket): Underlying socket of the closed connection
+        """
         try:
-            if self.ws.sock and self.ws.sock.connected:
-                self.ws.sock.close(
-                    status=websocket.STATUS_GOING_AWAY,
-                    reason=b"reconnecting",
-                    timeout=3,
-                )
+            sock.close(status=websocket.STATUS_GOING_AWAY, reason=b"reconnecting", timeout=3)
         except Exception as e:
             self.logger.warning(
                 f"Websocket RECONNECTING for url: {self.url}. Underlying socket close exception:{e}"
             )
             self.logger.exception(e)
 
-        time.sleep(self.reconnection_interval)
-        self.connect()
+    def _reconnect_now(self) -> None:
+        """
+        Connection attempt scheduled by reconnect, on the dispatcher thread (internal).
+        """
+        with self._lock_reconnect:
+            self._is_reconnect_scheduled = False
+        self._open()
 
     def send(self, message: Any, opcode: int = websocket.ABNF.OPCODE_TEXT) -> bool:
         """
-        Send message to the websocket.
+        Queue message for the websocket, never blocks.
 
         @param
             message (Any): message to send
             opcode (int): opcode to send
+        @return
+            result (bool): True, the message is sent by the sender thread once connected
         """
-        if not self.ws.sock or not self.ws.sock.connected:
-            self.logger.warn(f"Websocket connection NOT CONNECTED for url: {self.url}")
-            self.reconnect()
-        try:
-            self.ws.send(message, opcode)
-            return True
-        except Exception as e:
-            self.logger.warning(
-                f"FAILED sending message in websocket for url: {self.url}, Exception: {e}"
-            )
-            self.logger.exception(e)
-            self.reconnect()
-            return False
+        return self.sender.put(message, opcode)
+
+    def _write(self, message: Any, opcode: int) -> None:
+        """
+        Write message to the websocket, from the sender thread (internal).
+
+        @param
+            message (Any): message to send
+            opcode (int): opcode to send
+        """
+        self.ws.send(message, opcode)
+
+    def stats(self) -> SenderStats:
+        """
+        Get the counters of the sent messages.
+
+        @return
+            stats (SenderStats): Counters
+        """
+        return self.sender.stats()
+
+    def send_binary(self, message: bytes) -> bool:
+        """
+        Send a binary frame protocol message to the websocket.
+
+        @param
+            message (bytes): message encoded with frame_protocol.encode_message
+        """
+        return self.send(message, websocket.ABNF.OPCODE_BINARY)
 
     def start_dispatcher(self) -> None:
         """
-        Start the websocket dispatcher, need to called once.
+        Start the dispatcher of the manager, which serves every connection of the process.
+        Calling it again, from any client, has no effect.
+        """
+        self.manager.start()
+
+
+class ConnectionManager:
+    """
+    Single rel dispatcher thread serving every SocketClient of the process.
 
-        If called more than once, only for first call dispatcher will be running
-            and for rest reconnecting will not happen.
+    Connections are opened and reconnected on the dispatcher thread only, as rel is not
+    thread safe, and connections to the same url are shared. rel being global, there is
+    one manager per process, see default.
+    """
+
+    _default = None
+    _lock_default = threading.Lock()
+
+    @classmethod
+    def default(cls) -> "ConnectionManager":
         """
-        rel.safe_read()
-        self.dispatcher_thread = threading.Thread(
-            target=lambda: self._dispatch(self.reconnect)
-        )
-        self.dispatcher_thread.daemon = True
-        self.dispatcher_thread.start()
+        Get the manager of the process, created on first use.
+
+        @return
+            manager (ConnectionManager): Manager of the process
+        """
+        with cls._lock_default:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+
+    def __init__(self, poll_interval: float = 0.05) -> None:
+        """
+        Initialize the connection manager.
+
+        @param
+            poll_interval (float): Seconds between runs of the calls queued from other threads
+        """
+        self.poll_interval = poll_interval
+        self.clients: Dict[str, SocketClient] = {}
+        self.logger = logging.getLogger(ConnectionManager.__name__)
+        self._calls = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self.dispatcher_thread = None
+
+    def get_client(self, url: str, on_message: Callable[[Any], None] = None, **kwargs) -> SocketClient:
+        """
+        Get the client connected to a url, connecting it on first use.
+
+        @param
+            url (str): url to connect to
+            on_message (Callable[[Any], None]): callback for on message, added to the
+                callbacks of a reused client
+            kwargs (dict): SocketClient arguments, only used by the first call for the url
+        @return
+            client (SocketClient): Client of the url
+        """
+        with self._lock:
+            client = self.clients.get(url)
+            if client is None:
+                client = SocketClient(url, manager=self, **kwargs)
+                self.clients[url] = client
+                client.connect()
+        if on_message is not None:
+            client.add_listener(on_message)
+        return client
+
+    def is_dispatcher_thread(self) -> bool:
+        return threading.current_thread() is self.dispatcher_thread
+
+    def call_soon(self, callback: Callable, *args) -> None:
+        """
+        Run a callback on the dispatcher thread, callable from any thread.
+
+        @param
+            callback (Callable): Callback
+            args (tuple): Callback arguments
+        """
+        self._calls.put((0, callback, args))
 
-    def _dispatch(self, reconnect: Callable) -> None:
+    def call_later(self, delay: float, callback: Callable, *args) -> None:
         """
-        Wrapper for rel dispather.
+        Run a callback on the dispatcher thread after a delay, callable from any thread.
 
         @param
-            reconnect (Callable): reconnect function
+            delay (float): Seconds to wait
+            callback (Callable): Callback
+            args (tuple): Callback arguments
         """
-        _alive = True
-        while _alive:
-            _alive = False
+        self._calls.put((delay, callback, args))
+
+    def start(self) -> None:
+        """
+        Start the dispatcher thread, once.
+        """
+        with self._lock:
+            if self.dispatcher_thread is not None:
+                return
+            rel.safe_read()
+            self.dispatcher_thread = threading.Thread(target=self._dispatch, name="SocketDispatcher")
+            self.dispatcher_thread.daemon = True
+            self.dispatcher_thread.start()
+
+    def _run_calls(self) -> bool:
+        """
+        Run the calls queued from other threads, on the dispatcher thread (internal).
+
+        @return
+            is_repeated (bool): True, to keep polling
+        """
+        while True:
             try:
-                self.logger.warning(
-                    f"Websocket dispatcher STARTING for url: {self.url}"
-                )
+                delay, callback, args = self._calls.get_nowait()
+            except queue.Empty:
+                return True
+            if delay > 0:
+                rel.timeout(delay, self._run_call, callback, args)
+            else:
+                self._run_call(callback, args)
+
+    def _run_call(self, callback: Callable, args: tuple) -> None:
+        """
+        Run a queued call, its errors do not stop the dispatcher (internal).
+
+        @param
+            callback (Callable): Callback
+            args (tuple): Callback arguments
+        """
+        try:
+            callback(*args)
+        except Exception as e:
+            self.logger.exception(e)
+
+    def _dispatch(self) -> None:
+        """
+        Wrapper for rel dispather, restarting it and reconnecting every client after an
+        error (internal).
+        """
+        rel.timeout(self.poll_interval, self._run_calls)
+        while True:
+            try:
+                self.logger.warning("Websocket dispatcher STARTING")
                 rel.dispatch()
-                self.logger.warning(f"Websocket dispatcher STOPPED for url: {self.url}")
+                self.logger.warning("Websocket dispatcher STOPPED")
+                return
             except Exception as e:
-                self.logger.error(
-                    f"Websocket dispatcher EXCEPTION for url: {self.url} exception: {e}"
-                )
+                self.logger.error(f"Websocket dispatcher EXCEPTION exception: {e}")
                 self.logger.exception(e)
-                self.logger.warning(
-                    f"Websocket dispatcher RESTARTING for url: {self.url}"
-                )
-                """
-                Currently this will only reconnect the socket that is owned by this class.
-                If there are other websockets in same python process, those will not reconnect.
-
-                To handle this, main a map of url, websocket objects and reconnect all of them.
-                """
-                reconnect()
+                self.logger.warning("Websocket dispatcher RESTARTING")
+                for client in list(self.clients.values()):
+                    client.reconnect()
                 rel.rel.running = False
-                _alive = True
\ No newline at end of file
+
+    def stats(self) -> Dict[str, SenderStats]:
+        """
+        Get the counters of the sent messages of every client.
+
+        @return
+            stats (Dict[str, SenderStats]): Counters by url
+        """
+        return {url: client.stats() for url, client in self.clients.items()}
@@ -0,0 +1,212 @@
+"""This module is used to track detected objects across frames and predict their boxes between inferences."""
+import itertools
+from typing import Dict
+
+import numpy as np
+
+from detections import DETECTION_DTYPE
+
+# A tracked object: the detection fields with the box predicted at the requested time, plus a
+# stable track id and the box velocity (y1, x1, y2, x2) in pixels per second
+TRACK_DTYPE = np.dtype(
+    DETECTION_DTYPE.descr + [("track_id", np.int64), ("velocity", np.float32, (4,))]
+)
+
+
+def iou_matrix(boxes: np.ndarray, others: np.ndarray) -> np.ndarray:
+    """
+    Compute the intersection over union of every pair of boxes.
+
+    @param
+        boxes (np.ndarray): Boxes (n, 4) as (y1, x1, y2, x2)
+        others (np.ndarray): Boxes (m, 4) as (y1, x1, y2, x2)
+    @return
+        iou (np.ndarray): IoU (n, m), 0 for disjoint boxes
+    """
+    top_left = np.maximum(boxes[:, None, :2], others[None, :, :2])
+    bottom_right = np.minimum(boxes[:, None, 2:], others[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    areas = np.prod(boxes[:, 2:] - boxes[:, :2], axis=1)
+    other_areas = np.prod(others[:, 2:] - others[:, :2], axis=1)
+    union = areas[:, None] + other_areas[None, :] - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1e-9), 0.0)
+
+
+def match_greedy(iou: np.ndarray, min_iou: float) -> tuple:
+    """
+    Pair rows and columns by decreasing IoU, each at most once.
+
+    @param
+        iou (np.ndarray): IoU (n, m)
+        min_iou (float): Lowest IoU of a pair
+    @return
+        pairs (tuple): (rows, columns) index arrays of the pairs
+    """
+    iou = iou.copy()
+    rows, columns = [], []
+    # one iteration per pair, at most min(n, m), each a vectorized argmax
+    for _ in range(min(iou.shape)):
+        row, column = np.unravel_index(np.argmax(iou), iou.shape)
+        if iou[row, column] < min_iou:
+            break
+        rows.append(row)
+        columns.append(column)
+        iou[row, :] = -1
+        iou[:, column] = -1
+    return np.array(rows, dtype=np.int64), np.array(columns, dtype=np.int64)
+
+
+class Tracker:
+    """
+    Track the objects of one camera with a constant velocity model.
+
+    Detections of every inferred frame are matched to the tracks predicted at the capture
+    time of the frame, by IoU and class. A matched track takes the detected box and blends
+    the observed velocity into its own, an alpha-beta filter standing in for a Kalman
+    filter. Unmatched detections start new tracks, and tracks unmatched for longer than
+    max_age are dropped. Between inferences the boxes are extrapolated along the velocity,
+    unless the motion gate found the scene static.
+    """
+
+    def __init__(self, min_iou: float = 0.3, max_age: float = 1.0, velocity_smoothing: float = 0.5) -> None:
+        """
+        Initialize the tracker.
+
+        @param
+            min_iou (float): Lowest IoU between a predicted track and a detection to match them
+            max_age (float): Seconds a track survives without a matching detection
+            velocity_smoothing (float): Weight of the newest observed velocity, 0 to 1
+        """
+        self.min_iou = min_iou
+        self.max_age = max_age
+        self.velocity_smoothing = velocity_smoothing
+        self._track_ids = itertools.count(1)
+        # state of the tracks at their last update
+        self.tracks = np.empty(0, dtype=TRACK_DTYPE)
+        self.updated_at = np.empty(0, dtype=np.float64)
+        # last time a track was matched or held in a static scene, tracks expire max_age after it
+        self.seen_at = np.empty(0, dtype=np.float64)
+
+    def _is_alive(self, timestamp: float) -> np.ndarray:
+        """
+        Get which tracks were matched or held at most max_age before a time (internal).
+
+        @param
+            timestamp (float): Capture time of the frame
+        @return
+            is_alive (np.ndarray): bool mask of the tracks
+        """
+        return timestamp - self.seen_at <= self.max_age
+
+    def predict(self, timestamp: float) -> np.ndarray:
+        """
+        Get the tracks alive at a time, with their boxes extrapolated to it.
+
+        @param
+            timestamp (float): Capture time of the frame to predict for
+        @return
+            tracks (np.ndarray): TRACK_DTYPE array
+        """
+        is_alive = self._is_alive(timestamp)
+        tracks = self.tracks[is_alive]
+        elapsed = np.maximum(timestamp - self.updated_at[is_alive], 0.0).astype(np.float32)
+        tracks["box"] += tracks["velocity"] * elapsed[:, None]
+        return tracks
+
+    def hold(self, timestamp: float) -> np.ndarray:
+        """
+        Get the tracks alive at a time, at their last state and at rest, for a static scene.
+
+        The objects of a static scene are still there, so the tracks do not age while
+        detections are reused, and they stop moving until the next inference.
+
+        @param
+            timestamp (float): Capture time of the frame
+        @return
+            tracks (np.ndarray): TRACK_DTYPE array
+        """
+        is_alive = self._is_alive(timestamp)
+        self.tracks["velocity"][is_alive] = 0.0
+        self.seen_at[is_alive] = np.maximum(self.seen_at[is_alive], timestamp)
+        return self.tracks[is_alive]
+
+    def update(self, detections: np.ndarray, timestamp: float) -> np.ndarray:
+        """
+        Match the detections of an inferred frame to the tracks.
+
+        @param
+            detections (np.ndarray): DETECTION_DTYPE array of the frame
+            timestamp (float): Capture time of the frame
+        @return
+            tracks (np.ndarray): TRACK_DTYPE array of the tracks alive at the time
+        """
+        is_alive = self._is_alive(timestamp)
+        self.tracks = self.tracks[is_alive]
+        self.updated_at, self.seen_at = self.updated_at[is_alive], self.seen_at[is_alive]
+        predicted = self.predict(timestamp)
+        iou = iou_matrix(predicted["box"], detections["box"])
+        # a track only follows detections of its own class
+        iou[predicted["class_id"][:, None] != detections["class_id"][None, :]] = 0.0
+        rows, columns = match_greedy(iou, self.min_iou)
+
+        elapsed = (timestamp - self.updated_at[rows]).astype(np.float32)
+        moving = elapsed > 0
+        observed = (detections["box"][columns] - self.tracks["box"][rows]) / np.where(moving, elapsed, 1.0)[:, None]
+        matched = self.tracks[rows]
+        matched["velocity"] = np.where(
+            moving[:, None],
+            self.velocity_smoothing * observed + (1 - self.velocity_smoothing) * matched["velocity"],
+            matched["velocity"],
+        )
+        for name in DETECTION_DTYPE.names:
+            matched[name] = detections[name][columns]
+
+        is_new = np.ones(len(detections), dtype=bool)
+        is_new[columns] = False
+        created = np.zeros(int(is_new.sum()), dtype=TRACK_DTYPE)
+        for name in DETECTION_DTYPE.names:
+            created[name] = detections[name][is_new]
+        created["track_id"] = [next(self._track_ids) for _ in range(len(created))]
+
+        is_unmatched = np.ones(len(self.tracks), dtype=bool)
+        is_unmatched[rows] = False
+        # tracks without a detection keep coasting along their velocity until max_age
+        self.tracks = np.concatenate([matched, created, self.tracks[is_unmatched]])
+        now = np.full(len(matched) + len(created), timestamp)
+        self.updated_at = np.concatenate([now, self.updated_at[is_unmatched]])
+        self.seen_at = np.concatenate([now, self.seen_at[is_unmatched]])
+        return self.predict(timestamp)
+
+
+class CameraTrackers:
+    """
+    One tracker per camera, fed with the FrameProcessor results.
+    """
+
+    def __init__(self, **tracker_options) -> None:
+        """
+        Initialize the camera trackers.
+
+        @param
+            tracker_options (dict): Tracker arguments, see Tracker
+        """
+        self.tracker_options = tracker_options
+        self.trackers: Dict[int, Tracker] = {}
+
+    def update(self, result) -> np.ndarray:
+        """
+        Track the detections of a result.
+
+        @param
+            result (FrameProcessingResult): Result of the frame processing
+        @return
+            tracks (np.ndarray): TRACK_DTYPE array predicted at the capture time of the frame,
+                at rest for reused detections
+        """
+        tracker = self.trackers.get(result.camera_id)
+        if tracker is None:
+            tracker = self.trackers[result.camera_id] = Tracker(**self.tracker_options)
+        if not result.is_inferred:
+            # the motion gate found the scene static, the objects did not move either
+            return tracker.hold(result.captured_at)
+        return tracker.update(result.detections, result.captured_at)
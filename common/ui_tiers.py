@@ -0,0 +1,48 @@
+"""This module is used to define the resolution/fps/quality tiers UI clients subscribe to."""
+from typing import Optional
+
+
+class UiTier:
+    """
+    Variant of a camera stream produced for the UI.
+    """
+
+    def __init__(
+        self, index: int, name: str, size: Optional[tuple], fps: float, jpeg_quality: int
+    ) -> None:
+        """
+        Initialize the tier.
+
+        @param
+            index (int): Tier id, carried in the frame protocol header
+            name (str): Tier name, selected by the tier argument of /ws/frame
+            size (tuple): Frame size (width, height), None for the camera resolution
+            fps (float): Frame rate
+            jpeg_quality (int): JPEG quality, 0 to 100
+        """
+        self.index = index
+        self.name = name
+        self.size = size
+        self.fps = fps
+        self.jpeg_quality = jpeg_quality
+
+
+TIERS = [
+    UiTier(0, "thumbnail", (320, 240), 5, 60),
+    UiTier(1, "standard", (640, 480), 15, 80),
+    UiTier(2, "full", None, 15, 90),
+]
+TIERS_BY_NAME = {tier.name: tier for tier in TIERS}
+DEFAULT_TIER = TIERS_BY_NAME["standard"]
+
+
+def tier_by_name(name: Optional[str]) -> UiTier:
+    """
+    Get a tier by name.
+
+    @param
+        name (str): Tier name
+    @return
+        tier (UiTier): Tier, DEFAULT_TIER for an unknown name
+    """
+    return TIERS_BY_NAME.get(name, DEFAULT_TIER)
@@ -0,0 +1,202 @@
+"""This module is used to send frames to a server on the same host over a unix domain socket."""
+import logging
+import socket
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from background_sender import BackgroundSender, SenderStats, backoff_delay
+from frame_protocol import LENGTH_PREFIX, MESSAGE_HELLO, decode_message, encode_message, is_binary_message
+
+
+class UnixSocketClient:
+    """
+    Socket client to send frames to the server on the same host, without websocket framing,
+    masking or compression.
+
+    Every message is prefixed by its length, see frame_protocol.LENGTH_PREFIX. The client
+    binds the connection to its camera with a MESSAGE_HELLO message, and the server sends
+    the subscriber counts of the camera back on the same connection. Messages are sent
+    by a background thread, see BackgroundSender.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        camera_id: Optional[int],
+        reconnection_interval: int = 3,
+        on_message: Callable[[Any], None] = None,
+        max_reconnection_interval: int = 30,
+        max_pending: int = 4,
+    ) -> None:
+        """
+        Initialize the socket client.
+
+        @param
+            path (str): Path of the unix socket of the server
+            camera_id (int): Camera of the frames sent by the client, None for a connection
+                only sending messages, e.g. detections, that is not bound to a camera
+            reconnection_interval (int): Delay of the first reconnection attempt, doubled after
+                every failed attempt
+            on_message (Callable[[Any], None]): callback for on message, called with a
+                FrameMessage from the reader thread
+            max_reconnection_interval (int): Highest delay between reconnection attempts
+            max_pending (int): Max messages waiting to be sent, the latest frame of a camera
+                tier replaces a pending one
+        """
+        self.path = path
+        self.camera_id = camera_id
+        self.reconnection_interval = reconnection_interval
+        self.max_reconnection_interval = max_reconnection_interval
+        self.on_message_received = on_message
+        self.logger = logging.getLogger(UnixSocketClient.__name__)
+        self.sock: Optional[socket.socket] = None
+        self.reader_thread = None
+        self.sender = BackgroundSender(
+            self._write,
+            name=f"UnixSocketSender-{camera_id}",
+            max_pending=max_pending,
+            on_failure=lambda _: self._shutdown(),
+        )
+
+    def start(self) -> None:
+        """
+        Start connecting in the background, reconnecting whenever the connection drops.
+        """
+        self.reader_thread = threading.Thread(
+            target=self._run, name=f"UnixSocketClient-{self.camera_id}", daemon=True
+        )
+        self.reader_thread.start()
+
+    @property
+    def is_connected(self) -> bool:
+        return self.sock is not None
+
+    def _run(self) -> None:
+        """
+        Connect, read the messages of the server until the connection drops, repeat (internal).
+        """
+        attempts = 0
+        while True:
+            try:
+                self._connect()
+                attempts = 0
+                self._read_messages()
+            except OSError as e:
+                self.logger.warning(f"Unix socket connection ERROR for path: {self.path} error:{e}")
+            self._disconnect()
+            time.sleep(backoff_delay(attempts, self.reconnection_interval, self.max_reconnection_interval))
+            attempts += 1
+
+    def _connect(self) -> None:
+        """
+        Connect to the server and bind the connection to the camera (internal).
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+            if self.camera_id is not None:
+                hello = encode_message(MESSAGE_HELLO, self.camera_id, 0, "", b"")
+                sock.sendall(LENGTH_PREFIX.pack(len(hello)) + hello)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+        self.sender.set_connected(True)
+        self.logger.info(f"Unix socket connection OPENED for path: {self.path}")
+
+    def _disconnect(self) -> None:
+        """
+        Close the connection (internal).
+        """
+        self.sender.set_connected(False)
+        sock, self.sock = self.sock, None
+        if sock is not None:
+            sock.close()
+            self.logger.warning(f"Unix socket connection CLOSED for path: {self.path}")
+
+    def _read_messages(self) -> None:
+        """
+        Read messages until the server closes the connection (internal).
+        """
+        reader = self.sock.makefile("rb")
+        while True:
+            prefix = reader.read(LENGTH_PREFIX.size)
+            if len(prefix) < LENGTH_PREFIX.size:
+                return
+            (length,) = LENGTH_PREFIX.unpack(prefix)
+            message = reader.read(length)
+            if len(message) < length:
+                return
+            if self.on_message_received is not None and is_binary_message(message):
+                self._handle_message(message)
+
+    def _handle_message(self, message: bytes) -> None:
+        """
+        Pass a message to the callback, its errors do not stop the reader thread (internal).
+
+        @param
+            message (bytes): Binary frame protocol message
+        """
+        try:
+            self.on_message_received(decode_message(message))
+        except Exception as e:
+            self.logger.exception(e)
+
+    def send(self, message: Any, opcode: int = None) -> bool:
+        """
+        Queue message for the server, never blocks.
+
+        @param
+            message (Any): message to send, str for legacy JSON
+            opcode (int): ignored, for compatibility with SocketClient
+        @return
+            result (bool): True, the message is sent by the sender thread once connected
+        """
+        return self.sender.put(message, opcode)
+
+    def send_binary(self, message: bytes) -> bool:
+        """
+        Send a binary frame protocol message to the server.
+
+        @param
+            message (bytes): message encoded with frame_protocol.encode_message
+        """
+        return self.send(message)
+
+    def _write(self, message: Any, opcode: int) -> None:
+        """
+        Write message to the socket, from the sender thread (internal).
+
+        @param
+            message (Any): message to send
+            opcode (int): ignored
+        """
+        if isinstance(message, str):
+            message = message.encode("utf-8")
+        sock = self.sock
+        if sock is None:
+            raise ConnectionError("Unix socket not connected")
+        # two writes rather than concatenating, to not copy the frame
+        sock.sendall(LENGTH_PREFIX.pack(len(message)))
+        sock.sendall(message)
+
+    def _shutdown(self) -> None:
+        """
+        Shut the connection down after a failed write, the reader thread reconnects (internal).
+        """
+        sock = self.sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def stats(self) -> SenderStats:
+        """
+        Get the counters of the sent messages.
+
+        @return
+            stats (SenderStats): Counters
+        """
+        return self.sender.stats()
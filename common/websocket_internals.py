@@ -0,0 +1,96 @@
+"""This module is used to isolate the uses of tornado websocket internals, falling back to its public API."""
+import logging
+from typing import Any, Callable
+
+from tornado import websocket
+
+logger = logging.getLogger(__name__)
+_is_fallback_logged = False
+
+
+def has_internals(connection: Any) -> bool:
+    """
+    Check that a connection has the private attributes of the tornado version in
+    requirements.txt: the permessage-deflate compressor and the stream of the socket.
+
+    @param
+        connection (WebSocketProtocol): ws_connection of a handler
+    @return
+        has_internals (bool): True if the attributes exist, False to use the public API
+    """
+    global _is_fallback_logged
+    if (
+        isinstance(connection, websocket.WebSocketProtocol13)
+        and hasattr(connection, "_compressor")
+        and hasattr(connection, "stream")
+    ):
+        return True
+    if not _is_fallback_logged:
+        _is_fallback_logged = True
+        logger.warning("Tornado websocket internals not found, shared frames and selective compression are off")
+    return False
+
+
+def is_compressing(connection: Any) -> bool:
+    """
+    Check whether a connection negotiated permessage-deflate.
+
+    @param
+        connection (WebSocketProtocol): ws_connection of a handler
+    @return
+        is_compressing (bool): True if messages are compressed, False if not or unknown
+    """
+    return has_internals(connection) and connection._compressor is not None
+
+
+def wrap_compressor(connection: Any, wrap: Callable[[Any], Any]) -> None:
+    """
+    Replace the compressor of a connection by a wrapper, e.g. to measure it.
+
+    @param
+        connection (WebSocketProtocol): ws_connection of a handler
+        wrap (Callable[[Any], Any]): Called with the compressor, returns its replacement
+    """
+    if is_compressing(connection):
+        connection._compressor = wrap(connection._compressor)
+
+
+def write_uncompressed(handler: websocket.WebSocketHandler, message, binary: bool):
+    """
+    Write a message without compressing it, as permessage-deflate allows per message.
+
+    @param
+        handler (WebSocketHandler): Websocket handler of the client
+        message (bytes | str): Message
+        binary (bool): True to send a binary message
+    @return
+        future (Future): Future of the write
+    """
+    connection = handler.ws_connection
+    if not has_internals(connection):
+        return handler.write_message(message, binary=binary)
+    # tornado compresses every message while a compressor is set
+    compressor, connection._compressor = connection._compressor, None
+    try:
+        return handler.write_message(message, binary=binary)
+    finally:
+        connection._compressor = compressor
+
+
+def write_frame(handler: websocket.WebSocketHandler, frame: bytes, message, binary: bool):
+    """
+    Write a websocket frame built beforehand straight to the socket, so that the same bytes
+    serve every client.
+
+    @param
+        handler (WebSocketHandler): Websocket handler of the client
+        frame (bytes): Unmasked, uncompressed websocket frame of the message
+        message (bytes | str): Message, written through tornado when its internals are missing
+        binary (bool): True to send a binary message
+    @return
+        future (Future): Future of the write
+    """
+    connection = handler.ws_connection
+    if not has_internals(connection):
+        return handler.write_message(message, binary=binary)
+    return connection.stream.write(frame)
@@ -0,0 +1,147 @@
+"""This module is used to provide a shared memory frame ring buffer between processes."""
+import threading
+from multiprocessing import shared_memory
+from typing import Optional
+
+import numpy as np
+
+# Header value of a slot while its frame is being written
+SLOT_WRITING = -1
+
+
+class FrameSlot:
+    """
+    Descriptor of a frame written into the ring buffer, small enough to cross a queue cheaply.
+    """
+
+    def __init__(
+        self, index: int, write_sequence: int, correlation_id: str, shape: tuple, dtype: str
+    ) -> None:
+        self.index = index
+        self.write_sequence = write_sequence
+        self.correlation_id = correlation_id
+        self.shape = shape
+        self.dtype = dtype
+
+
+class FrameRingBuffer:
+    """
+    Ring of fixed size frame slots in shared memory, with a single writer process.
+
+    Every slot has a header holding the write sequence of the frame it contains, so a reader
+    can detect that the writer has wrapped around and overwritten the frame it was sent.
+    """
+
+    def __init__(self, slot_count: int, slot_bytes: int, name: Optional[str] = None) -> None:
+        """
+        Create the shared memory, or attach to an existing one when name is given.
+
+        @param
+            slot_count (int): Number of frame slots
+            slot_bytes (int): Max size of a frame in bytes
+            name (str): Name of the shared memory to attach to, None to create it
+        """
+        self.slot_count = slot_count
+        self.slot_bytes = slot_bytes
+        self.header_bytes = slot_count * np.dtype(np.int64).itemsize
+        self.is_owner = name is None
+        self.shm = shared_memory.SharedMemory(
+            name=name, create=self.is_owner, size=self.header_bytes + slot_count * slot_bytes
+        )
+        self.header = np.ndarray((slot_count,), dtype=np.int64, buffer=self.shm.buf)
+        if self.is_owner:
+            self.header.fill(SLOT_WRITING)
+        self._write_sequence = 0
+        # the writer process may write from several capture threads
+        self._write_locker = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        return {"name": self.shm.name, "slot_count": self.slot_count, "slot_bytes": self.slot_bytes}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state["slot_count"], state["slot_bytes"], name=state["name"])
+
+    def _slot_array(self, index: int, shape: tuple, dtype: str) -> np.ndarray:
+        """
+        Get a numpy view of a slot (internal).
+
+        @param
+            index (int): Slot index
+            shape (tuple): Frame shape
+            dtype (str): Frame dtype
+        @return
+            frame (np.ndarray): View on the shared memory
+        """
+        return np.ndarray(
+            shape,
+            dtype=dtype,
+            buffer=self.shm.buf,
+            offset=self.header_bytes + index * self.slot_bytes,
+        )
+
+    def can_hold(self, frame: np.ndarray) -> bool:
+        """
+        Check if a frame fits in a slot.
+
+        @param
+            frame (np.ndarray): Frame
+        @return
+            can_hold (bool): True if the frame fits
+        """
+        return frame.nbytes <= self.slot_bytes
+
+    def write(self, frame: np.ndarray, correlation_id: str) -> FrameSlot:
+        """
+        Copy a frame into the next slot, must only be called by a single writer process.
+
+        @param
+            frame (np.ndarray): Frame
+            correlation_id (str): Correlation id of the frame
+        @return
+            slot (FrameSlot): Descriptor of the written frame
+        """
+        with self._write_locker:
+            write_sequence = self._write_sequence
+            self._write_sequence += 1
+        index = write_sequence % self.slot_count
+        self.header[index] = SLOT_WRITING
+        np.copyto(self._slot_array(index, frame.shape, frame.dtype.str), frame)
+        self.header[index] = write_sequence
+        return FrameSlot(index, write_sequence, correlation_id, frame.shape, frame.dtype.str)
+
+    def read(self, slot: FrameSlot) -> Optional[np.ndarray]:
+        """
+        Get a zero copy view of a frame.
+
+        The view stays valid until the writer wraps around the ring, so the ring must have
+        more slots than frames that can be queued and processed at the same time. Check
+        is_valid again once done with the view, its content is only trustworthy if it holds.
+
+        @param
+            slot (FrameSlot): Descriptor of the frame
+        @return
+            frame (np.ndarray): View of the frame, None if it was already overwritten
+        """
+        if not self.is_valid(slot):
+            return None
+        return self._slot_array(slot.index, slot.shape, slot.dtype)
+
+    def is_valid(self, slot: FrameSlot) -> bool:
+        """
+        Check if a slot still holds the frame of the descriptor.
+
+        @param
+            slot (FrameSlot): Descriptor of the frame
+        @return
+            is_valid (bool): True if the frame was not overwritten
+        """
+        return int(self.header[slot.index]) == slot.write_sequence
+
+    def close(self) -> None:
+        """
+        Detach from the shared memory, and free it when owned.
+        """
+        self.header = None
+        self.shm.close()
+        if self.is_owner:
+            self.shm.unlink()
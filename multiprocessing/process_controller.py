@@ -1,12 +1,19 @@
 """This module is used to provide the process controller."""
 
 import logging
+import os
+import threading
 from multiprocessing import Process
 from multiprocessing.context import DefaultContext
 from process_queue import ProcessQueue
+from frame_ring_buffer import FrameRingBuffer
+from queue_policy import POLICY_FAIR_SHARE, POLICY_LATEST_ONLY
 
 import frame_provider
-from frame_processor import FrameProcessor
+from detection_publisher import DetectionPublisher
+from frame_processor import FrameProcessor, FrameProcessingResult
+from result_collector import ResultCollector
+from tracker import CameraTrackers
 
 class ProcessController:
     """
@@ -21,8 +28,42 @@ class ProcessController:
         """
         self.multiprocessing_context = multiprocessing_context
         self.queue = ProcessQueue()
+        # video sources, one camera each, all feeding the same workers
+        self.camera_sources = frame_provider.DEFAULT_SOURCES
+        # overflow policy of the frame queue, see queue_policy, None to serve the cameras in
+        # turn when there are several, picked on start from camera_sources
+        self.queue_policy = None
+        self.queue_capacity = 1
+        self.result_queue = None
+        # frames cross from process one to process two through shared memory
+        self.use_shared_memory = True
+        self.frame_ring_buffer = None
+        self.frame_ring_buffer_slot_bytes = 640 * 480 * 3
         self.process_one = None
-        self.process_two = None
+        # pool of FrameProcessor workers, all fed from the same queue
+        self.process_two_pool = []
+        self.process_two_count = 2
+        # frames inferred at once by every worker, see FrameProcessor.batch_size
+        self.batch_size = 1
+        # frames are only produced when a worker is ready to take them, False to produce frames
+        # at the configured rate
+        self.queue_backpressure = True
+        # max credits of the queue, None for one per frame of the batch of every worker, so that
+        # every worker can fill its batch
+        self.queue_max_credits = None
+        # deliver results in capture order, or out of order within the reorder window
+        self.ordered_results = True
+        self.max_reorder_window = self.process_two_count
+        # more slots than frames that can be queued and in process at once, see FrameRingBuffer.read,
+        # None to size the ring on start from camera_sources
+        self.frame_ring_buffer_slot_count = None
+        # detections of every result are overlaid on the frames of the UI
+        self.detection_publisher = DetectionPublisher()
+        # stable ids and velocities of the detected objects, the UI extrapolates their boxes
+        # to the frames between inferences
+        self.trackers = CameraTrackers(min_iou=0.3, max_age=1.0)
+        self.result_collector = None
+        self.result_collector_thread = None
         self.logger = logging.getLogger(__name__)
 
     def start(self) -> bool:
@@ -35,31 +76,71 @@ class ProcessController:
         if self.process_one is not None and self.process_one.is_alive():
             self.logger.info("process_one is already running...")
             return False
-        if self.process_two is not None and self.process_two.is_alive():
+        if any(process.is_alive() for process in self.process_two_pool):
             self.logger.info("process_two is already running...")
             return False
 
-        # Creating empty queue
-        self.queue = ProcessQueue()
+        # Creating empty queues, sized for the cameras configured by now
+        source_count = len(self.camera_sources)
+        in_flight_count = self.process_two_count * self.batch_size
+        max_credits = None
+        if self.queue_backpressure:
+            max_credits = self.queue_max_credits if self.queue_max_credits is not None else in_flight_count
+        queue_policy = self.queue_policy
+        if queue_policy is None:
+            queue_policy = POLICY_FAIR_SHARE if source_count > 1 else POLICY_LATEST_ONLY
+        if self.use_shared_memory:
+            slot_count = self.frame_ring_buffer_slot_count
+            if slot_count is None:
+                slot_count = 4 * in_flight_count + self.queue_capacity * source_count + 4
+            self.frame_ring_buffer = FrameRingBuffer(slot_count, self.frame_ring_buffer_slot_bytes)
+        self.queue = ProcessQueue(
+            self.frame_ring_buffer,
+            policy=queue_policy,
+            capacity=self.queue_capacity,
+            source_count=source_count,
+            max_credits=max_credits,
+        )
+        self.result_queue = self.multiprocessing_context.Queue()
         # Creating process one
         self.process_one = self.multiprocessing_context.Process(
             target=frame_provider.run,
-            args=((self.queue),),
+            args=(self.queue, self.camera_sources),
             name="ProcessOne",
         )
         # Starting process one as a daemon process
         self.process_one.daemon = True
         self.process_one.start()
 
-        # Creating process two
-        self.process_two = self.multiprocessing_context.Process(
-            target=FrameProcessor().run,
-            args=((self.queue),),
-            name="ProcessTwo",
+        # Creating process two pool, splitting the cores between the workers
+        intra_op_num_threads = max(1, (os.cpu_count() or 1) // self.process_two_count)
+        self.process_two_pool = []
+        for index in range(self.process_two_count):
+            frame_processor = FrameProcessor(intra_op_num_threads=intra_op_num_threads)
+            frame_processor.batch_size = self.batch_size
+            process_two = self.multiprocessing_context.Process(
+                target=frame_processor.run,
+                args=(self.queue, self.result_queue),
+                name=f"ProcessTwo-{index}",
+            )
+            # Starting process two as a daemon process
+            process_two.daemon = True
+            process_two.start()
+            self.process_two_pool.append(process_two)
+
+        # Collecting results of the process two pool
+        self.result_collector = ResultCollector(
+            on_result=self._on_result,
+            ordered=self.ordered_results,
+            max_reorder_window=self.max_reorder_window,
         )
-        # Starting process two as a daemon process
-        self.process_two.daemon = True
-        self.process_two.start()
+        self.result_collector_thread = threading.Thread(
+            target=self.result_collector.run,
+            args=(self.result_queue, self.queue),
+            name="ResultCollector",
+            daemon=True,
+        )
+        self.result_collector_thread.start()
         self.logger.info("Started all processes...")
         return True
 
@@ -74,13 +155,23 @@ class ProcessController:
             self._terminate_process(self.process_one)
             self.process_one = None
             self.logger.info("process_one is stopped...")
-        if self.process_two is not None and self.process_two.is_alive():
-            self._terminate_process(self.process_two)
-            self.process_two = None
-            self.logger.info("process_two is stopped...")
+        for process_two in self.process_two_pool:
+            if process_two.is_alive():
+                self._terminate_process(process_two)
+                self.logger.info(f"{process_two.name} is stopped...")
+        self.process_two_pool = []
+        if self.result_collector is not None:
+            self.result_collector.stop()
+            self.result_collector = None
 
         # Empty queue
-        self.queue.work_queue.close()
+        self.logger.info(f"Queue stats: {self.queue.stats()}")
+        self.queue.close()
+        if self.result_queue is not None:
+            self.result_queue.close()
+        if self.frame_ring_buffer is not None:
+            self.frame_ring_buffer.close()
+            self.frame_ring_buffer = None
         self.logger.info("Queue is cleared...")
         self.logger.info("Stopped all processes...")
         return True
@@ -97,6 +188,23 @@ class ProcessController:
         self.logger.info("Restarted all processes...")
         return result
 
+    def _on_result(self, result: FrameProcessingResult) -> None:
+        """
+        Handle a result of the process two pool, delivered in the configured order.
+
+        @param
+            result (FrameProcessingResult): Result of the frame processing
+        """
+        self.logger.info(
+            f"Result for {result.correlation_id} of camera {result.camera_id}: "
+            f"{len(result.boxes)} detections ({'inferred' if result.is_inferred else 'reused'}), "
+            f"time taken for inference: {result.inference_time}, "
+            f"time spent in queue: {result.queue_dwell_time}"
+        )
+        tracks = self.trackers.update(result)
+        self.logger.debug(f"Tracked objects of camera {result.camera_id}: {len(tracks)}")
+        self.detection_publisher.publish(result, tracks)
+
     def _terminate_process(self, process: Process, retry_count: int = 0) -> None:
         """
         Terminate the process with retry (internal).
@@ -1,60 +1,360 @@
 """This module is used to provide process queue for communication between processes."""
+import copy
 import multiprocessing
-from typing import Any
+import queue
+import time
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+
+from frame_ring_buffer import FrameRingBuffer
+from queue_policy import (
+    DEQUEUED_LOG_SIZE,
+    POLICY_FAIR_SHARE,
+    POLICY_DROP_NEWEST,
+    POLICY_LATEST_ONLY,
+    STAT_COUNT,
+    STAT_DEQUEUED,
+    STAT_DROPPED,
+    STAT_ENQUEUED,
+    STAT_STALE,
+    STAT_THROTTLED,
+    QueueStats,
+    channel_capacity,
+    smooth_latency,
+    source_of,
+)
 
 
 class ProcessQueue:
     """
     Process queue for communication between processes.
+
+    Items are held in one channel, or one channel per source with POLICY_FAIR_SHARE. Channel
+    sizes and counters live in shared memory guarded by a lock that is only held for
+    bookkeeping, and a semaphore counts the items so that readers block until one is added.
     """
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        ring_buffer: Optional[FrameRingBuffer] = None,
+        policy: str = POLICY_LATEST_ONLY,
+        capacity: int = 1,
+        source_count: int = 1,
+        max_credits: Optional[int] = None,
+    ) -> None:
         """
-        Initialize the process queue, with max length of 1.
+        Initialize the process queue, by default keeping only the newest item.
+
+        @param:
+            ring_buffer (FrameRingBuffer): Shared memory frames are transported through, so that
+                only small slot descriptors are pickled, None to pickle the frames
+            policy (str): Overflow policy, see queue_policy
+            capacity (int): Max items, per source for POLICY_FAIR_SHARE
+            source_count (int): Number of sources served in turn by POLICY_FAIR_SHARE
+            max_credits (int): Max items readers can be ready to take at once, the writer only
+                produces an item when it gets a credit, None to disable the backpressure
         """
-        self.maxlen = 1
-        self.work_queue = multiprocessing.Queue(self.maxlen)
+        self.ring_buffer = ring_buffer
+        self.max_credits = max_credits
+        # items the readers are ready to take, granted by readers and spent by the writer
+        self.credits = multiprocessing.Value("i", 0, lock=False)
+        # moving average of the seconds readers take to process a batch
+        self.latency = multiprocessing.Value("d", 0.0, lock=False)
+        self.policy = policy
+        self.maxlen = channel_capacity(policy, capacity)
+        channel_count = source_count if policy == POLICY_FAIR_SHARE else 1
+        self.channels = [multiprocessing.Queue() for _ in range(channel_count)]
+        # items added and not yet claimed by a reader, per channel
+        self.sizes = multiprocessing.Array("i", channel_count, lock=False)
+        self.counters = multiprocessing.Array("q", STAT_COUNT, lock=False)
+        # next channel to serve with POLICY_FAIR_SHARE
+        self.cursor = multiprocessing.Value("i", 0, lock=False)
+        # sequences of the items taken by readers, in a ring, and how many were ever logged
+        self.dequeued_log = multiprocessing.Array("q", DEQUEUED_LOG_SIZE, lock=False)
+        self.dequeued_total = multiprocessing.Value("q", 0, lock=False)
+        self.available = multiprocessing.Semaphore(0)
         self.locker = multiprocessing.Lock()
         self.locker_timeout = 0.5
-        self.get_timeout = 0.5
         self.put_timeout = 0.5
 
+    def grant_credits(self, count: int) -> None:
+        """
+        Signal that a reader is ready to take items, called by the readers.
+
+        @param:
+            count (int): Number of items the reader is ready to take
+        """
+        if self.max_credits is None:
+            return
+        with self.locker:
+            self.credits.value = min(self.max_credits, self.credits.value + count)
+
+    def has_credit(self) -> bool:
+        """
+        Check that a credit is free without spending it, called by the writer before paying
+        for an item it may skip. A missing credit counts as a throttled item.
+
+        @return:
+            has_credit (bool): True if a reader is ready to take an item, False to skip it
+        """
+        if self.max_credits is None:
+            return True
+        with self.locker:
+            if self.credits.value > 0:
+                return True
+            self.counters[STAT_THROTTLED] += 1
+            return False
+
+    def try_acquire_credit(self) -> bool:
+        """
+        Spend a credit before producing an item, called by the writer. Never waits.
+
+        @return:
+            has_credit (bool): True if a reader is ready to take the item, False to skip it
+        """
+        if self.max_credits is None:
+            return True
+        with self.locker:
+            if self.credits.value > 0:
+                self.credits.value -= 1
+                return True
+            self.counters[STAT_THROTTLED] += 1
+            return False
+
+    def report_latency(self, latency: float) -> None:
+        """
+        Report the seconds a reader took to process a batch, called by the readers.
+
+        @param:
+            latency (float): Processing time of the batch
+        """
+        with self.locker:
+            self.latency.value = smooth_latency(self.latency.value, latency)
+
     def add_item(self, item: Any) -> bool:
         """
-        Add item to the queue and lock the queue during adding.
+        Add item to the queue, applying the overflow policy when full. Never waits for room.
 
         @param:
             item (Any): item object to be added to the queue
         @return:
-            is_added (bool): True if the item is added, False otherwise
+            is_added (bool): True if the item is added, False if it was dropped
         """
-        # multiprocessing.Lock can handle maximum processes matching the number of cores
-        if self.locker.acquire(timeout=self.locker_timeout):
-            self.clear()
-            try:
-                self.work_queue.put(item, timeout=self.put_timeout)
-            except Exception:
-                self.locker.release()
-                return False
+        channel = source_of(item) % len(self.channels)
+        # the lock is only held for bookkeeping, by readers and writers alike
+        if not self.locker.acquire(timeout=self.locker_timeout):
+            return False
+        try:
+            if self.sizes[channel] >= self.maxlen:
+                if self.policy == POLICY_DROP_NEWEST or not self._evict(channel):
+                    self.counters[STAT_DROPPED] += 1
+                    return False
+            # reserve the place of the item, readers only look for it once the semaphore is released
+            self.sizes[channel] += 1
+            self.counters[STAT_ENQUEUED] += 1
+        finally:
             self.locker.release()
-            return True
-        else:
+        # only admitted frames take a ring slot, a dropped one must not overwrite a queued one
+        item = self._detach_frame(item)
+        # wall clock, as it is compared across processes
+        item.enqueued_at = time.time()
+        self.channels[channel].put(item)
+        self.available.release()
+        return True
+
+    def _evict(self, channel: int) -> bool:
+        """
+        Drop the oldest unclaimed item of a channel, called with the lock held (internal).
+
+        Never waits, so the writer and the readers waiting for the lock are not held up. An
+        item still being flushed by the feeder thread of the channel can not be evicted yet.
+
+        @param:
+            channel (int): Channel index
+        @return:
+            is_evicted (bool): True if an item was dropped, False to drop the new item instead
+        """
+        try:
+            self.channels[channel].get_nowait()
+        except queue.Empty:
             return False
+        self.sizes[channel] -= 1
+        self.counters[STAT_STALE] += 1
+        # the semaphore token of the evicted item is consumed by a reader finding nothing
+        return True
 
     def get_item(self) -> Any:
         """
-        Get item from the queue.
+        Get item from the queue, without waiting.
 
         @return:
-            item (Any): item object from the queue
+            item (Any): item object from the queue, None if the queue is empty
+        """
+        return self.wait_for_item(timeout=0)
+
+    def wait_for_item(self, timeout: Optional[float]) -> Any:
+        """
+        Wait for the next item, returning as soon as one is added.
+
+        The wait blocks on a semaphore released by the writer instead of polling. Several
+        readers can wait at once, every item is handed to only one of them.
+
+        @param:
+            timeout (float): max seconds to wait, 0 to not wait, None to wait forever
+        @return:
+            item (Any): item object from the queue, None if no item was added in time
         """
-        if not self.is_empty():
-            if self.locker.acquire(timeout=self.locker_timeout):
-                item = self.work_queue.get(timeout=self.get_timeout)
-                self.locker.release()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if remaining == 0:
+                is_available = self.available.acquire(block=False)
+            else:
+                is_available = self.available.acquire(timeout=remaining)
+            if not is_available:
+                return None
+            channel = self._claim()
+            if channel is None:
+                # token of an evicted item, wait for the next one
+                continue
+            try:
+                item = self.channels[channel].get(timeout=self.put_timeout)
+            except queue.Empty:
+                return None
+            item.dequeued_at = time.time()
+            item = self._attach_frame(item)
+            if item is not None:
+                self._log_dequeued(item)
                 return item
+
+    def is_frame_intact(self, item: Any) -> bool:
+        """
+        Check that the frame of a taken item was not overwritten while in use, called by the
+        readers once done with the frame. An overwritten frame is counted as stale.
+
+        @param:
+            item (Any): item object from the queue
+        @return:
+            is_intact (bool): True if the frame still holds, False if the writer wrapped around
+        """
+        frame_slot = getattr(item, "frame_slot", None)
+        if frame_slot is None or self.ring_buffer.is_valid(frame_slot):
+            return True
+        self._count_stale_dequeued()
+        return False
+
+    def _count_stale_dequeued(self) -> None:
+        """
+        Count a dequeued item whose frame was overwritten as stale instead (internal).
+        """
+        with self.locker:
+            self.counters[STAT_DEQUEUED] -= 1
+            self.counters[STAT_STALE] += 1
+
+    def _log_dequeued(self, item: Any) -> None:
+        """
+        Log the sequence of an item handed to a reader (internal).
+
+        @param:
+            item (Any): item object with a sequence attribute
+        """
+        with self.locker:
+            total = self.dequeued_total.value
+            self.dequeued_log[total % DEQUEUED_LOG_SIZE] = item.sequence
+            self.dequeued_total.value = total + 1
+
+    def dequeued_since(self, cursor: int) -> Tuple[List[int], int]:
+        """
+        Get the sequences of the items handed to readers since a previous call, called by the
+        result collector to know which results are on their way as soon as a frame is taken.
+
+        @param:
+            cursor (int): Cursor returned by the previous call, 0 for the first call
+        @return:
+            sequences (List[int]): Sequences of the items taken since, the oldest ones are lost
+                when more than DEQUEUED_LOG_SIZE were taken
+            cursor (int): Cursor for the next call
+        """
+        with self.locker:
+            total = self.dequeued_total.value
+            start = max(cursor, total - DEQUEUED_LOG_SIZE)
+            sequences = [self.dequeued_log[index % DEQUEUED_LOG_SIZE] for index in range(start, total)]
+        return sequences, total
+
+    def _claim(self) -> Optional[int]:
+        """
+        Claim an item, serving the channels in turn (internal).
+
+        @return:
+            channel (int): Channel holding the claimed item, None if all channels are empty
+        """
+        with self.locker:
+            channel_count = len(self.channels)
+            for offset in range(channel_count):
+                channel = (self.cursor.value + offset) % channel_count
+                if self.sizes[channel] > 0:
+                    self.sizes[channel] -= 1
+                    self.counters[STAT_DEQUEUED] += 1
+                    self.cursor.value = (channel + 1) % channel_count
+                    return channel
         return None
 
+    def _detach_frame(self, item: Any) -> Any:
+        """
+        Move the frame of an item into the ring buffer (internal).
+
+        @param:
+            item (Any): item object with a frame attribute
+        @return:
+            item (Any): copy of the item carrying a frame_slot descriptor instead of the frame
+        """
+        frame = getattr(item, "frame", None)
+        if self.ring_buffer is None or not isinstance(frame, np.ndarray):
+            return item
+        if not self.ring_buffer.can_hold(frame):
+            return item
+        item = copy.copy(item)
+        item.frame_slot = self.ring_buffer.write(frame, item.correlation_id)
+        item.frame = None
+        return item
+
+    def _attach_frame(self, item: Any) -> Any:
+        """
+        Resolve the frame of an item from the ring buffer (internal).
+
+        @param:
+            item (Any): item object from the queue
+        @return:
+            item (Any): item object with its frame, None if the frame was overwritten
+        """
+        frame_slot = getattr(item, "frame_slot", None)
+        if item is None or frame_slot is None:
+            return item
+        item.frame = self.ring_buffer.read(frame_slot)
+        if item.frame is None:
+            self._count_stale_dequeued()
+            return None
+        return item
+
+    def stats(self) -> QueueStats:
+        """
+        Get a snapshot of the queue counters.
+
+        @return:
+            stats (QueueStats): Counters of the queue
+        """
+        with self.locker:
+            return QueueStats(
+                enqueued=self.counters[STAT_ENQUEUED],
+                dropped=self.counters[STAT_DROPPED],
+                stale=self.counters[STAT_STALE],
+                dequeued=self.counters[STAT_DEQUEUED],
+                size=sum(self.sizes),
+                throttled=self.counters[STAT_THROTTLED],
+                latency=self.latency.value,
+            )
+
     def is_empty(self) -> bool:
         """
         Check if the queue is empty.
@@ -62,14 +362,18 @@ class ProcessQueue:
         @return:
             is_empty (bool): True if the queue is empty, False otherwise
         """
-        return self.work_queue.empty()
+        return sum(self.sizes) == 0
 
     def clear(self) -> None:
         """
         Clear the queue.
         """
-        while not self.is_empty():
-            try:
-                self.work_queue.get(block=False)
-            except Exception as ex:
-                print(ex)
+        while self.get_item() is not None:
+            pass
+
+    def close(self) -> None:
+        """
+        Close the queue channels.
+        """
+        for channel in self.channels:
+            channel.close()
@@ -0,0 +1,46 @@
+import pathlib
+import sys
+
+import numpy as np
+
+sys.path.append(f"{pathlib.Path(__file__).absolute().parent.parent.resolve()}/common")
+
+from detections import DETECTION_DTYPE
+from frame_processor import FrameProcessingResult
+from tracker import CameraTrackers
+
+
+def make_result(captured_at: float, is_inferred: bool) -> FrameProcessingResult:
+    detections = np.zeros(1, dtype=DETECTION_DTYPE)
+    detections["box"] = [10, 10, 50, 50]
+    detections["score"] = 0.9
+    return FrameProcessingResult(
+        correlation_id="camera-0-frame-0",
+        sequence=0,
+        detections=detections,
+        inference_time=0.0,
+        frame_size=(416, 416),
+        is_inferred=is_inferred,
+        captured_at=captured_at,
+    )
+
+
+def test_static_scene_keeps_tracks_between_inferences():
+    # inference every motion_max_staleness (2 s), reused detections in between
+    trackers = CameraTrackers(min_iou=0.3, max_age=1.0)
+    track_ids = []
+    for captured_at in np.arange(0.0, 6.01, 0.2):
+        is_inferred = round(captured_at, 1) % 2.0 == 0.0
+        tracks = trackers.update(make_result(float(captured_at), is_inferred))
+        assert len(tracks) == 1, f"no track at {captured_at:.1f}s"
+        assert np.allclose(tracks["box"], [10, 10, 50, 50])
+        track_ids.append(int(tracks["track_id"][0]))
+    assert set(track_ids) == {1}
+
+
+def test_tracks_expire_without_detections():
+    trackers = CameraTrackers(min_iou=0.3, max_age=1.0)
+    trackers.update(make_result(0.0, is_inferred=True))
+    empty = make_result(1.5, is_inferred=True)
+    empty.detections = np.zeros(0, dtype=DETECTION_DTYPE)
+    assert len(trackers.update(empty)) == 0
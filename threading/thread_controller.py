@@ -1,11 +1,17 @@
 """This module is used to provide the thread controller."""
 
 import logging
+import os
+import queue
 import threading
 from thread_queue import ThreadQueue
+from queue_policy import POLICY_FAIR_SHARE, POLICY_LATEST_ONLY
 
 import frame_provider
-from frame_processor import FrameProcessor
+from detection_publisher import DetectionPublisher
+from frame_processor import FrameProcessor, FrameProcessingResult
+from result_collector import ResultCollector
+from tracker import CameraTrackers
 
 
 class ThreadController:
@@ -18,8 +24,35 @@ class ThreadController:
         Initialize the thread controller.
         """
         self.queue = ThreadQueue()
+        # video sources, one camera each, all feeding the same workers
+        self.camera_sources = frame_provider.DEFAULT_SOURCES
+        # overflow policy of the frame queue, see queue_policy, None to serve the cameras in
+        # turn when there are several, picked on start from camera_sources
+        self.queue_policy = None
+        self.queue_capacity = 1
+        self.result_queue = None
         self.thread_one = None
-        self.thread_two = None
+        # pool of FrameProcessor workers, all fed from the same queue
+        self.thread_two_pool = []
+        self.thread_two_count = 2
+        # frames inferred at once by every worker, see FrameProcessor.batch_size
+        self.batch_size = 1
+        # frames are only produced when a worker is ready to take them, False to produce frames
+        # at the configured rate
+        self.queue_backpressure = True
+        # max credits of the queue, None for one per frame of the batch of every worker, so that
+        # every worker can fill its batch
+        self.queue_max_credits = None
+        # deliver results in capture order, or out of order within the reorder window
+        self.ordered_results = True
+        self.max_reorder_window = self.thread_two_count
+        # detections of every result are overlaid on the frames of the UI
+        self.detection_publisher = DetectionPublisher()
+        # stable ids and velocities of the detected objects, the UI extrapolates their boxes
+        # to the frames between inferences
+        self.trackers = CameraTrackers(min_iou=0.3, max_age=1.0)
+        self.result_collector = None
+        self.result_collector_thread = None
         self.logger = logging.getLogger(__name__)
 
     def start(self) -> bool:
@@ -32,28 +65,64 @@ class ThreadController:
         if self.thread_one is not None and self.thread_one.is_alive():
             self.logger.info("thread_one is already running...")
             return False
-        if self.thread_two is not None and self.thread_two.is_alive():
+        if any(thread.is_alive() for thread in self.thread_two_pool):
             self.logger.info("thread_two is already running...")
             return False
 
-        # Creating empty queue
-        self.queue = ThreadQueue()
+        # Creating empty queues, sized for the cameras configured by now
+        source_count = len(self.camera_sources)
+        in_flight_count = self.thread_two_count * self.batch_size
+        max_credits = None
+        if self.queue_backpressure:
+            max_credits = self.queue_max_credits if self.queue_max_credits is not None else in_flight_count
+        queue_policy = self.queue_policy
+        if queue_policy is None:
+            queue_policy = POLICY_FAIR_SHARE if source_count > 1 else POLICY_LATEST_ONLY
+        self.queue = ThreadQueue(
+            policy=queue_policy,
+            capacity=self.queue_capacity,
+            source_count=source_count,
+            max_credits=max_credits,
+        )
+        self.result_queue = queue.Queue()
 
         # Creating thread one
         self.thread_one = threading.Thread(
-            target=frame_provider.run, args=((self.queue),), name="ThreadOne",
+            target=frame_provider.run, args=(self.queue, self.camera_sources), name="ThreadOne",
         )
         # Starting thread one as a daemon thread
         self.thread_one.setDaemon(True)
         self.thread_one.start()
 
-        # Creating thread two
-        self.thread_two = threading.Thread(
-            target=FrameProcessor().run, args=((self.queue),), name="ThreadTwo",
+        # Creating thread two pool, splitting the cores between the workers
+        intra_op_num_threads = max(1, (os.cpu_count() or 1) // self.thread_two_count)
+        self.thread_two_pool = []
+        for index in range(self.thread_two_count):
+            frame_processor = FrameProcessor(intra_op_num_threads=intra_op_num_threads)
+            frame_processor.batch_size = self.batch_size
+            thread_two = threading.Thread(
+                target=frame_processor.run,
+                args=(self.queue, self.result_queue),
+                name=f"ThreadTwo-{index}",
+            )
+            # Starting thread two as a daemon thread
+            thread_two.setDaemon(True)
+            thread_two.start()
+            self.thread_two_pool.append(thread_two)
+
+        # Collecting results of the thread two pool
+        self.result_collector = ResultCollector(
+            on_result=self._on_result,
+            ordered=self.ordered_results,
+            max_reorder_window=self.max_reorder_window,
         )
-        # Starting thread two as a daemon thread
-        self.thread_two.setDaemon(True)
-        self.thread_two.start()
+        self.result_collector_thread = threading.Thread(
+            target=self.result_collector.run,
+            args=(self.result_queue, self.queue),
+            name="ResultCollector",
+            daemon=True,
+        )
+        self.result_collector_thread.start()
         self.logger.info("Started all threads...")
         return True
 
@@ -68,14 +137,19 @@ class ThreadController:
             self._terminate_thread(self.thread_one)
             self.thread_one = None
             self.logger.info("thread_one is stopped...")
-        if self.thread_two is not None and self.thread_two.is_alive():
-            self._terminate_thread(self.thread_two)
-            self.thread_two = None
-            self.logger.info("thread_two is stopped...")
+        for thread_two in self.thread_two_pool:
+            if thread_two.is_alive():
+                self._terminate_thread(thread_two)
+                self.logger.info(f"{thread_two.name} is stopped...")
+        self.thread_two_pool = []
+        if self.result_collector is not None:
+            self.result_collector.stop()
+            self.result_collector = None
 
         # Empty queue
-        # self.queue.work_queue.close()
-        # self.logger.info("Queue is cleared...")
+        self.logger.info(f"Queue stats: {self.queue.stats()}")
+        self.queue.clear()
+        self.logger.info("Queue is cleared...")
         self.logger.info("Stopped all threads...")
         return True
 
@@ -91,6 +165,23 @@ class ThreadController:
         self.logger.info("Restarted all threads...")
         return result
 
+    def _on_result(self, result: FrameProcessingResult) -> None:
+        """
+        Handle a result of the thread two pool, delivered in the configured order.
+
+        @param
+            result (FrameProcessingResult): Result of the frame processing
+        """
+        self.logger.info(
+            f"Result for {result.correlation_id} of camera {result.camera_id}: "
+            f"{len(result.boxes)} detections ({'inferred' if result.is_inferred else 'reused'}), "
+            f"time taken for inference: {result.inference_time}, "
+            f"time spent in queue: {result.queue_dwell_time}"
+        )
+        tracks = self.trackers.update(result)
+        self.logger.debug(f"Tracked objects of camera {result.camera_id}: {len(tracks)}")
+        self.detection_publisher.publish(result, tracks)
+
     def _terminate_thread(self, thread: threading.Thread, retry_count: int = 0) -> None:
         """
         Terminate the thread with retry (internal).
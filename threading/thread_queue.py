@@ -1,61 +1,237 @@
 """This module is used to provide thread queue for communication between threads."""
-import queue
+import collections
 import threading
-from typing import Any
+import time
+from typing import Any, List, Optional, Tuple
+
+from queue_policy import (
+    DEQUEUED_LOG_SIZE,
+    POLICY_FAIR_SHARE,
+    POLICY_DROP_NEWEST,
+    POLICY_LATEST_ONLY,
+    STAT_COUNT,
+    STAT_DEQUEUED,
+    STAT_DROPPED,
+    STAT_ENQUEUED,
+    STAT_STALE,
+    STAT_THROTTLED,
+    QueueStats,
+    channel_capacity,
+    smooth_latency,
+    source_of,
+)
 
 
 class ThreadQueue:
     """
     Thread queue for communication between threads.
+
+    Items are held in one channel, or one channel per source with POLICY_FAIR_SHARE, guarded
+    by a condition that wakes up a waiting reader as soon as an item is added.
     """
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        policy: str = POLICY_LATEST_ONLY,
+        capacity: int = 1,
+        source_count: int = 1,
+        max_credits: Optional[int] = None,
+    ) -> None:
         """
-        Initialize the thread queue, with max length of 1.
+        Initialize the thread queue, by default keeping only the newest item.
+
+        @param:
+            policy (str): Overflow policy, see queue_policy
+            capacity (int): Max items, per source for POLICY_FAIR_SHARE
+            source_count (int): Number of sources served in turn by POLICY_FAIR_SHARE
+            max_credits (int): Max items readers can be ready to take at once, the writer only
+                produces an item when it gets a credit, None to disable the backpressure
         """
-        self.maxlen = 1
-        self.work_queue = queue.Queue(maxsize=self.maxlen)
+        # moving average of the seconds readers take to process a batch
+        self.latency = 0.0
+        self.policy = policy
+        self.max_credits = max_credits
+        # items the readers are ready to take, granted by readers and spent by the writer
+        self.credits = 0
+        self.maxlen = channel_capacity(policy, capacity)
+        channel_count = source_count if policy == POLICY_FAIR_SHARE else 1
+        self.channels = [collections.deque() for _ in range(channel_count)]
+        self.counters = [0] * STAT_COUNT
+        # next channel to serve with POLICY_FAIR_SHARE
+        self.cursor = 0
+        # sequences of the last items taken by readers, and how many were ever logged
+        self.dequeued_log = collections.deque(maxlen=DEQUEUED_LOG_SIZE)
+        self.dequeued_total = 0
         self.locker = threading.Lock()
-        self.locker_timeout = 0.5
-        self.get_timeout = 0.5
-        self.put_timeout = 0.5
+        self.available = threading.Condition(self.locker)
 
-    def add_item(self, item: Any) -> bool:
+    def grant_credits(self, count: int) -> None:
         """
-        Add item to the queue and lock the queue during adding.
+        Signal that a reader is ready to take items, called by the readers.
 
         @param:
-            item (Any): item object to be added to the queue
+            count (int): Number of items the reader is ready to take
+        """
+        if self.max_credits is None:
+            return
+        with self.locker:
+            self.credits = min(self.max_credits, self.credits + count)
+
+    def has_credit(self) -> bool:
+        """
+        Check that a credit is free without spending it, called by the writer before paying
+        for an item it may skip. A missing credit counts as a throttled item.
+
         @return:
-            is_added (bool): True if the item is added, False otherwise
-        """
-        # multiprocessing.Lock can handle maximum processes matching the number of cores
-        if self.locker.acquire(timeout=self.locker_timeout):
-            self.clear()
-            try:
-                self.work_queue.put(item, timeout=self.put_timeout)
-            except Exception:
-                self.locker.release()
-                return False
-            self.locker.release()
+            has_credit (bool): True if a reader is ready to take an item, False to skip it
+        """
+        if self.max_credits is None:
             return True
-        else:
+        with self.locker:
+            if self.credits > 0:
+                return True
+            self.counters[STAT_THROTTLED] += 1
             return False
 
+    def try_acquire_credit(self) -> bool:
+        """
+        Spend a credit before producing an item, called by the writer. Never waits.
+
+        @return:
+            has_credit (bool): True if a reader is ready to take the item, False to skip it
+        """
+        if self.max_credits is None:
+            return True
+        with self.locker:
+            if self.credits > 0:
+                self.credits -= 1
+                return True
+            self.counters[STAT_THROTTLED] += 1
+            return False
+
+    def report_latency(self, latency: float) -> None:
+        """
+        Report the seconds a reader took to process a batch, called by the readers.
+
+        @param:
+            latency (float): Processing time of the batch
+        """
+        with self.locker:
+            self.latency = smooth_latency(self.latency, latency)
+
+    def add_item(self, item: Any) -> bool:
+        """
+        Add item to the queue, applying the overflow policy when full. Never waits for room.
+
+        @param:
+            item (Any): item object to be added to the queue
+        @return:
+            is_added (bool): True if the item is added, False if it was dropped
+        """
+        item.enqueued_at = time.time()
+        with self.available:
+            channel = self.channels[source_of(item) % len(self.channels)]
+            if len(channel) >= self.maxlen:
+                if self.policy == POLICY_DROP_NEWEST:
+                    self.counters[STAT_DROPPED] += 1
+                    return False
+                channel.popleft()
+                self.counters[STAT_STALE] += 1
+            channel.append(item)
+            self.counters[STAT_ENQUEUED] += 1
+            self.available.notify()
+        return True
+
     def get_item(self) -> Any:
         """
-        Get item from the queue.
+        Get item from the queue, without waiting.
 
         @return:
+            item (Any): item object from the queue, None if the queue is empty
+        """
+        return self.wait_for_item(timeout=0)
+
+    def wait_for_item(self, timeout: Optional[float]) -> Any:
+        """
+        Wait for the next item, returning as soon as one is added.
+
+        Several readers can wait at once, every item is handed to only one of them.
+
+        @param:
+            timeout (float): max seconds to wait, 0 to not wait, None to wait forever
+        @return:
+            item (Any): item object from the queue, None if no item was added in time
+        """
+        with self.available:
+            if not self.available.wait_for(lambda: not self._is_empty(), timeout=timeout):
+                return None
+            channel_count = len(self.channels)
+            for offset in range(channel_count):
+                index = (self.cursor + offset) % channel_count
+                if self.channels[index]:
+                    self.cursor = (index + 1) % channel_count
+                    item = self.channels[index].popleft()
+                    break
+            self.counters[STAT_DEQUEUED] += 1
+            self.dequeued_log.append(item.sequence)
+            self.dequeued_total += 1
+        item.dequeued_at = time.time()
+        return item
+
+    def dequeued_since(self, cursor: int) -> Tuple[List[int], int]:
+        """
+        Get the sequences of the items handed to readers since a previous call, see
+        ProcessQueue.dequeued_since.
+
+        @param:
+            cursor (int): Cursor returned by the previous call, 0 for the first call
+        @return:
+            sequences (List[int]): Sequences of the items taken since
+            cursor (int): Cursor for the next call
+        """
+        with self.locker:
+            count = min(self.dequeued_total - cursor, len(self.dequeued_log))
+            sequences = list(self.dequeued_log)[len(self.dequeued_log) - count:]
+            return sequences, self.dequeued_total
+
+    def is_frame_intact(self, item: Any) -> bool:
+        """
+        Check that the frame of a taken item was not overwritten while in use, see
+        ProcessQueue.is_frame_intact.
+
+        @param:
             item (Any): item object from the queue
+        @return:
+            is_intact (bool): Always True, the items own their frames
+        """
+        return True
+
+    def stats(self) -> QueueStats:
+        """
+        Get a snapshot of the queue counters.
+
+        @return:
+            stats (QueueStats): Counters of the queue
+        """
+        with self.locker:
+            return QueueStats(
+                enqueued=self.counters[STAT_ENQUEUED],
+                dropped=self.counters[STAT_DROPPED],
+                stale=self.counters[STAT_STALE],
+                dequeued=self.counters[STAT_DEQUEUED],
+                size=sum(len(channel) for channel in self.channels),
+                throttled=self.counters[STAT_THROTTLED],
+                latency=self.latency,
+            )
+
+    def _is_empty(self) -> bool:
+        """
+        Check if the queue is empty, called with the lock held (internal).
+
+        @return:
+            is_empty (bool): True if the queue is empty, False otherwise
         """
-        if not self.is_empty():
-            if self.locker.acquire(timeout=self.locker_timeout):
-                item = self.work_queue.get(timeout=self.get_timeout)
-                self.work_queue.task_done()
-                self.locker.release()
-                return item
-        return None
+        return not any(self.channels)
 
     def is_empty(self) -> bool:
         """
@@ -64,14 +240,14 @@ class ThreadQueue:
         @return:
             is_empty (bool): True if the queue is empty, False otherwise
         """
-        return self.work_queue.empty()
+        with self.locker:
+            return self._is_empty()
 
     def clear(self) -> None:
         """
         Clear the queue.
         """
-        while not self.is_empty():
-            try:
-                self.work_queue.get(block=False)
-            except Exception as ex:
-                print(ex)
+        with self.locker:
+            for channel in self.channels:
+                self.counters[STAT_STALE] += len(channel)
+                channel.clear()
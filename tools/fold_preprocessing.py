@@ -0,0 +1,81 @@
+"""
+Rewrite tiny-yolov3 into a variant that takes uint8 NHWC input.
+
+Cast, Div and Transpose nodes are added in front of the graph, so the float conversion,
+normalization and layout change run inside the optimized onnxruntime graph instead of Python.
+
+Usage: python fold_preprocessing.py [input_model] [output_model]
+"""
+import sys
+import pathlib
+
+import numpy as np
+import onnx
+from onnx import helper, numpy_helper, TensorProto
+
+MODEL_DIR = pathlib.Path(__file__).absolute().parent.parent.resolve() / "common"
+DEFAULT_INPUT_MODEL = MODEL_DIR / "tiny-yolov3-11.onnx"
+DEFAULT_OUTPUT_MODEL = MODEL_DIR / "tiny-yolov3-11.uint8.onnx"
+
+
+def fold_preprocessing(model: onnx.ModelProto, input_name: str = "input_1") -> onnx.ModelProto:
+    """
+    Replace the float NCHW image input with an uint8 NHWC input of the same name.
+
+    @param
+        model (onnx.ModelProto): Model taking a normalized float32 NCHW image
+        input_name (str): Name of the image input
+    @return
+        model (onnx.ModelProto): Model taking an uint8 NHWC image
+    """
+    graph = model.graph
+    image_input = next(i for i in graph.input if i.name == input_name)
+    nchw_name = f"{input_name}_nchw"
+
+    # Rewire the original consumers to the output of the new preprocessing nodes
+    for node in graph.node:
+        for index, name in enumerate(node.input):
+            if name == input_name:
+                node.input[index] = nchw_name
+
+    batch, channels, height, width = [
+        dim.dim_param or dim.dim_value for dim in image_input.type.tensor_type.shape.dim
+    ]
+    graph.input.remove(image_input)
+    graph.input.insert(
+        0,
+        helper.make_tensor_value_info(
+            input_name, TensorProto.UINT8, [batch, height, width, channels]
+        ),
+    )
+    graph.initializer.append(
+        numpy_helper.from_array(np.array(255.0, dtype=np.float32), f"{input_name}_scale")
+    )
+    preprocessing = [
+        helper.make_node(
+            "Cast", [input_name], [f"{input_name}_float"], to=TensorProto.FLOAT
+        ),
+        helper.make_node(
+            "Div", [f"{input_name}_float", f"{input_name}_scale"], [f"{input_name}_normalized"]
+        ),
+        helper.make_node(
+            "Transpose", [f"{input_name}_normalized"], [nchw_name], perm=[0, 3, 1, 2]
+        ),
+    ]
+    for node in reversed(preprocessing):
+        graph.node.insert(0, node)
+
+    onnx.checker.check_model(model)
+    return model
+
+
+def main() -> None:
+    input_model = sys.argv[1] if len(sys.argv) > 1 else str(DEFAULT_INPUT_MODEL)
+    output_model = sys.argv[2] if len(sys.argv) > 2 else str(DEFAULT_OUTPUT_MODEL)
+    model = fold_preprocessing(onnx.load(input_model))
+    onnx.save(model, output_model)
+    print(f"Saved uint8 NHWC model to {output_model}")
+
+
+if __name__ == "__main__":
+    main()